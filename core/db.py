@@ -0,0 +1,122 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework import permissions
+
+_routing = ContextVar('db_routing', default=None)
+
+
+class RoutingState:
+    """Where the current request reads from, and whether it has written yet."""
+
+    def __init__(self):
+        self.read_alias = None
+        self.wrote = False
+
+
+@contextmanager
+def routing_scope():
+    """
+    Track reads and writes of one unit of work, such as a request. Outside
+    a scope every query goes to the primary.
+    """
+    state = RoutingState()
+    token = _routing.set(state)
+    try:
+        yield state
+    finally:
+        _routing.reset(token)
+
+
+def read_alias():
+    """The database alias catalog reads may be served from, or None to read the primary."""
+    return getattr(settings, 'DATABASE_READ_ALIAS', None)
+
+
+def stickiness():
+    return getattr(settings, 'DATABASE_READ_STICKINESS', 5)
+
+
+def pin_key(user):
+    return f'db:primary:{user.pk}'
+
+
+def pin_to_primary(user):
+    """Keep `user`'s reads on the primary for DATABASE_READ_STICKINESS seconds."""
+    if read_alias() and stickiness() and user is not None and user.is_authenticated:
+        cache.set(pin_key(user), True, stickiness())
+
+
+def pinned_to_primary(user):
+    return user is not None and user.is_authenticated and bool(cache.get(pin_key(user)))
+
+
+def use_read_replica(user=None):
+    """
+    Send the rest of the current scope's reads to the read alias, unless it
+    has already written or `user` wrote within the stickiness window.
+    """
+    state = _routing.get()
+    alias = read_alias()
+    if state is None or alias is None or state.wrote or pinned_to_primary(user):
+        return False
+    state.read_alias = alias
+    return True
+
+
+class ReadReplicaRouter:
+    """
+    Route reads to the alias chosen by use_read_replica() and everything
+    else to the primary. The first write of a scope moves its later reads
+    back to the primary, so a request always reads what it wrote.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _routing.get()
+        if state is not None and state.read_alias and not state.wrote:
+            return state.read_alias
+        return None
+
+    def db_for_write(self, model, **hints):
+        state = _routing.get()
+        if state is not None:
+            state.wrote = True
+        # Explicitly, so rows read from the replica are saved to the primary.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {DEFAULT_DB_ALIAS, read_alias()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+
+class ReadReplicaMiddleware:
+    """
+    Open a routing scope per request. When the request wrote, its user's
+    reads stay on the primary for DATABASE_READ_STICKINESS seconds so the
+    next requests see the write before the replica catches up.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with routing_scope() as state:
+            response = self.get_response(request)
+        if state.wrote:
+            pin_to_primary(getattr(request, 'user', None))
+        return response
+
+
+class ReadReplicaMixin:
+    """Serve the safe-method requests of a viewset from DATABASE_READ_ALIAS."""
+
+    def initial(self, request, *args, **kwargs):
+        # Authentication and permission checks above still read the primary.
+        super().initial(request, *args, **kwargs)
+        if request.method in permissions.SAFE_METHODS:
+            use_read_replica(request.user)
@@ -0,0 +1,151 @@
+import json
+from base64 import b64decode, b64encode
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.db.models import Q
+from django.utils.encoding import force_str
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Keyset ("seek") pagination that follows whatever ordering the filter
+    backends left on the queryset and breaks ties on the primary key.
+
+    The cursor stores the full sort key of the last row, so every page is a
+    single `WHERE (sort key) > (cursor) ORDER BY ... LIMIT n` query and deep
+    pages cost the same as the first one. Ordering fields must be non-null
+    model fields or annotations.
+
+    Passing `?offset=` or `?limit=` opts into classic limit/offset pages.
+    """
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = 'pk'
+
+    offset_pagination_class = LimitOffsetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.offset_paginator = None
+        params = request.query_params
+        if self.offset_pagination_class and (
+            self.offset_pagination_class.offset_query_param in params
+            or self.offset_pagination_class.limit_query_param in params
+        ):
+            self.offset_paginator = self.offset_pagination_class()
+            return self.offset_paginator.paginate_queryset(queryset, request, view)
+
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.keys = self.get_sort_keys(queryset)
+        self.pk_name = queryset.model._meta.pk.attname
+        reverse, position = self.decode_cursor(request)
+        self.has_cursor = position is not None
+
+        order_by = [self._order_term(name, desc != reverse) for name, desc in self.keys]
+        if position is not None:
+            queryset = queryset.filter(self.seek(position, reverse))
+        rows = list(queryset.order_by(*order_by)[:self.page_size + 1])
+
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = self.has_cursor, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.has_cursor
+        return self.page
+
+    def get_paginated_response(self, data):
+        if self.offset_paginator is not None:
+            return self.offset_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_sort_keys(self, queryset):
+        """[(field, descending), ...] from the queryset ordering, ending on pk."""
+        ordering = [
+            term for term in (queryset.query.order_by or queryset.model._meta.ordering)
+            if isinstance(term, str) and term != '?'
+        ] or [self.ordering]
+        keys = [(term.lstrip('-'), term.startswith('-')) for term in ordering]
+        keys = [('pk' if name == 'id' else name, desc) for name, desc in keys]
+        if keys[-1][0] != 'pk':
+            # Ties run in the same direction as the leading key so a single
+            # index on that key (which implicitly ends in the pk) serves the scan.
+            keys.append(('pk', keys[0][1]))
+        return keys
+
+    @staticmethod
+    def _order_term(name, descending):
+        return f'-{name}' if descending else name
+
+    def seek(self, position, reverse):
+        """Rows strictly after `position` in the (possibly reversed) ordering."""
+        condition = Q()
+        equal = {}
+        for (name, desc), value in zip(self.keys, position):
+            lookup = 'lt' if desc != reverse else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def get_position(self, row):
+        values = []
+        for name, _ in self.keys:
+            if isinstance(row, dict):
+                value = row[self.pk_name if name == 'pk' else name]
+            else:
+                value = getattr(row, name)
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = str(value)
+            values.append(value)
+        return values
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return False, None
+        try:
+            cursor = json.loads(b64decode(encoded.encode('ascii')).decode('utf-8'))
+            reverse, ordering, position = bool(cursor['r']), cursor['o'], cursor['p']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if ordering != [self._order_term(name, desc) for name, desc in self.keys] \
+                or len(position) != len(self.keys):
+            raise NotFound(self.invalid_cursor_message)
+        return reverse, position
+
+    def encode_cursor(self, reverse, position):
+        cursor = {
+            'r': int(reverse),
+            'o': [self._order_term(name, desc) for name, desc in self.keys],
+            'p': position,
+        }
+        encoded = force_str(b64encode(json.dumps(cursor, separators=(',', ':')).encode('utf-8')))
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(False, self.get_position(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(True, self.get_position(self.page[0]))
+
+    def get_html_context(self):
+        if self.offset_paginator is not None:
+            return self.offset_paginator.get_html_context()
+        return super().get_html_context()
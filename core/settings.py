@@ -34,6 +34,7 @@ ALLOWED_HOSTS = ["*"]
 
 INSTALLED_APPS = [
     'unfold',
+    'unfold.contrib.filters',
     'django.contrib.admin',
     'django.contrib.auth',
     'django.contrib.contenttypes',
@@ -60,6 +61,8 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
     # 'DEFAULT_THROTTLE_RATES': {
     #     'review': '6/minute',  # 1 request per 10 seconds
     # }
@@ -91,6 +94,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.db.ReadReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -122,9 +126,55 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Take the write lock when a transaction starts and wait for it, so
+        # concurrent checkouts queue up instead of failing with "database is
+        # locked" when a reader tries to upgrade to a writer.
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # A file rather than shared-cache memory, which has no busy timeout
+        # and would make the concurrency tests fail on table locks.
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
+    },
+    # Read replica of `default`. Only used once DATABASE_READ_ALIAS names it;
+    # to try it locally, copy db.sqlite3 to replica.sqlite3 (or point both
+    # aliases at a Postgres primary and its standby).
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'replica.sqlite3',
+        'TEST': {
+            'NAME': BASE_DIR / 'test_replica.sqlite3',
+        },
+    },
+}
+
+# Safe-method requests on the catalog viewsets read from this alias; None
+# reads everything from the primary. See core.db.
+DATABASE_ROUTERS = ['core.db.ReadReplicaRouter']
+DATABASE_READ_ALIAS = None
+# Seconds a user's reads stay on the primary after they write, covering
+# replication lag so they see their own changes.
+DATABASE_READ_STICKINESS = 5
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory is per process; point this at Redis or Memcached when running
+# several workers so the catalog cache and its version key are shared.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'localmarket',
     }
 }
 
+# Seconds a cached catalog response may live; 0 disables the catalog cache.
+CATALOG_CACHE_TIMEOUT = 300
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -180,4 +230,25 @@ UNFOLD = {
     "SITE_TITLE": "LocalMarket",
     "WELCOME_SIGN": "Welcome to LocalMarket admin",
     "COPYRIGHT": "LocalMarket © 2025",
-}
\ No newline at end of file
+}
+
+# Product search: dotted path to a product.search.BaseSearchEngine subclass.
+# Left unset, SQLite uses the FTS5 index and other databases fall back to LIKE.
+PRODUCT_SEARCH_ENGINE = None
+# `?search=` returns at most this many products: the best ranked of those
+# that pass the request's other filters.
+PRODUCT_SEARCH_MAX_RESULTS = 1000
+
+# Derivatives generated for every uploaded product image and banner:
+# {name: longest edge in px}. See product.images.
+IMAGE_DERIVATIVE_SIZES = {'small': 160, 'medium': 480, 'large': 960}
+IMAGE_DERIVATIVE_FORMAT = 'WEBP'
+# Background threads rendering derivatives after upload; 0 renders inline.
+IMAGE_DERIVATIVE_WORKERS = 2
+
+# Seconds an anonymous shopper's cache-backed cart survives its last change.
+GUEST_CART_TTL = 7 * 24 * 60 * 60
+
+# Seconds the sales rollup watermark trails the clock, so orders still being
+# committed when refresh_sales_rollups runs are picked up on the next run.
+SALES_ROLLUP_LAG = 60
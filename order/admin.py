@@ -1,5 +1,7 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 from unfold.admin import ModelAdmin as UnfoldAdmin
+from product.stock import InsufficientStock, shortages, stock_delta
 from .models import *
 
 class UnfoldTranslationAdmin(UnfoldAdmin):
@@ -13,21 +15,68 @@ class UnfoldTranslationAdmin(UnfoldAdmin):
             'screen': ('modeltranslation/css/tabbed_translation_fields.css',),
         }
 
+class OrderItemFormSet(forms.BaseInlineFormSet):
+    def clean(self):
+        super().clean()
+        order = self.instance
+        if not order.stock_reserved or order.status == 'cancelled':
+            return
+        # Lines of an order holding stock reserve their edits (OrderItem.save).
+        before, after = [], []
+        for form in self.forms:
+            if not hasattr(form, 'cleaned_data') or not form.has_changed():
+                continue
+            if form.instance.pk is not None:
+                before.append((form.initial.get('product'), form.initial.get('quantity', 0)))
+            product, quantity = form.cleaned_data.get('product'), form.cleaned_data.get('quantity')
+            if product is not None and quantity and not self._should_delete_form(form):
+                after.append((product.pk, quantity))
+        grown = [(pk, quantity) for pk, quantity in stock_delta(before, after).items() if quantity > 0]
+        short = shortages(grown)
+        if short:
+            raise forms.ValidationError(f"Not enough stock for products {short}.")
+
+
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
+    formset = OrderItemFormSet
     extra = 0
     readonly_fields = ("total_price",)
     fields = ("product", "quantity", "total_price")
+    autocomplete_fields = ("product",)
+
+class OrderAdminForm(forms.ModelForm):
+    def clean(self):
+        cleaned = super().clean()
+        # self.instance still holds the stored status until the form is applied.
+        self.reopening = (
+            self.instance.pk is not None and self.instance.status == 'cancelled'
+            and cleaned.get('status', 'cancelled') != 'cancelled'
+        )
+        if self.reopening:
+            short = shortages(self.instance.items.values_list('product_id', 'quantity'))
+            if short:
+                self.add_error('status', f"Cannot reopen the order, not enough stock for products {short}.")
+        return cleaned
+
 
 @admin.register(Order)
 class OrderAdmin(UnfoldAdmin):
-    list_display = ("id", "user", "status", "created_at", "overall_price_display")
+    form = OrderAdminForm
+    list_display = ("id", "user", "status", "created_at", "item_count", "overall_price")
     list_filter = ("status", "created_at")
+    list_select_related = ("user",)
+    autocomplete_fields = ("user",)
     search_fields = ("user__username", "first_name", "last_name", "phone", "address")
     inlines = [OrderItemInline]
-    readonly_fields = ("created_at",)
-
-    def overall_price_display(self, obj):
-        return obj.overall_price
-    overall_price_display.short_description = "Total"
+    readonly_fields = ("created_at", "item_count", "overall_price")
 
+    def save_model(self, request, obj, form, change):
+        if getattr(form, 'reopening', False):
+            try:
+                obj.reserve_items()
+            except InsufficientStock as exc:
+                # Sold out between validating the form and saving it.
+                obj.status = 'cancelled'
+                self.message_user(request, f"The order stays cancelled: {exc}", messages.ERROR)
+        super().save_model(request, obj, form, change)
@@ -0,0 +1,158 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from product.pricing import CENT
+from .models import DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem, RollupWatermark
+
+WATERMARK = 'sales'
+ROLLUPS = [
+    # (model, grouping column, OrderItem lookup it is read from)
+    (DailySales, None, None),
+    (DailyProductSales, 'product_id', 'product'),
+    (DailyCategorySales, 'category_id', 'product__category'),
+]
+
+
+def order_day(lookup='created_at'):
+    """The local calendar day of an order timestamp; orders are counted on the day they were placed."""
+    return TruncDate(lookup, tzinfo=timezone.get_current_timezone())
+
+
+def rebuild_days(days):
+    """
+    Recompute every rollup row of `days` from the order lines and replace
+    what was stored, so rebuilding a day is always safe to repeat.
+    Cancelled orders are left out.
+    """
+    days = sorted(set(days))
+    if not days:
+        return 0
+    lines = (
+        OrderItem.objects.exclude(order__status='cancelled')
+        .annotate(day=order_day('order__created_at'))
+        .filter(day__in=days)
+        .order_by()
+    )
+    totals = {
+        'units': Sum('quantity'),
+        'revenue': Sum('total_price'),
+        'order_count': Count('order', distinct=True),
+    }
+    with transaction.atomic():
+        for model, column, lookup in ROLLUPS:
+            model.objects.filter(day__in=days).delete()
+            rows = lines.values('day', **({'key': F(lookup)} if column else {})).annotate(**totals)
+            model.objects.bulk_create(
+                model(day=row['day'], **({column: row['key']} if column else {}), units=row['units'],
+                      revenue=row['revenue'], order_count=row['order_count'])
+                for row in rows
+            )
+    return len(days)
+
+
+class PendingRebuild:
+    """Days queued for rebuilding when one transaction commits."""
+
+    def __init__(self):
+        self.days = set()
+
+    def __call__(self):
+        rebuild_days(self.days)
+
+
+def rebuild_days_on_commit(days):
+    """
+    Rebuild `days` once the current transaction commits. Days queued by
+    several calls in one transaction, such as the orders of a bulk delete,
+    are rebuilt together.
+    """
+    connection = transaction.get_connection()
+    pending = getattr(connection, 'pending_rollup_rebuild', None)
+    # Committing or rolling back drops the callback; start a new batch then.
+    if pending is not None and any(callback is pending for _, callback, _ in connection.run_on_commit):
+        pending.days.update(days)
+        return
+    pending = connection.pending_rollup_rebuild = PendingRebuild()
+    pending.days.update(days)
+    transaction.on_commit(pending)
+
+
+def rollup_lag():
+    """
+    How far behind the clock the watermark stays, in seconds, so orders whose
+    transaction started before a run but commits after it are not skipped.
+    """
+    return getattr(settings, 'SALES_ROLLUP_LAG', 60)
+
+
+def refresh_rollups(full=False, now=None):
+    """
+    Bring the rollups up to date with the orders written since the last run.
+
+    Only the days of orders updated after the watermark are rebuilt; the
+    watermark then moves up to `now` minus rollup_lag(). The first run, or
+    `full=True`, rebuilds every day. Returns the number of days rebuilt.
+    """
+    upto = (now or timezone.now()) - timedelta(seconds=rollup_lag())
+    with transaction.atomic():
+        mark, created = RollupWatermark.objects.select_for_update().get_or_create(
+            name=WATERMARK, defaults={'value': upto}
+        )
+        orders = Order.objects.all()
+        if full or created:
+            for model, _, _ in ROLLUPS:
+                model.objects.all().delete()
+        else:
+            orders = orders.filter(updated_at__gt=mark.value, updated_at__lte=upto)
+        days = orders.annotate(day=order_day()).order_by().values_list('day', flat=True).distinct()
+        rebuilt = rebuild_days(days)
+        mark.value = max(mark.value, upto)
+        mark.save(update_fields=['value'])
+    return rebuilt
+
+
+def rollups_as_of():
+    return RollupWatermark.objects.filter(name=WATERMARK).values_list('value', flat=True).first()
+
+
+def _totals(rows):
+    return rows.aggregate(units=Sum('units'), revenue=Sum('revenue'), order_count=Sum('order_count'))
+
+
+def _money(row):
+    row['units'] = row['units'] or 0
+    row['order_count'] = row['order_count'] or 0
+    row['revenue'] = str((row['revenue'] or 0).quantize(CENT))
+    return row
+
+
+def sales_report(start, end, by='day', limit=50):
+    """
+    Units, revenue and orders between `start` and `end` (inclusive days),
+    answered from the rollup tables only. `by` is 'day', 'product' or
+    'category'; product and category rows are the `limit` best by revenue.
+    """
+    days = {'day__range': (start, end)}
+    report = {
+        'start': start, 'end': end, 'by': by, 'as_of': rollups_as_of(),
+        'totals': _money(_totals(DailySales.objects.filter(**days))),
+    }
+    if by == 'day':
+        rows = DailySales.objects.filter(**days).order_by('day').values('day', 'units', 'revenue', 'order_count')
+    else:
+        model, key, name = {
+            'product': (DailyProductSales, 'product', 'product__name'),
+            'category': (DailyCategorySales, 'category', 'category__name'),
+        }[by]
+        rows = (
+            model.objects.filter(**days).values(key, name=F(name))
+            .annotate(units=Sum('units'), revenue=Sum('revenue'), order_count=Sum('order_count'))
+            .order_by('-revenue', key)[:limit]
+        )
+    report['results'] = [_money(row) for row in rows]
+    return report
@@ -0,0 +1,25 @@
+import django_filters
+from .models import Order, OrderItem
+
+
+class OrderFilter(django_filters.FilterSet):
+    status = django_filters.MultipleChoiceFilter(choices=Order.STATUS_CHOICES)
+    # ?created_after=2026-01-01&created_before=2026-01-31, both days inclusive.
+    created = django_filters.DateFromToRangeFilter(field_name='created_at')
+
+    class Meta:
+        model = Order
+        fields = {
+            'overall_price': ['gte', 'lte'],
+            'item_count': ['gte', 'lte'],
+        }
+
+
+class OrderItemFilter(django_filters.FilterSet):
+    """OrderFilter's status and date range, applied to the lines of matching orders."""
+    status = django_filters.MultipleChoiceFilter(field_name='order__status', choices=Order.STATUS_CHOICES)
+    created = django_filters.DateFromToRangeFilter(field_name='order__created_at')
+
+    class Meta:
+        model = OrderItem
+        fields = ['product']
@@ -0,0 +1,77 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from order.models import Order
+from product.management.commands._catalog import seed_catalog
+from product.models import Cart, CartItem
+from users.models import User
+
+DETAILS = {'first_name': 'Bench', 'last_name': 'Buyer', 'phone': '+998900000000', 'address': 'Tashkent'}
+
+
+class Command(BaseCommand):
+    help = (
+        "Latency and query count by number of order lines of POST /orders/, of the "
+        "two-call checkout (GET /api/cart/ then POST /orders/) and of POST /orders/checkout/. "
+        "The catalog is created inside a transaction and rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 5, 10, 30, 100])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def measure(self, repeat, request, before=None):
+        timings = []
+        for _ in range(repeat):
+            if before is not None:
+                before()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                request()
+                timings.append((time.perf_counter() - start) * 1000)
+        return statistics.median(timings), len(queries.captured_queries)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            products = seed_catalog(max(options['sizes']), with_extras=True)
+            products.update(amount=10_000)
+            product_ids = list(products.values_list('pk', flat=True))
+            user = User.objects.create_user(username='bench-buyer', password='bench-pass')
+            cart = Cart.objects.create(user=user)
+            client = APIClient()
+            client.force_authenticate(user)
+
+            def post(path, payload):
+                response = client.post(path, payload, format='json')
+                assert response.status_code == 201, response.content
+
+            for size in options['sizes']:
+                lines = [{'product': pk, 'quantity': 2} for pk in product_ids[:size]]
+
+                def fill_cart():
+                    CartItem.objects.filter(cart=cart).delete()
+                    CartItem.objects.bulk_create(CartItem(cart=cart, product_id=pk, quantity=2)
+                                                 for pk in product_ids[:size])
+
+                def two_calls():
+                    items = client.get('/api/cart/').json()['items']
+                    post('/orders/', {**DETAILS, 'items': [
+                        {'product': item['product'], 'quantity': item['quantity']} for item in items
+                    ]})
+
+                create = self.measure(options['repeat'], lambda: post('/orders/', {**DETAILS, 'items': lines}))
+                cart_then_create = self.measure(options['repeat'], two_calls, fill_cart)
+                checkout = self.measure(options['repeat'], lambda: post('/orders/checkout/', DETAILS), fill_cart)
+
+                self.stdout.write(f"{size:>5} lines" + "".join(
+                    f"   {label} {ms:>7.2f} ms {count:>3} q"
+                    for label, (ms, count) in [('create', create), ('cart+create', cart_then_create),
+                                               ('checkout', checkout)]
+                ))
+            Order.objects.filter(user=user).delete()
+            transaction.set_rollback(True)
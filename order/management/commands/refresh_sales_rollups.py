@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from order.analytics import refresh_rollups, rollups_as_of
+
+
+class Command(BaseCommand):
+    help = (
+        "Update the daily sales rollups with the orders created or changed since the "
+        "last run. Schedule it every few minutes; --full rebuilds every day from scratch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild all rollups instead of only changed days.')
+
+    def handle(self, *args, **options):
+        days = refresh_rollups(full=options['full'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {days} days of sales rollups; up to date as of {rollups_as_of():%Y-%m-%d %H:%M:%S}."
+        ))
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:15
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_order_totals(apps, schema_editor):
+    Order = apps.get_model('order', 'Order')
+    OrderItem = apps.get_model('order', 'OrderItem')
+    items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+    Order.objects.update(
+        overall_price=Coalesce(
+            Subquery(items.annotate(total=Sum('total_price')).values('total')),
+            Value(Decimal('0.00')),
+            output_field=DecimalField(),
+        ),
+        item_count=Coalesce(Subquery(items.annotate(count=Count('pk')).values('count')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('order', '0002_order_user_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='overall_price',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, max_digits=12),
+        ),
+        migrations.RunPython(populate_order_totals, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,45 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Now
 from django.core.validators import MinValueValidator
 from decimal import Decimal
 
+from product.pricing import line_total
+from product.stock import adjust_stock, reserve_stock
+
+
+class OrderQuerySet(models.QuerySet):
+    def place(self, items, **fields):
+        """
+        Create an order from unsaved, priced OrderItems in one transaction:
+        reserve their stock, insert the order with its totals and bulk-insert
+        the items. Raises product.stock.InsufficientStock, writing nothing.
+        """
+        with transaction.atomic():
+            reserve_stock((item.product_id, item.quantity) for item in items)
+            order = self.create(
+                **fields,
+                stock_reserved=True,
+                overall_price=sum((item.total_price for item in items), Decimal('0.00')),
+                item_count=len(items),
+            )
+            for item in items:
+                item.order = order
+            OrderItem.objects.bulk_create(items)
+        return order
+
+    def refresh_totals(self):
+        """Recompute the stored `overall_price` and `item_count` of these orders in one UPDATE."""
+        items = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order')
+        total = Subquery(items.annotate(total=Sum('total_price')).values('total'))
+        count = Subquery(items.annotate(count=Count('pk')).values('count'))
+        return self.update(
+            overall_price=Coalesce(total, Value(Decimal('0.00')), output_field=DecimalField()),
+            item_count=Coalesce(count, 0),
+            updated_at=Now(),
+        )
+
+
 class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -26,11 +64,34 @@ class Order(models.Model):
         default='pending'
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped by every write to the order or its items; the sales rollups
+    # pick up changed orders by it (see order.analytics).
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+    # Kept in sync with the items (see OrderQuerySet.refresh_totals) so lists
+    # can sort and filter on them without touching order_orderitem.
+    overall_price = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'), editable=False)
+    item_count = models.PositiveIntegerField(default=0, editable=False)
+    # Whether the items are currently taken out of product stock: set by
+    # OrderQuerySet.place and reserve_items, cleared when cancelling puts
+    # them back. Orders created any other way never held stock.
+    stock_reserved = models.BooleanField(default=False, editable=False)
+
+    objects = OrderQuerySet.as_manager()
 
-    @property
-    def overall_price(self):
-        total = sum(item.total_price for item in self.items.all()), Decimal('0.00')
-        return round(float(total), 2)
+    class Meta:
+        indexes = [
+            # A user's order history, newest first.
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ]
+
+    def reserve_items(self):
+        """
+        Take the stored items out of stock again, e.g. when a cancelled order
+        is reopened; saving the order records it. Raises
+        product.stock.InsufficientStock, changing nothing.
+        """
+        reserve_stock(self.items.values_list('product_id', 'quantity'))
+        self.stock_reserved = True
 
     def __str__(self):
         return f"Order #{self.id} by {self.first_name} {self.last_name}"
@@ -55,9 +116,73 @@ class OrderItem(models.Model):
     )
 
     def save(self, *args, **kwargs):
-        if self.product:
-            self.total_price = Decimal(self.product.price) * self.quantity
-        super().save(*args, **kwargs)
+        stored = self.stored_line()
+        changed = stored != (self.product_id, self.quantity)
+        # A total given with a new line is the price it was sold at (see
+        # OrderQuerySet.place); any later change to the line reprices it.
+        if self.product and (self.total_price is None or (stored is not None and changed)):
+            self.total_price = line_total(self.product, self.quantity)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'total_price'}
+        if not changed:
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            # Lines of an order holding stock hold exactly their quantity;
+            # raises InsufficientStock, leaving the line unsaved.
+            if Order.objects.filter(pk=self.order_id, stock_reserved=True).exists():
+                adjust_stock([stored] if stored else [], [(self.product_id, self.quantity)])
+            super().save(*args, **kwargs)
+
+    def stored_line(self):
+        """(product_id, quantity) of the stored row, or None for a new line."""
+        if self.pk is None:
+            return None
+        return OrderItem.objects.filter(pk=self.pk).values_list('product_id', 'quantity').first()
 
     def __str__(self):
         return f"{self.product} x{self.quantity} (Order #{self.order.id})"
+
+
+class SalesRollup(models.Model):
+    """Units, revenue and orders of one day. Not cancelled orders, bucketed by the day they were placed."""
+    day = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    order_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesRollup):
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day'], name='dailysales_day_uniq'),
+        ]
+
+
+class DailyProductSales(SalesRollup):
+    product = models.ForeignKey('product.Product', on_delete=models.SET_NULL, null=True, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='dailyproductsales_day_product_uniq'),
+        ]
+
+
+class DailyCategorySales(SalesRollup):
+    category = models.ForeignKey('product.Category', on_delete=models.SET_NULL, null=True, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'category'], name='dailycategorysales_day_category_uniq'),
+        ]
+
+
+class RollupWatermark(models.Model):
+    """How far a rollup job has read: orders updated after `value` are still to be processed."""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} @ {self.value:%Y-%m-%d %H:%M:%S}"
@@ -1,18 +1,59 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
+
+from product.models import Cart, CartItem, Product, active_discount_prefetch
+from product.pricing import line_total, price_cart
+from product.stock import InsufficientStock
 from .models import Order, OrderItem
 
 
+class BatchedProductField(serializers.PrimaryKeyRelatedField):
+    """
+    Product lookup that reads from the batch loaded by OrderItemListSerializer
+    and only queries on its own for ids missing from it (to report the error).
+    """
+
+    def to_internal_value(self, data):
+        products = getattr(self.parent.parent, 'products', None)
+        if products is not None:
+            try:
+                return products[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class OrderItemListSerializer(serializers.ListSerializer):
+    """Validates order lines against products and discounts loaded in one batch."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            ids = set()
+            for item in data:
+                try:
+                    ids.add(int(item['product']))
+                except (KeyError, TypeError, ValueError):
+                    continue
+            self.products = Product.objects.filter(pk__in=ids).prefetch_related(active_discount_prefetch()).in_bulk()
+        return super().to_internal_value(data)
+
+
 class OrderItemCreateSerializer(serializers.ModelSerializer):
+    product = BatchedProductField(queryset=Product.objects.all())
+
     class Meta:
         model = OrderItem
         fields = ['product', 'quantity']
         read_only_fields = ['total_price']
+        list_serializer_class = OrderItemListSerializer
 
     def create(self, validated_data):
         product = validated_data['product']
         quantity = validated_data['quantity']
-        total_price = product.discounted_price * quantity
-        return OrderItem.objects.create(total_price=total_price, **validated_data)
+        return OrderItem.objects.create(total_price=line_total(product, quantity), **validated_data)
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -34,25 +75,78 @@ class OrderCreateSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
-        for item_data in items_data:
-            product = item_data['product']
-            quantity = item_data['quantity']
-            total_price = product.discounted_price * quantity
-            OrderItem.objects.create(order=order, product=product, quantity=quantity, total_price=total_price)
+        items = [
+            OrderItem(
+                product=item['product'], quantity=item['quantity'],
+                total_price=line_total(item['product'], item['quantity']),
+            )
+            for item in items_data
+        ]
+        try:
+            return Order.objects.place(items, **validated_data)
+        except InsufficientStock as exc:
+            raise serializers.ValidationError({'items': str(exc)})
+
+
+class CheckoutSerializer(serializers.ModelSerializer):
+    """Turns the user's cart into an order, priced as the cart view prices it."""
+
+    class Meta:
+        model = Order
+        fields = ['first_name', 'last_name', 'phone', 'address']
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            cart = Cart.objects.filter(user=validated_data['user']).order_by('pk').first()
+            priced = price_cart(cart) if cart is not None else None
+            if priced is None or not priced.lines:
+                raise serializers.ValidationError({'cart': 'The cart is empty.'})
+            items = [
+                OrderItem(product=line.product, quantity=line.quantity, total_price=line.total)
+                for line in priced.lines
+            ]
+            try:
+                order = Order.objects.place(items, **validated_data)
+            except InsufficientStock as exc:
+                raise serializers.ValidationError({'cart': str(exc)})
+            CartItem.objects.filter(cart=cart).delete()
         return order
 
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
-    overall_price = serializers.SerializerMethodField()
+    overall_price = serializers.FloatField(read_only=True)
 
     class Meta:
         model = Order
         fields = [
             'id', 'user', 'first_name', 'last_name', 'phone', 'address',
-            'status', 'created_at', 'overall_price', 'items'
+            'status', 'created_at', 'overall_price', 'item_count', 'items'
         ]
+        read_only_fields = ['item_count']
+
+    def update(self, instance, validated_data):
+        # Reopening a cancelled order takes its items out of stock again,
+        # or is refused if they have sold out meanwhile.
+        reopening = instance.status == 'cancelled' and validated_data.get('status', 'cancelled') != 'cancelled'
+        with transaction.atomic():
+            if reopening:
+                try:
+                    instance.reserve_items()
+                except InsufficientStock as exc:
+                    raise serializers.ValidationError({'status': str(exc)})
+            return super().update(instance, validated_data)
+
+
+class SalesReportQuerySerializer(serializers.Serializer):
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    by = serializers.ChoiceField(choices=['day', 'product', 'category'], default='day')
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=50)
 
-    def get_overall_price(self, obj):
-        return round(obj.overall_price, 2)
+    def validate(self, attrs):
+        attrs.setdefault('end', timezone.localdate())
+        attrs.setdefault('start', attrs['end'] - timedelta(days=29))
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError({'start': 'Must not be after end.'})
+        return attrs
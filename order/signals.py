@@ -0,0 +1,70 @@
+from django.db.models import QuerySet
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete
+from django.utils import timezone
+from django.dispatch import receiver
+
+from product.stock import release_stock
+from .analytics import rebuild_days_on_commit
+from .models import Order, OrderItem
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    # Reopening a cancelled order reserves its stock where the status is
+    # edited (OrderSerializer.update, OrderAdmin), which can refuse the
+    # change; a signal could only fail the save.
+    instance._previous_status, instance._stock_was_reserved = (
+        Order.objects.filter(pk=instance.pk).values_list('status', 'stock_reserved').first()
+        if instance.pk else None
+    ) or (None, False)
+
+
+@receiver(post_save, sender=Order)
+def restock_cancelled_order(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_previous_status', None)
+    if (
+        not created and previous not in (None, 'cancelled') and instance.status == 'cancelled'
+        and getattr(instance, '_stock_was_reserved', False)
+    ):
+        release_stock(instance.items.values_list('product_id', 'quantity'))
+        Order.objects.filter(pk=instance.pk).update(stock_reserved=False)
+        instance.stock_reserved = instance._stock_was_reserved = False
+
+
+def deleting_orders(origin):
+    """Whether a delete started from orders, so their items go with them (post_delete's `origin`)."""
+    return isinstance(origin, Order) or (isinstance(origin, QuerySet) and origin.model is Order)
+
+
+@receiver(pre_delete, sender=Order)
+def remember_reserved_lines(sender, instance, **kwargs):
+    # The items are gone by post_delete.
+    instance._reserved_lines = (
+        list(instance.items.values_list('product_id', 'quantity')) if instance.stock_reserved else []
+    )
+
+
+@receiver(post_delete, sender=Order)
+def restock_deleted_order(sender, instance, **kwargs):
+    release_stock(getattr(instance, '_reserved_lines', []))
+
+
+@receiver(post_delete, sender=OrderItem)
+def restock_deleted_item(sender, instance, origin=None, **kwargs):
+    if not deleting_orders(origin) and Order.objects.filter(pk=instance.order_id, stock_reserved=True).exists():
+        release_stock([(instance.product_id, instance.quantity)])
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def refresh_order_totals(sender, instance, origin=None, **kwargs):
+    # Lines deleted along with their order leave nothing to refresh.
+    if not deleting_orders(origin):
+        Order.objects.filter(pk=instance.order_id).refresh_totals()
+
+
+@receiver(post_delete, sender=Order)
+def drop_deleted_order_from_rollups(sender, instance, **kwargs):
+    # Deleted orders leave no updated_at behind for the watermark to find,
+    # so rebuild their day directly.
+    rebuild_days_on_commit([timezone.localdate(instance.created_at)])
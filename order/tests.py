@@ -1,3 +1,724 @@
-from django.test import TestCase
+import csv
+import json
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from product.models import Cart, CartItem, Category, Discount, Product
+from product.stock import InsufficientStock
+from users.models import User
+from product.pricing import line_total
+from .analytics import rebuild_days, refresh_rollups
+from .models import DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem
+from .views import OrderExportAPIView
+
+
+class OrderQueryPlanTests(TestCase):
+    def test_order_history_uses_user_created_index(self):
+        user = User.objects.create_user(username='buyer', password='pass12345')
+        queryset = Order.objects.filter(user=user).order_by('-created_at')[:20]
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {queryset.query}')
+            plan = [row[-1] for row in cursor.fetchall()]
+        self.assertTrue(any('order_user_created_idx' in step for step in plan), plan)
+        self.assertFalse(any('TEMP B-TREE' in step for step in plan), plan)
+
+
+class OrderCreateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Phones')
+        now = timezone.now()
+        self.products = []
+        for i in range(30):
+            product = Product.objects.create(
+                name=f'Product {i}', brand='Brand', price=10.0 + i, amount=50, category=category
+            )
+            if i % 2:
+                Discount.objects.create(
+                    title=f'Sale {i}', product=product, percentage=25.0, active=True,
+                    start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+                )
+            self.products.append(product)
+
+    def payload(self, products, quantity=2):
+        return {
+            'first_name': 'Ali', 'last_name': 'Valiyev', 'phone': '+998900000000', 'address': 'Tashkent',
+            'items': [{'product': product.pk, 'quantity': quantity} for product in products],
+        }
+
+    def test_items_are_priced_with_active_discounts(self):
+        response = self.client.post('/orders/', self.payload(self.products[:2], quantity=3), format='json')
+
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(user=self.user)
+        totals = dict(order.items.values_list('product__name', 'total_price'))
+        self.assertEqual(totals, {'Product 0': Decimal('30.00'), 'Product 1': Decimal('24.75')})
+
+    def test_query_count_does_not_grow_with_order_size(self):
+        with self.assertNumQueries(10):
+            self.client.post('/orders/', self.payload(self.products[:1]), format='json')
+        with self.assertNumQueries(10):
+            response = self.client.post('/orders/', self.payload(self.products), format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['items']), 30)
+
+    def test_unknown_product_is_rejected_without_writing(self):
+        payload = self.payload(self.products[:2])
+        payload['items'].append({'product': 999999, 'quantity': 1})
+
+        response = self.client.post('/orders/', payload, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('product', response.json()['items'][2])
+        self.assertFalse(Order.objects.exists())
+
+    def test_failed_item_insert_rolls_back_the_order(self):
+        with mock.patch.object(OrderItem.objects, 'bulk_create', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.client.post('/orders/', self.payload(self.products[:3]), format='json')
+        self.assertFalse(Order.objects.exists())
+
+    def test_editing_a_line_reprices_it_and_the_order(self):
+        order = Order.objects.create(user=self.user, first_name='A', last_name='B', phone='1', address='C')
+        sold = OrderItem.objects.create(order=order, product=self.products[0], quantity=1, total_price=Decimal('5.00'))
+        item = OrderItem.objects.create(order=order, product=self.products[1], quantity=1)
+        self.assertEqual((sold.total_price, item.total_price), (Decimal('5.00'), Decimal('8.25')))
+
+        item.quantity = 5
+        item.save()
+        item.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual(item.total_price, Decimal('41.25'))
+        self.assertEqual(order.overall_price, Decimal('46.25'))
+
+        # Saving a line without changing it keeps the price it was sold at.
+        sold.save()
+        sold.refresh_from_db()
+        self.assertEqual(sold.total_price, Decimal('5.00'))
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Phones')
+        self.phone = Product.objects.create(name='Phone', brand='Brand', price=10.0, amount=3, category=category)
+        self.case = Product.objects.create(name='Case', brand='Brand', price=2.0, amount=1, category=category)
+
+    def order(self, *lines):
+        return self.client.post('/orders/', {
+            'first_name': 'Ali', 'last_name': 'Valiyev', 'phone': '+998900000000', 'address': 'Tashkent',
+            'items': [{'product': product.pk, 'quantity': quantity} for product, quantity in lines],
+        }, format='json')
+
+    def test_order_takes_items_out_of_stock(self):
+        response = self.order((self.phone, 2), (self.case, 1))
+
+        self.assertEqual(response.status_code, 201)
+        self.phone.refresh_from_db()
+        self.case.refresh_from_db()
+        self.assertEqual((self.phone.amount, self.phone.is_available), (1, True))
+        self.assertEqual((self.case.amount, self.case.is_available), (0, False))
+
+    def test_short_item_rejects_the_whole_order(self):
+        response = self.order((self.phone, 2), (self.case, 2))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.case.pk), response.json()['items'])
+        self.assertNotIn(str(self.phone.pk), response.json()['items'])
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.amount, 3)
+        self.assertFalse(Order.objects.exists())
+
+    def test_repeated_lines_are_summed(self):
+        response = self.order((self.phone, 2), (self.phone, 2))
+        self.assertEqual(response.status_code, 400)
+
+    def test_cancelling_restores_stock(self):
+        self.order((self.phone, 1), (self.case, 1))
+        order = Order.objects.get()
+
+        order.status = 'cancelled'
+        order.save()
+
+        self.phone.refresh_from_db()
+        self.case.refresh_from_db()
+        self.assertEqual(self.phone.amount, 3)
+        self.assertEqual((self.case.amount, self.case.is_available), (1, True))
+
+        # Saving again without a status change does not restock twice.
+        order.save()
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.amount, 3)
+
+    def set_status(self, order, status):
+        self.user.role = 'admin'
+        self.user.save()
+        return self.client.patch(f'/orders/{order.pk}/', {'status': status}, format='json')
+
+    def test_reopening_a_cancelled_order_reserves_again(self):
+        self.order((self.case, 1))
+        order = Order.objects.get()
+        self.assertEqual(self.set_status(order, 'cancelled').status_code, 200)
+        self.case.refresh_from_db()
+        self.assertEqual(self.case.amount, 1)
+
+        self.assertEqual(self.set_status(order, 'pending').status_code, 200)
+        self.case.refresh_from_db()
+        order.refresh_from_db()
+        self.assertEqual((self.case.amount, self.case.is_available), (0, False))
+        self.assertTrue(order.stock_reserved)
+
+    def test_reopening_without_stock_is_refused(self):
+        self.order((self.case, 1))
+        order = Order.objects.get()
+        self.set_status(order, 'cancelled')
+        self.order((self.case, 1))
+
+        response = self.set_status(order, 'pending')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.case.pk), response.json()['status'])
+        order.refresh_from_db()
+        self.case.refresh_from_db()
+        self.assertEqual((order.status, order.stock_reserved), ('cancelled', False))
+        self.assertEqual(self.case.amount, 0)
+
+    def test_reopening_without_stock_in_the_admin_is_refused(self):
+        self.order((self.case, 1))
+        order = Order.objects.get()
+        self.set_status(order, 'cancelled')
+        self.order((self.case, 1))
+        item = order.items.get()
+        admin = User.objects.create_superuser(username='root', password='pass12345', email='root@example.com')
+        client = Client()
+        client.force_login(admin)
+
+        response = client.post(reverse('admin:order_order_change', args=[order.pk]), {
+            'user': self.user.pk, 'first_name': 'Ali', 'last_name': 'Valiyev', 'phone': '1', 'address': 'C',
+            'status': 'pending',
+            'items-TOTAL_FORMS': '1', 'items-INITIAL_FORMS': '1', 'items-MIN_NUM_FORMS': '0', 'items-MAX_NUM_FORMS': '1000',
+            'items-0-id': item.pk, 'items-0-order': order.pk, 'items-0-product': self.case.pk, 'items-0-quantity': '1',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('status', response.context['adminform'].form.errors)
+        order.refresh_from_db()
+        self.case.refresh_from_db()
+        self.assertEqual(order.status, 'cancelled')
+        self.assertEqual(self.case.amount, 0)
+
+    def test_edited_lines_move_their_reservation(self):
+        self.order((self.phone, 1))
+        order = Order.objects.get()
+        item = order.items.get()
+
+        item.quantity = 3
+        item.save()
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.amount, 0)
+
+        item.quantity = 4
+        with self.assertRaises(InsufficientStock):
+            item.save()
+        self.assertEqual(order.items.get().quantity, 3)
+
+        self.set_status(order, 'cancelled')
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.amount, 3)
+
+    def test_deleting_reserved_lines_and_orders_restocks(self):
+        self.order((self.phone, 2), (self.case, 1))
+        order = Order.objects.get()
+
+        order.items.get(product=self.phone).delete()
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.amount, 3)
+
+        order.delete()
+        self.case.refresh_from_db()
+        self.assertEqual(self.case.amount, 1)
+
+        # A cancelled order already gave its stock back.
+        self.order((self.case, 1))
+        cancelled = Order.objects.get()
+        self.set_status(cancelled, 'cancelled')
+        Order.objects.all().delete()
+        self.case.refresh_from_db()
+        self.assertEqual(self.case.amount, 1)
+
+    def test_admin_refuses_line_edits_beyond_stock(self):
+        self.order((self.phone, 1))
+        order = Order.objects.get()
+        item = order.items.get()
+        admin = User.objects.create_superuser(username='root', password='pass12345', email='root@example.com')
+        client = Client()
+        client.force_login(admin)
+
+        response = client.post(reverse('admin:order_order_change', args=[order.pk]), {
+            'user': self.user.pk, 'first_name': 'Ali', 'last_name': 'Valiyev', 'phone': '1', 'address': 'C',
+            'status': 'pending',
+            'items-TOTAL_FORMS': '1', 'items-INITIAL_FORMS': '1', 'items-MIN_NUM_FORMS': '0', 'items-MAX_NUM_FORMS': '1000',
+            'items-0-id': item.pk, 'items-0-order': order.pk, 'items-0-product': self.phone.pk, 'items-0-quantity': '5',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['inline_admin_formsets'][0].formset.non_form_errors())
+        self.phone.refresh_from_db()
+        self.assertEqual((self.phone.amount, order.items.get().quantity), (2, 1))
+
+    def test_cancelling_an_order_that_held_no_stock_restocks_nothing(self):
+        order = Order.objects.create(user=self.user, first_name='A', last_name='B', phone='1', address='C')
+        OrderItem.objects.create(order=order, product=self.phone, quantity=2)
+
+        order.status = 'cancelled'
+        order.save()
+
+        self.phone.refresh_from_db()
+        self.assertEqual(self.phone.amount, 3)
+
+
+class StockStressTests(TransactionTestCase):
+    def test_concurrent_orders_never_oversell(self):
+        category = Category.objects.create(name='Phones')
+        product = Product.objects.create(name='Phone', brand='Brand', price=10.0, amount=25, category=category)
+        buyers = 8
+        attempts = 10
+        users = [User.objects.create_user(username=f'buyer{i}', password='pass12345') for i in range(buyers)]
+        barrier = threading.Barrier(buyers)
+        results = []
+
+        def buy(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                for _ in range(attempts):
+                    response = client.post('/orders/', {
+                        'first_name': 'A', 'last_name': 'B', 'phone': '1', 'address': 'C',
+                        'items': [{'product': product.pk, 'quantity': 1}],
+                    }, format='json')
+                    results.append(response.status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(sorted(set(results)), [201, 400])
+        self.assertEqual(results.count(201), 25)
+        self.assertEqual(product.amount, 0)
+        self.assertFalse(product.is_available)
+        self.assertEqual(OrderItem.objects.count(), 25)
+
+
+class OrderTotalsTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Phones')
+        self.products = [
+            Product.objects.create(name=f'Product {i}', brand='Brand', price=10.0 * (i + 1), amount=50, category=category)
+            for i in range(3)
+        ]
+
+    def place(self, *lines):
+        response = self.client.post('/orders/', {
+            'first_name': 'Ali', 'last_name': 'Valiyev', 'phone': '+998900000000', 'address': 'Tashkent',
+            'items': [{'product': product.pk, 'quantity': quantity} for product, quantity in lines],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.latest('pk')
+
+    def test_totals_are_stored_on_create(self):
+        order = self.place((self.products[0], 2), (self.products[2], 1))
+        self.assertEqual((order.overall_price, order.item_count), (Decimal('50.00'), 2))
+
+    def test_item_changes_refresh_totals(self):
+        order = self.place((self.products[0], 1))
+        item = OrderItem.objects.create(order=order, product=self.products[1], quantity=1)
+        order.refresh_from_db()
+        self.assertEqual((order.overall_price, order.item_count), (Decimal('30.00'), 2))
+
+        item.delete()
+        order.refresh_from_db()
+        self.assertEqual((order.overall_price, order.item_count), (Decimal('10.00'), 1))
+
+    def test_deleting_an_order_does_not_refresh_its_totals(self):
+        orders = [self.place((self.products[0], 1), (self.products[1], 1), (self.products[2], 1)) for _ in range(2)]
+
+        with CaptureQueriesContext(connection) as queries:
+            orders[0].delete()
+            Order.objects.all().delete()
+
+        self.assertFalse([query for query in queries.captured_queries
+                          if query['sql'].startswith('UPDATE "order_order"')])
+        self.assertFalse(OrderItem.objects.exists())
+
+    def test_editing_a_line_in_the_admin_refreshes_totals(self):
+        order = self.place((self.products[0], 1), (self.products[1], 1))
+        first, second = order.items.order_by('pk')
+        admin = User.objects.create_superuser(username='root', password='pass12345', email='root@example.com')
+        self.client = Client()
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:order_order_change', args=[order.pk]), {
+            'user': self.user.pk, 'first_name': 'Ali', 'last_name': 'Valiyev', 'phone': '1', 'address': 'C',
+            'status': 'pending',
+            'items-TOTAL_FORMS': '2', 'items-INITIAL_FORMS': '2', 'items-MIN_NUM_FORMS': '0', 'items-MAX_NUM_FORMS': '1000',
+            'items-0-id': first.pk, 'items-0-order': order.pk, 'items-0-product': self.products[0].pk, 'items-0-quantity': '4',
+            'items-1-id': second.pk, 'items-1-order': order.pk, 'items-1-product': self.products[2].pk, 'items-1-quantity': '1',
+        })
+        self.assertEqual(response.status_code, 302)
+        order.refresh_from_db()
+        self.assertEqual(sorted(order.items.values_list('total_price', flat=True)), [Decimal('30.00'), Decimal('40.00')])
+        self.assertEqual((order.overall_price, order.item_count), (Decimal('70.00'), 2))
+
+    def test_list_sorts_and_filters_on_totals_without_item_queries(self):
+        small = self.place((self.products[0], 1))
+        large = self.place((self.products[2], 3), (self.products[1], 1))
+
+        response = self.client.get('/orders/', {'ordering': '-overall_price'})
+        self.assertEqual([row['id'] for row in response.json()['results']], [large.pk, small.pk])
+        self.assertEqual(response.json()['results'][0]['overall_price'], 110.0)
+        self.assertEqual(response.json()['results'][0]['item_count'], 2)
+
+        response = self.client.get('/orders/', {'overall_price__gte': 50})
+        self.assertEqual([row['id'] for row in response.json()['results']], [large.pk])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/orders/', {'ordering': 'item_count'})
+        self.assertFalse(any('SUM(' in query['sql'] for query in queries.captured_queries))
+
+
+class CheckoutTests(TestCase):
+    details = {'first_name': 'Ali', 'last_name': 'Valiyev', 'phone': '+998900000000', 'address': 'Tashkent'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Phones')
+        self.cart = Cart.objects.create(user=self.user)
+
+    def fill_cart(self, count, quantity=2, amount=50):
+        now = timezone.now()
+        for i in range(count):
+            product = Product.objects.create(
+                name=f'Product {i}', brand='Brand', price=10.0 + i, amount=amount, category=self.category
+            )
+            Discount.objects.create(
+                title=f'Sale {i}', product=product, percentage=10.0, active=True,
+                start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+            )
+            CartItem.objects.create(cart=self.cart, product=product, quantity=quantity)
+
+    def test_checkout_turns_the_cart_into_an_order(self):
+        self.fill_cart(2)
+        cart = self.client.get('/api/cart/').json()
+
+        response = self.client.post('/orders/checkout/', self.details, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(data['overall_price'], float(cart['total']))
+        self.assertEqual(data['item_count'], 2)
+        self.assertEqual([item['total_price'] for item in data['items']],
+                         [line['total'] for line in cart['items']])
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+        self.assertEqual(list(Product.objects.values_list('amount', flat=True)), [48, 48])
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        self.fill_cart(1)
+        with self.assertNumQueries(15):
+            self.client.post('/orders/checkout/', self.details, format='json')
+        self.fill_cart(30)
+        with self.assertNumQueries(15):
+            response = self.client.post('/orders/checkout/', self.details, format='json')
+        self.assertEqual(len(response.json()['items']), 30)
+
+    def test_empty_cart_is_rejected(self):
+        response = self.client.post('/orders/checkout/', self.details, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cart', response.json())
+        self.assertFalse(Order.objects.exists())
+
+    def test_short_stock_keeps_the_cart(self):
+        self.fill_cart(2, quantity=3, amount=2)
+
+        response = self.client.post('/orders/checkout/', self.details, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 2)
+        self.assertFalse(Order.objects.exists())
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Phones')
+        self.products = [
+            Product.objects.create(name=f'Product {i}', brand='Brand', price=10.0, amount=100, category=category)
+            for i in range(4)
+        ]
+
+    def place(self, lines, status='pending', days_ago=0):
+        order = Order.objects.create(user=self.user, first_name='A', last_name='B', phone='1', address='C',
+                                     status=status)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        OrderItem.objects.bulk_create(
+            OrderItem(order=order, product=product, quantity=1, total_price=Decimal('10.00'))
+            for product in self.products[:lines]
+        )
+        return order
+
+    def ids(self, response):
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.json()['results']]
+
+    def test_list_queries_do_not_grow_with_orders_or_items(self):
+        self.place(1)
+        with self.assertNumQueries(2):
+            self.client.get('/orders/')
+        for days in range(1, 6):
+            self.place(4, days_ago=days)
+        with self.assertNumQueries(2):
+            response = self.client.get('/orders/')
+        self.assertEqual(response.json()['results'][1]['items'][0]['product'], 'Product 0')
+
+    def test_detail_runs_a_fixed_number_of_queries(self):
+        order = self.place(4)
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/orders/{order.pk}/')
+        self.assertEqual(len(response.json()['items']), 4)
+
+    def test_pages_run_newest_first(self):
+        orders = [self.place(1, days_ago=days) for days in range(5)]
+
+        response = self.client.get('/orders/', {'page_size': 3})
+        self.assertEqual(self.ids(response), [order.pk for order in orders[:3]])
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(self.ids(response), [order.pk for order in orders[3:]])
+
+    def test_filters_by_status_and_date_range(self):
+        recent = self.place(1, status='delivering', days_ago=1)
+        old = self.place(1, status='completed', days_ago=10)
+        cancelled = self.place(1, status='cancelled', days_ago=2)
+        today = timezone.localdate()
+
+        self.assertEqual(self.ids(self.client.get('/orders/', {'status': 'completed'})), [old.pk])
+        self.assertEqual(self.ids(self.client.get('/orders/?status=delivering&status=cancelled')),
+                         [recent.pk, cancelled.pk])
+        self.assertEqual(
+            self.ids(self.client.get('/orders/', {
+                'created_after': str(today - timedelta(days=5)), 'created_before': str(today - timedelta(days=2)),
+            })),
+            [cancelled.pk],
+        )
+        self.assertEqual(self.client.get('/orders/', {'status': 'lost'}).status_code, 400)
+
+    def test_other_users_orders_are_hidden(self):
+        other = User.objects.create_user(username='other', password='pass12345')
+        foreign = Order.objects.create(user=other, first_name='A', last_name='B', phone='1', address='C')
+        self.assertEqual(self.ids(self.client.get('/orders/')), [])
+        self.assertEqual(self.client.get(f'/orders/{foreign.pk}/').status_code, 404)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='finance', password='pass12345', role='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        product = Product.objects.create(name='Phone, "Pro"', brand='Brand', price=10.0, amount=100,
+                                         category=Category.objects.create(name='Phones'))
+        self.orders = []
+        for days, status in [(1, 'completed'), (3, 'cancelled'), (10, 'completed')]:
+            order = Order.objects.create(user=self.admin, first_name='A', last_name='B', phone='1',
+                                         address='C', status=status, overall_price=Decimal('20.50'), item_count=2)
+            Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days))
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=1, total_price=Decimal('10.25')),
+                OrderItem(order=order, product=product, quantity=1, total_price=Decimal('10.25')),
+            ])
+            self.orders.append(order)
+
+    def content(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_orders_stream_as_csv(self):
+        response = self.client.get('/orders/export/')
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertIn('attachment; filename="orders-', response['Content-Disposition'])
+        rows = list(csv.DictReader(self.content(response).splitlines()))
+        self.assertEqual([int(row['id']) for row in rows], [order.pk for order in self.orders])
+        self.assertEqual((rows[0]['status'], rows[0]['overall_price'], rows[0]['item_count']),
+                         ('completed', '20.50', '2'))
+
+    def test_items_stream_as_ndjson_with_filters(self):
+        today = timezone.localdate()
+        response = self.client.get('/orders/export/items/', {
+            'format': 'ndjson', 'status': 'completed', 'created_after': str(today - timedelta(days=5)),
+        })
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in self.content(response).splitlines()]
+        self.assertEqual({row['order_id'] for row in rows}, {self.orders[0].pk})
+        self.assertEqual(rows[0]['product_name'], 'Phone, "Pro"')
+        self.assertEqual(rows[0]['total_price'], '10.25')
+
+    def test_rows_are_flushed_in_chunks(self):
+        with mock.patch.object(OrderExportAPIView, 'chunk_size', 2):
+            chunks = list(self.client.get('/orders/export/').streaming_content)
+        # Header, then blocks of two rows and one of the remaining row.
+        self.assertEqual(len(chunks), 3)
+
+    def test_invalid_filters_are_rejected_before_streaming(self):
+        response = self.client.get('/orders/export/', {'status': 'lost', 'format': 'ndjson'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', json.loads(response.content))
+
+    def test_exports_are_admin_only(self):
+        customer = User.objects.create_user(username='buyer', password='pass12345')
+        self.client.force_authenticate(customer)
+        self.assertEqual(self.client.get('/orders/export/').status_code, 403)
+        self.client.force_authenticate(None)
+        self.assertIn(self.client.get('/orders/export/items/').status_code, (401, 403))
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='finance', password='pass12345', role='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+        self.phones = Category.objects.create(name='Phones')
+        self.laptops = Category.objects.create(name='Laptops')
+        self.phone = Product.objects.create(name='Phone', brand='B', price=10.0, amount=100, category=self.phones)
+        self.case = Product.objects.create(name='Case', brand='B', price=2.0, amount=100, category=self.phones)
+        self.laptop = Product.objects.create(name='Laptop', brand='B', price=50.0, amount=100, category=self.laptops)
+        self.today = timezone.localdate()
+
+    def place(self, lines, days_ago=0, status='pending'):
+        items = [OrderItem(product=product, quantity=quantity, total_price=line_total(product, quantity))
+                 for product, quantity in lines]
+        order = Order.objects.place(items, user=self.admin, first_name='A', last_name='B', phone='1',
+                                    address='C', status=status)
+        when = timezone.now() - timedelta(days=days_ago)
+        Order.objects.filter(pk=order.pk).update(created_at=when, updated_at=when)
+        order.refresh_from_db()
+        return order
+
+    def refresh(self, **kwargs):
+        with override_settings(SALES_ROLLUP_LAG=0):
+            return refresh_rollups(**kwargs)
+
+    def report(self, **params):
+        response = self.client.get('/orders/analytics/sales/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_rollups_match_the_order_lines(self):
+        self.place([(self.phone, 2), (self.case, 1)], days_ago=1)
+        self.place([(self.phone, 1), (self.laptop, 1)], days_ago=1)
+        self.place([(self.laptop, 1)], days_ago=3)
+        self.place([(self.phone, 5)], days_ago=1, status='cancelled')
+        self.refresh()
+
+        day = self.today - timedelta(days=1)
+        self.assertEqual(
+            DailySales.objects.values_list('day', 'units', 'revenue', 'order_count').get(day=day),
+            (day, 5, Decimal('82.00'), 2),
+        )
+        self.assertEqual(
+            dict(DailyProductSales.objects.filter(day=day).values_list('product__name', 'order_count')),
+            {'Phone': 2, 'Case': 1, 'Laptop': 1},
+        )
+        self.assertEqual(
+            dict(DailyCategorySales.objects.filter(day=day).values_list('category__name', 'revenue')),
+            {'Phones': Decimal('32.00'), 'Laptops': Decimal('50.00')},
+        )
+
+    def test_refresh_only_rebuilds_days_changed_since_the_watermark(self):
+        old = self.place([(self.phone, 1)], days_ago=5)
+        self.place([(self.phone, 1)], days_ago=1)
+        self.assertEqual(self.refresh(), 2)
+        self.assertEqual(self.refresh(), 0)
+
+        old.status = 'cancelled'
+        old.save()
+        self.assertEqual(self.refresh(), 1)
+        self.assertFalse(DailySales.objects.filter(day=self.today - timedelta(days=5)).exists())
+
+    def test_item_edits_and_deletes_reach_the_rollups(self):
+        order = self.place([(self.phone, 1)], days_ago=2)
+        self.refresh()
+        OrderItem.objects.create(order=order, product=self.case, quantity=3)
+        self.refresh()
+        self.assertEqual(DailySales.objects.get().units, 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            order.delete()
+        self.assertFalse(DailySales.objects.exists())
+
+    def test_bulk_delete_rebuilds_its_days_once(self):
+        for days_ago in (1, 1, 2):
+            self.place([(self.phone, 1)], days_ago=days_ago)
+        self.refresh()
+
+        with mock.patch('order.analytics.rebuild_days', wraps=rebuild_days) as rebuild:
+            with self.captureOnCommitCallbacks(execute=True):
+                Order.objects.all().delete()
+
+        rebuild.assert_called_once_with({self.today - timedelta(days=1), self.today - timedelta(days=2)})
+        self.assertFalse(DailySales.objects.exists())
+
+    def test_report_reads_only_rollup_tables(self):
+        self.place([(self.phone, 2), (self.case, 1)], days_ago=1)
+        self.place([(self.laptop, 1)], days_ago=3)
+        self.place([(self.laptop, 2)], days_ago=40)
+        call_command('refresh_sales_rollups', stdout=StringIO())
+
+        with CaptureQueriesContext(connection) as queries:
+            by_day = self.report()
+        self.assertFalse(any('order_order' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(by_day['totals'], {'units': 4, 'revenue': '72.00', 'order_count': 2})
+        self.assertEqual([row['day'] for row in by_day['results']],
+                         [str(self.today - timedelta(days=3)), str(self.today - timedelta(days=1))])
+
+        by_product = self.report(by='product', start=str(self.today - timedelta(days=60)), limit=2)
+        self.assertEqual([(row['name'], row['revenue']) for row in by_product['results']],
+                         [('Laptop', '150.00'), ('Phone', '20.00')])
+        by_category = self.report(by='category', end=str(self.today - timedelta(days=2)))
+        self.assertEqual(by_category['results'], [
+            {'category': self.laptops.pk, 'name': 'Laptops', 'units': 1, 'revenue': '50.00', 'order_count': 1},
+        ])
+
+    def test_report_validates_its_parameters_and_is_admin_only(self):
+        self.assertEqual(self.client.get('/orders/analytics/sales/', {'by': 'brand'}).status_code, 400)
+        self.assertEqual(self.client.get('/orders/analytics/sales/', {
+            'start': str(self.today), 'end': str(self.today - timedelta(days=1)),
+        }).status_code, 400)
+        self.client.force_authenticate(User.objects.create_user(username='buyer', password='pass12345'))
+        self.assertEqual(self.client.get('/orders/analytics/sales/').status_code, 403)
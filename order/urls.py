@@ -1,5 +1,14 @@
 from django.urls import path
+from rest_framework.routers import DefaultRouter
+from .views import OrderViewSet, OrderExportAPIView, OrderItemExportAPIView, SalesAnalyticsAPIView
 
+router = DefaultRouter()
+router.register(r'', OrderViewSet, basename='order')
+
+# Listed before the router so `export/` and `analytics/` are not taken for order ids.
 urlpatterns = [
-    # path()
-]
\ No newline at end of file
+    path('analytics/sales/', SalesAnalyticsAPIView.as_view(), name='sales-analytics'),
+    path('export/', OrderExportAPIView.as_view(), name='order-export'),
+    path('export/items/', OrderItemExportAPIView.as_view(), name='order-item-export'),
+]
+urlpatterns += router.urls
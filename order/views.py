@@ -1,26 +1,92 @@
-from rest_framework import viewsets, permissions
+from django.db.models import Prefetch
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import viewsets, permissions, filters, status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+from rest_framework.views import APIView
 from users.permissions import IsAdmin
-from .models import Order
-from .serializers import OrderSerializer, OrderCreateSerializer
+from core.exports import ExportAPIView
+from product.carts import merge_request_guest_cart
+from .analytics import sales_report
+from .filters import OrderFilter, OrderItemFilter
+from .models import Order, OrderItem
+from .serializers import (OrderSerializer, OrderCreateSerializer, CheckoutSerializer,
+                          SalesReportQuerySerializer)
 
 class OrderViewSet(viewsets.ModelViewSet):
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
+    filterset_class = OrderFilter
+    ordering_fields = ['created_at', 'overall_price', 'item_count']
+    # Newest first; pages seek on (created_at, id) through order_user_created_idx.
+    ordering = ['-created_at']
 
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user)
+        items = Prefetch('items', queryset=OrderItem.objects.select_related('product').order_by('pk'))
+        return Order.objects.filter(user=self.request.user).prefetch_related(items)
 
     def get_serializer_class(self):
         if self.action == 'create':
             return OrderCreateSerializer
+        if self.action == 'checkout':
+            return CheckoutSerializer
         return OrderSerializer
 
     def get_permissions(self):
-        if self.action in ['list', 'retrieve', 'create']:
+        if self.action in ['list', 'retrieve', 'create', 'checkout']:
             return [permissions.IsAuthenticated()]
         return [IsAdmin(), permissions.IsAuthenticated()]
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=['post'])
+    def checkout(self, request):
+        """
+        Place an order for everything in the user's cart and empty the cart.
+        A guest cart sent in the X-Cart-Token header is merged in first.
+        """
+        merge_request_guest_cart(request)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order = serializer.save(user=request.user)
+        order = self.get_queryset().get(pk=order.pk)
+        return Response(OrderSerializer(order, context=self.get_serializer_context()).data,
+                        status=status.HTTP_201_CREATED)
 
 
+class OrderExportAPIView(ExportAPIView):
+    """All orders, one row each, as CSV or NDJSON (`?format=`). Filters as in OrderFilter."""
+    queryset = Order.objects.all()
+    filterset_class = OrderFilter
+    filename = 'orders'
+    columns = [
+        ('id', 'pk'), ('created_at', 'created_at'), ('status', 'status'), ('user_id', 'user_id'),
+        ('first_name', 'first_name'), ('last_name', 'last_name'), ('phone', 'phone'),
+        ('address', 'address'), ('item_count', 'item_count'), ('overall_price', 'overall_price'),
+    ]
 
+
+class OrderItemExportAPIView(ExportAPIView):
+    """Every order line with its order's date and status, as CSV or NDJSON."""
+    queryset = OrderItem.objects.all()
+    filterset_class = OrderItemFilter
+    filename = 'order-items'
+    columns = [
+        ('id', 'pk'), ('order_id', 'order_id'), ('order_created_at', 'order__created_at'),
+        ('order_status', 'order__status'), ('product_id', 'product_id'), ('product_name', 'product__name'),
+        ('quantity', 'quantity'), ('total_price', 'total_price'),
+    ]
+
+
+class SalesAnalyticsAPIView(APIView):
+    """
+    Sales between ?start= and ?end= (default: the last 30 days), per day or
+    as a ranking of products or categories (?by=). Served from the daily
+    rollups kept by refresh_sales_rollups; `as_of` tells how fresh they are.
+    """
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        query = SalesReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(sales_report(**query.validated_data))
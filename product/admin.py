@@ -1,11 +1,25 @@
-from django.contrib import admin
+import io
+import os
+
+from django import forms
+from django.contrib import admin, messages
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
 from django.utils.html import format_html
 from .models import (
     Banner, Category, Product, Image,
     Discount, Wishlist, Review, Cart, CartItem
 )
+from django.db.models import Count, Prefetch
 from django.urls import reverse
+from .cache import bump_catalog_version
+from .images import preview_url
+from .imports import FORMATS, import_catalog
+from .pricing import price_items, pricing_queryset
 from unfold.admin import ModelAdmin as UnfoldAdmin
+from unfold.contrib.filters.admin import AutocompleteSelectFilter
+from unfold.decorators import action
+from unfold.widgets import UnfoldAdminFileFieldWidget, UnfoldAdminSelectWidget
 
 class UnfoldTranslationAdmin(UnfoldAdmin):
     class Media:
@@ -32,7 +46,7 @@ class ProductImageInline(admin.StackedInline):
 
     def image_preview(self, obj):
         if obj and getattr(obj, "image", None):
-            return format_html('<img src="{}" style="max-height:100px;"/>', obj.image.url)
+            return format_html('<img src="{}" style="max-height:100px;"/>', preview_url(obj.image, obj.derivatives_ready))
         return "-"
     image_preview.short_description = "Preview"
 
@@ -48,7 +62,7 @@ class BannerAdmin(UnfoldAdmin):
 
     def image_preview(self, obj):
         if obj and getattr(obj, "image", None):
-            return format_html('<img src="{}" style="max-height:80px;"/>', obj.image.url)
+            return format_html('<img src="{}" style="max-height:80px;"/>', preview_url(obj.image, obj.derivatives_ready))
         return "-"
     image_preview.short_description = "Preview"
 
@@ -61,6 +75,7 @@ class CategoryAdmin(UnfoldAdmin):
     list_display = ("id", "name", "banner_link", "created_at")
     search_fields = ("name",)
     list_filter = ("banner",)
+    list_select_related = ("banner",)
     readonly_fields = ("created_at",)
 
     def banner_link(self, obj):
@@ -74,24 +89,63 @@ class CategoryAdmin(UnfoldAdmin):
 # ---------------------
 # Product admin
 # ---------------------
+class CatalogImportForm(forms.Form):
+    file = forms.FileField(widget=UnfoldAdminFileFieldWidget, help_text="CSV or JSONL, UTF-8.")
+    format = forms.ChoiceField(
+        choices=[("", "From the file extension"), ("csv", "CSV"), ("jsonl", "JSONL")],
+        required=False, widget=UnfoldAdminSelectWidget,
+    )
+
+    def clean(self):
+        cleaned = super().clean()
+        upload = cleaned.get("file")
+        if upload and not cleaned.get("format"):
+            cleaned["format"] = FORMATS.get(os.path.splitext(upload.name)[1].lower())
+            if cleaned["format"] is None:
+                raise forms.ValidationError("Cannot tell the format from the file name; choose one.")
+        return cleaned
+
+
 @admin.register(Product)
 class ProductAdmin(UnfoldAdmin):
-    list_display = ("id", "name", "brand", "category", "price", "amount", "rating", "is_available", "created_at")
+    list_display = ("id", "name", "brand", "category", "price", "effective_price", "amount", "rating", "is_available", "created_at")
     list_filter = ("category", "brand", "is_available")
-    search_fields = ("name", "brand", "description")
+    list_select_related = ("category",)
+    search_fields = ("name", "sku", "brand", "description")
     inlines = [ProductImageInline]
-    readonly_fields = ("created_at",)
+    readonly_fields = ("created_at", "effective_price", "rating")
     list_editable = ("is_available",)
     save_on_top = True
     fieldsets = (
         (None, {
-            "fields": ("name", "brand", "description", "category", "is_available")
+            "fields": ("name", "sku", "brand", "description", "category", "is_available")
         }),
         ("Pricing & Stock", {
-            "fields": ("price", "amount", "rating")
+            "fields": ("price", "effective_price", "amount", "rating")
         }),
         ("Timestamps", {"fields": ("created_at",)}),
     )
+    actions_list = ["import_catalog"]
+
+    @action(description="Import catalog", url_path="import-catalog", permissions=["add", "change"])
+    def import_catalog(self, request):
+        form = CatalogImportForm(request.POST or None, request.FILES or None)
+        if request.method == "POST" and form.is_valid():
+            # Uploads are spooled to disk past FILE_UPLOAD_MAX_MEMORY_SIZE and read a batch at a time.
+            upload = form.cleaned_data["file"]
+            stream = io.TextIOWrapper(upload.file, encoding="utf-8-sig", newline="")
+            result = import_catalog(stream, form.cleaned_data["format"])
+            self.message_user(request, f"Imported {result}.", messages.SUCCESS)
+            for line, sku, message in result.errors:
+                self.message_user(request, f"Line {line} ({sku or 'no sku'}): {message}", messages.WARNING)
+            return redirect("admin:product_product_changelist")
+        context = {
+            **self.admin_site.each_context(request),
+            "opts": self.model._meta,
+            "title": "Import catalog",
+            "form": form,
+        }
+        return TemplateResponse(request, "admin/product/product/import_catalog.html", context)
 
 
 # ---------------------
@@ -100,18 +154,26 @@ class ProductAdmin(UnfoldAdmin):
 @admin.register(Discount)
 class DiscountAdmin(UnfoldAdmin):
     list_display = ("id", "title", "product", "percentage", "active", "start_date", "end_date", "created_at")
-    list_filter = ("active", "product")
+    # The product filter searches as you type instead of listing the whole catalog.
+    list_filter = ("active", ("product", AutocompleteSelectFilter))
+    list_filter_submit = True
+    list_select_related = ("product",)
+    autocomplete_fields = ("product",)
     search_fields = ("title", "product__name")
     readonly_fields = ("created_at",)
     actions = ["make_active", "make_inactive"]
 
     def make_active(self, request, queryset):
         updated = queryset.update(active=True)
+        Product.objects.filter(discounts__in=queryset).refresh_effective_price()
+        bump_catalog_version()
         self.message_user(request, f"{updated} discounts activated.")
     make_active.short_description = "Mark selected discounts active"
 
     def make_inactive(self, request, queryset):
         updated = queryset.update(active=False)
+        Product.objects.filter(discounts__in=queryset).refresh_effective_price()
+        bump_catalog_version()
         self.message_user(request, f"{updated} discounts deactivated.")
     make_inactive.short_description = "Mark selected discounts inactive"
 
@@ -122,6 +184,8 @@ class DiscountAdmin(UnfoldAdmin):
 @admin.register(Wishlist)
 class WishlistAdmin(UnfoldAdmin):
     list_display = ("id", "user", "product", "created_at")
+    list_select_related = ("user", "product")
+    autocomplete_fields = ("user", "product")
     search_fields = ("user__username", "product__name")
 
 
@@ -133,6 +197,8 @@ class ReviewAdmin(UnfoldAdmin):
     list_display = ("id", "product", "user", "rating", "short_comment", "created_at")
     search_fields = ("product__name", "user__username", "comment")
     list_filter = ("rating",)
+    list_select_related = ("product", "user")
+    autocomplete_fields = ("product", "user")
 
     def short_comment(self, obj):
         if obj.comment:
@@ -149,6 +215,7 @@ class CartItemInline(admin.TabularInline):
     extra = 0
     readonly_fields = ("total_price",)
     fields = ("product", "quantity", "total_price")
+    autocomplete_fields = ("product",)
 
 
 @admin.register(Cart)
@@ -157,13 +224,21 @@ class CartAdmin(UnfoldAdmin):
     search_fields = ("user__username",)
     inlines = [CartItemInline]
     readonly_fields = ("created_at",)
+    list_select_related = ("user",)
+    autocomplete_fields = ("user",)
+
+    def get_queryset(self, request):
+        # Price every cart on the page from one batch of items, products and discounts.
+        items = Prefetch('items', queryset=pricing_queryset(CartItem.objects.order_by('pk')))
+        return super().get_queryset(request).annotate(line_count=Count('items')).prefetch_related(items)
 
     def total_items(self, obj):
-        return obj.items.count()
+        return obj.line_count
     total_items.short_description = "Items"
+    total_items.admin_order_field = "line_count"
 
     def total_value(self, obj):
-        return sum(i.total_price for i in obj.items.all())
+        return price_items(obj.items.all()).total
     total_value.short_description = "Total value"
 
 
@@ -0,0 +1,129 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Min, Q
+from django.utils import timezone
+from rest_framework.response import Response
+
+VERSION_KEY = 'catalog:version'
+HITS_KEY = 'catalog:hits'
+MISSES_KEY = 'catalog:misses'
+
+
+def get_catalog_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        # Start from the clock rather than 1 so a version evicted from the
+        # cache never comes back as a number that old entries were stored under.
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def _bump():
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        get_catalog_version()
+
+
+def bump_catalog_version():
+    """
+    Invalidate every cached catalog response. Bumps now and again once the
+    surrounding transaction commits, so a read racing the write cannot
+    re-cache the old rows under the new version.
+    """
+    _bump()
+    transaction.on_commit(_bump)
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key)
+
+
+def get_cache_stats():
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'version': get_catalog_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+    }
+
+
+def reset_cache_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def next_discount_boundary(version):
+    """
+    The next moment an active discount starts or ends. Cached per catalog
+    version: any discount write bumps the version, and once the stored
+    boundary has passed it is looked up again.
+    """
+    key = f'catalog:{version}:boundary'
+    now = timezone.now()
+    boundary = cache.get(key)
+    if boundary is not None and (boundary == 'none' or boundary > now):
+        return None if boundary == 'none' else boundary
+
+    from .models import Discount
+    bounds = Discount.objects.filter(active=True).aggregate(
+        start=Min('start_date', filter=Q(start_date__gt=now)),
+        end=Min('end_date', filter=Q(end_date__gt=now)),
+    )
+    upcoming = [value for value in bounds.values() if value is not None]
+    boundary = min(upcoming) if upcoming else None
+    cache.set(key, boundary or 'none', None)
+    return boundary
+
+
+class CatalogCacheMixin:
+    """
+    Cache list/retrieve responses of catalog viewsets under the catalog
+    version, keyed on the full request URL. Writes bump the version through
+    signals (see product.signals); entries also expire no later than the
+    next discount start or end so cached prices never outlive a window.
+    """
+
+    def get_cache_timeout(self):
+        return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+    def cached_response(self, request, handler, *args, **kwargs):
+        timeout = self.get_cache_timeout()
+        if not timeout:
+            return handler(request, *args, **kwargs)
+
+        version = get_catalog_version()
+        url = hashlib.md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+        key = f'catalog:{version}:{self.basename}:{self.action}:{url}'
+
+        data = cache.get(key)
+        if data is not None:
+            _count(HITS_KEY)
+            return Response(data, headers={'X-Cache': 'HIT'})
+
+        _count(MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            boundary = next_discount_boundary(version)
+            if boundary is not None:
+                timeout = min(timeout, max(int((boundary - timezone.now()).total_seconds()), 1))
+            cache.set(key, response.data, timeout)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(request, super().retrieve, *args, **kwargs)
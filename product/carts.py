@@ -0,0 +1,176 @@
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Cart, CartItem, Product
+
+TOKEN_HEADER = 'X-Cart-Token'
+TOKEN_SALT = 'product.guest-cart'
+
+ADD, SET, REMOVE = 'add', 'set', 'remove'
+
+
+def apply_operations(quantities, operations):
+    """
+    Apply add / set / remove operations, in order, to a {product_id: quantity}
+    map. Returns the new map; a quantity of 0 means the line is removed.
+    """
+    quantities = dict(quantities)
+    for operation in operations:
+        product_id = operation['product']
+        if operation['op'] == ADD:
+            quantities[product_id] = quantities.get(product_id, 0) + operation.get('quantity', 1)
+        elif operation['op'] == SET:
+            quantities[product_id] = operation['quantity']
+        else:
+            quantities[product_id] = 0
+    return quantities
+
+
+def update_cart(cart, product_ids, change):
+    """
+    Rewrite the lines of `cart` for `product_ids` in one transaction.
+
+    `change` receives the current {product_id: quantity} of those products
+    and returns the wanted one (0 removes a line). The cart is written with
+    at most one DELETE and two bulk INSERT ... ON CONFLICT DO UPDATE.
+
+    The lines read are locked until the transaction ends, so their new
+    quantities are written as they are. Lines that did not exist are added
+    to (see CartItemQuerySet.add_quantity), so a concurrent request creating
+    the same line does not lose its quantity.
+    """
+    with transaction.atomic():
+        current = dict(
+            CartItem.objects.select_for_update().filter(cart=cart, product_id__in=product_ids)
+            .values_list('product_id', 'quantity')
+        )
+        quantities = change(current)
+
+        removed = [
+            product_id for product_id, quantity in quantities.items()
+            if not quantity and product_id in current
+        ]
+        updated = [
+            CartItem(cart=cart, product_id=product_id, quantity=quantity)
+            for product_id, quantity in quantities.items()
+            if quantity and product_id in current and quantity != current[product_id]
+        ]
+        added = {
+            product_id: quantity for product_id, quantity in quantities.items()
+            if quantity and product_id not in current
+        }
+        if removed:
+            CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+        if updated:
+            CartItem.objects.bulk_create(
+                updated, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity'],
+            )
+        CartItem.objects.add_quantities(cart.pk, added)
+    return cart
+
+
+class GuestCart:
+    """
+    Cart of an anonymous shopper, kept in the cache as {product_id: quantity}
+    under a random id. Clients hold the id as a signed token and send it
+    back in the X-Cart-Token header. Entries expire GUEST_CART_TTL seconds
+    after the last write.
+    """
+
+    def __init__(self, cart_id=None, items=None):
+        self.id = cart_id or uuid.uuid4().hex
+        self.items = items or {}
+
+    @staticmethod
+    def cache_key(cart_id):
+        return f'guest-cart:{cart_id}'
+
+    @staticmethod
+    def ttl():
+        return getattr(settings, 'GUEST_CART_TTL', 7 * 24 * 60 * 60)
+
+    @property
+    def token(self):
+        return signing.Signer(salt=TOKEN_SALT).sign(self.id)
+
+    @classmethod
+    def from_token(cls, token):
+        """The guest cart of a token, or None if the token is forged or the cart expired."""
+        if not token:
+            return None
+        try:
+            cart_id = signing.Signer(salt=TOKEN_SALT).unsign(token)
+        except signing.BadSignature:
+            return None
+        items = cache.get(cls.cache_key(cart_id))
+        return cls(cart_id, items) if items is not None else None
+
+    @classmethod
+    def from_request(cls, request):
+        return cls.from_token(request.headers.get(TOKEN_HEADER))
+
+    def save(self):
+        self.items = {product_id: quantity for product_id, quantity in self.items.items() if quantity}
+        cache.set(self.cache_key(self.id), self.items, self.ttl())
+
+    def delete(self):
+        cache.delete(self.cache_key(self.id))
+
+
+def merge_quantities(current, incoming, stock):
+    """
+    Merge rules for a guest cart joining a user's cart:
+
+    * a product in both carts gets the sum of both quantities;
+    * the sum is capped at the product's current stock, but never below
+      what the user's cart already held;
+    * products that no longer exist are dropped.
+    """
+    merged = dict(current)
+    for product_id, quantity in incoming.items():
+        if product_id not in stock:
+            continue
+        held = current.get(product_id, 0)
+        merged[product_id] = max(held, min(held + quantity, stock[product_id]))
+    return merged
+
+
+def merge_guest_cart(user, guest):
+    """Move a guest cart into `user`'s cart in one batch and drop it from the cache."""
+    if guest.items:
+        stock = dict(Product.objects.filter(pk__in=guest.items).values_list('pk', 'amount'))
+        with transaction.atomic():
+            cart = Cart.objects.filter(user=user).order_by('pk').first() or Cart.objects.create(user=user)
+            update_cart(cart, list(guest.items), lambda current: merge_quantities(current, guest.items, stock))
+    guest.delete()
+
+
+def merge_request_guest_cart(request):
+    """Merge the guest cart of the X-Cart-Token header, if any, into the authenticated user's cart."""
+    guest = GuestCart.from_request(request)
+    if guest is not None and request.user.is_authenticated:
+        merge_guest_cart(request.user, guest)
+
+
+def get_user_cart(request):
+    """
+    The authenticated user's cart, or None if they have none yet. Views
+    merge a pending guest cart into it first (GuestCartMergeMixin).
+    """
+    return Cart.objects.filter(user=request.user).order_by('pk').first()
+
+
+class GuestCartMergeMixin:
+    """
+    Merge the guest cart of the X-Cart-Token header into the user's cart
+    before any authenticated request of the view, so a shopper who logs in
+    keeps their guest lines whichever cart endpoint they use first.
+    """
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        merge_request_guest_cart(request)
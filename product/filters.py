@@ -1,10 +1,70 @@
 import django_filters
+from django.conf import settings
+from django.db.models import Func, IntegerField
+from rest_framework import filters
 from .models import Product
+from .search import get_search_engine
 
 class ProductFilter(django_filters.FilterSet):
     min_price = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
     max_price = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
+    min_effective_price = django_filters.NumberFilter(field_name='effective_price', lookup_expr='gte')
+    max_effective_price = django_filters.NumberFilter(field_name='effective_price', lookup_expr='lte')
 
     class Meta:
         model = Product
-        fields = ['category', 'rating', 'discounts__active', 'min_price', 'max_price']
\ No newline at end of file
+        fields = ['category', 'rating', 'discounts__active', 'min_price', 'max_price',
+                  'min_effective_price', 'max_effective_price']
+
+
+class ProductExportFilter(ProductFilter):
+    created = django_filters.DateFromToRangeFilter(field_name='created_at')
+
+    class Meta(ProductFilter.Meta):
+        fields = ProductFilter.Meta.fields + ['is_available']
+
+
+class ListPosition(Func):
+    """Index of `expression` in `values`, compiled to one flat CASE ... WHEN."""
+    output_field = IntegerField()
+
+    def __init__(self, expression, values):
+        super().__init__(expression)
+        self.values = list(values)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        whens = ' '.join(['WHEN %s THEN %s'] * len(self.values))
+        positions = [param for item in enumerate(self.values) for param in item[::-1]]
+        return f'CASE {sql} {whens} END', (*params, *positions)
+
+
+class ProductSearchFilter(filters.SearchFilter):
+    """
+    `?search=` backed by the product search engine instead of LIKE scans.
+
+    Matches are annotated with `search_rank` (0 = most relevant) and ordered
+    by it unless the client asked for an explicit `?ordering=`, so place this
+    backend after OrderingFilter.
+
+    At most PRODUCT_SEARCH_MAX_RESULTS matches are returned, the most
+    relevant among the products the earlier backends let through: a filtered
+    queryset is handed to the engine, so a filter cannot empty the capped set.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+
+        limit = getattr(settings, 'PRODUCT_SEARCH_MAX_RESULTS', 1000)
+        # An unfiltered queryset holds the whole catalog; skip the IN subquery then.
+        within = queryset if queryset.query.where else None
+        ids = get_search_engine().search(' '.join(terms), limit, within)
+        if not ids:
+            return queryset.none()
+
+        queryset = queryset.filter(pk__in=ids).annotate(search_rank=ListPosition('pk', ids))
+        if not request.query_params.get(filters.OrderingFilter.ordering_param):
+            queryset = queryset.order_by('search_rank')
+        return queryset
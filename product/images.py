@@ -0,0 +1,179 @@
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from PIL import Image as PILImage, ImageOps
+
+from .cache import bump_catalog_version
+from .models import Banner, Image
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = {'small': 160, 'medium': 480, 'large': 960}
+
+_executor = None
+
+
+def derivative_sizes():
+    """{name: longest edge in pixels} of the derivatives generated for every upload."""
+    return getattr(settings, 'IMAGE_DERIVATIVE_SIZES', DEFAULT_SIZES)
+
+
+def derivative_format():
+    return getattr(settings, 'IMAGE_DERIVATIVE_FORMAT', 'WEBP')
+
+
+def derivative_name(name, size):
+    """'images/products/a.png' -> 'derivatives/images/products/a_small.webp'"""
+    stem = posixpath.splitext(name)[0]
+    return f'derivatives/{stem}_{size}.{derivative_format().lower()}'
+
+
+def derivative_urls(file, ready, request=None, storage=None):
+    """
+    Per-size URLs of the derivatives of an uploaded `file` (a FieldFile or a
+    stored name). Until they are `ready` (the row's derivatives_ready) every
+    size points at the original instead.
+    """
+    name = getattr(file, 'name', file)
+    if not name:
+        return None
+    storage = storage or getattr(file, 'storage', None) or default_storage
+    urls = {}
+    for size in derivative_sizes():
+        url = storage.url(derivative_name(name, size) if ready else name)
+        urls[size] = request.build_absolute_uri(url) if request is not None else url
+    return urls
+
+
+def derivatives_known_ready(name):
+    """Whether another image or banner using the stored file `name` has its derivatives ready."""
+    return any(model.objects.filter(image=name, derivatives_ready=True).exists() for model in (Image, Banner))
+
+
+def mark_derivatives_ready(names):
+    """Record that the derivatives of the stored images `names` exist, on every row using them."""
+    marked = sum(
+        model.objects.filter(image__in=names, derivatives_ready=False).update(derivatives_ready=True)
+        for model in (Image, Banner)
+    )
+    if marked:
+        # Cached responses still point at the original.
+        bump_catalog_version()
+    return marked
+
+
+def generate_derivatives(name, storage=None, overwrite=False):
+    """
+    Render every configured size of the stored image `name`. Returns the
+    names written; callers record the rows ready (mark_derivatives_ready).
+    """
+    storage = storage or default_storage
+    targets = {
+        size: derivative_name(name, size) for size in derivative_sizes()
+        if overwrite or not storage.exists(derivative_name(name, size))
+    }
+    if not targets:
+        return []
+
+    with storage.open(name, 'rb') as source:
+        original = ImageOps.exif_transpose(PILImage.open(source))
+        original.load()
+    mode = 'RGBA' if original.mode in ('RGBA', 'LA', 'P') else 'RGB'
+    original = original.convert(mode)
+
+    written = []
+    for size, target in targets.items():
+        edge = derivative_sizes()[size]
+        image = original.copy()
+        image.thumbnail((edge, edge), PILImage.Resampling.LANCZOS)
+        buffer = BytesIO()
+        image.save(buffer, format=derivative_format(), quality=80, method=4)
+        if storage.exists(target):
+            storage.delete(target)
+        written.append(storage.save(target, ContentFile(buffer.getvalue())))
+    return written
+
+
+def _generate_safely(name, storage, overwrite=False):
+    try:
+        written = generate_derivatives(name, storage, overwrite)
+        mark_derivatives_ready([name])
+        return written
+    except Exception:
+        logger.exception("Could not generate derivatives of %s", name)
+        return []
+
+
+def _generate_in_worker(name, storage, overwrite=False):
+    try:
+        return _generate_safely(name, storage, overwrite)
+    finally:
+        # Pool threads outlive the job; do not leave their connections open.
+        connections.close_all()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2),
+            thread_name_prefix='image-derivatives',
+        )
+    return _executor
+
+
+def schedule_derivatives(file):
+    """
+    Generate the derivatives of an uploaded FieldFile on the worker pool once
+    the surrounding transaction commits. With IMAGE_DERIVATIVE_WORKERS = 0
+    they are generated inline instead.
+    """
+    if not file:
+        return
+    name, storage = file.name, file.storage
+
+    def submit():
+        if getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2) == 0:
+            _generate_safely(name, storage, overwrite=True)
+        else:
+            get_executor().submit(_generate_in_worker, name, storage, True)
+    transaction.on_commit(submit)
+
+
+def delete_derivatives(name, storage=None):
+    """Remove the stored derivatives of the image `name`. Returns the names deleted."""
+    storage = storage or default_storage
+    deleted = []
+    for size in derivative_sizes():
+        target = derivative_name(name, size)
+        if storage.exists(target):
+            storage.delete(target)
+            deleted.append(target)
+    return deleted
+
+
+def schedule_derivative_cleanup(name, storage):
+    """
+    Delete the derivatives of the stored image `name`, removed or replaced,
+    once the surrounding transaction commits, unless another image or
+    banner still uses the same file.
+    """
+    def cleanup():
+        if Image.objects.filter(image=name).exists() or Banner.objects.filter(image=name).exists():
+            return
+        try:
+            delete_derivatives(name, storage)
+        except Exception:
+            logger.exception("Could not delete derivatives of %s", name)
+    transaction.on_commit(cleanup)
+
+
+def preview_url(file, ready, size='small'):
+    """URL of a derivative for admin previews, or of the original until they are `ready`."""
+    return file.storage.url(derivative_name(file.name, size)) if ready else file.url
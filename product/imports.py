@@ -0,0 +1,278 @@
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+from rest_framework import serializers
+
+from .cache import bump_catalog_version
+from .models import Category, Discount, Image, Product
+from .search import get_search_engine
+
+CSV, JSONL = 'csv', 'jsonl'
+FORMATS = {'.csv': CSV, '.jsonl': JSONL, '.ndjson': JSONL}
+# Product columns a row may set; anything it leaves out keeps its stored value.
+PRODUCT_FIELDS = ['name', 'brand', 'description', 'price', 'amount', 'is_available', 'category']
+# What an upsert writes for an existing product: its current value of every
+# column a row may set, overridden by the row.
+UPSERT_COLUMNS = ['sku', 'name', 'brand', 'description', 'price', 'amount', 'is_available', 'category_id']
+REQUIRED_FOR_NEW = ['name', 'brand', 'price', 'amount', 'category']
+MAX_ERRORS = 100
+
+
+class CatalogRowSerializer(serializers.Serializer):
+    """
+    One supplier catalog line. CSV columns and JSONL keys are the field
+    names; `images` is a list of stored file names ('|'-separated in CSV).
+    A discount is given by its percentage, window and optional title.
+    """
+    sku = serializers.CharField(max_length=64)
+    name = serializers.CharField(max_length=200, required=False)
+    brand = serializers.CharField(max_length=50, required=False)
+    description = serializers.CharField(required=False, allow_blank=True)
+    category = serializers.CharField(max_length=31, required=False)
+    price = serializers.FloatField(min_value=0.0, required=False)
+    amount = serializers.IntegerField(min_value=0, max_value=32767, required=False)
+    is_available = serializers.BooleanField(required=False)
+    discount_title = serializers.CharField(max_length=200, required=False)
+    discount_percentage = serializers.FloatField(min_value=0.0, max_value=100.0, required=False)
+    discount_start = serializers.DateTimeField(required=False)
+    discount_end = serializers.DateTimeField(required=False)
+    images = serializers.ListField(child=serializers.CharField(max_length=100), required=False)
+
+    def validate(self, attrs):
+        window = ['discount_percentage', 'discount_start', 'discount_end']
+        given = [name for name in window if name in attrs]
+        if given and len(given) < len(window):
+            raise serializers.ValidationError("A discount needs discount_percentage, discount_start and discount_end.")
+        if given and attrs['discount_end'] <= attrs['discount_start']:
+            raise serializers.ValidationError("discount_end must be after discount_start.")
+        return attrs
+
+
+def read_rows(stream, format):
+    """
+    Yield (line number, raw row dict) from a text stream, one line at a
+    time. Blank CSV cells are left out; unreadable JSON lines are yielded
+    as a string for the validator to reject.
+    """
+    if format == CSV:
+        for line, row in enumerate(csv.DictReader(stream), 2):
+            row = {key: value for key, value in row.items() if key and value not in ('', None)}
+            if 'images' in row:
+                row['images'] = [name for name in row['images'].split('|') if name]
+            yield line, row
+        return
+    for line, text in enumerate(stream, 1):
+        if not text.strip():
+            continue
+        try:
+            yield line, json.loads(text)
+        except ValueError as exc:
+            yield line, f"Invalid JSON: {exc}"
+
+
+def error_text(errors):
+    """Flatten serializer errors into 'field: message; ...'."""
+    return '; '.join(
+        f"{field}: {' '.join(str(message) for message in messages)}" if field != 'non_field_errors'
+        else ' '.join(str(message) for message in messages)
+        for field, messages in errors.items()
+    )
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = self.created = self.updated = self.discounts = self.images = 0
+        self.error_count = 0
+        # The first MAX_ERRORS (line, sku, message); the rest are only counted.
+        self.errors = []
+
+    def error(self, line, sku, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((line, sku, message))
+
+    def __str__(self):
+        return (
+            f"{self.rows} rows: {self.created} products created, {self.updated} updated, "
+            f"{self.discounts} discounts and {self.images} images written, {self.error_count} rows rejected"
+        )
+
+
+class CatalogImporter:
+    """
+    Upsert products, with their discount and images, from a stream of
+    catalog rows, keyed by Product.sku.
+
+    Rows are read and written `batch_size` at a time, each batch in its own
+    transaction with a fixed number of queries: the batch is validated
+    against the products it touches, then written with bulk_create and
+    bulk_update. Bulk writes send no model signals, so their side effects
+    run once per batch instead of once per row (effective prices, search
+    index) or once at the end (catalog cache). Memory stays bounded by the
+    batch size however long the input is.
+    """
+
+    def __init__(self, batch_size=1000, progress=None):
+        self.batch_size = batch_size
+        self.progress = progress
+        self.result = ImportResult()
+        # One unbound serializer validates every row, the way ListSerializer
+        # reuses its child; building one per row would copy its fields each time.
+        self.validator = CatalogRowSerializer()
+        # Category name -> Category, filled as names are met.
+        self.categories = {}
+
+    def run(self, stream, format):
+        for batch in chunked(read_rows(stream, format), self.batch_size):
+            self.import_batch(batch)
+            if self.progress:
+                self.progress(self.result)
+        if self.result.created or self.result.updated:
+            bump_catalog_version()
+        return self.result
+
+    def validate(self, batch):
+        """Field-level validation; returns {sku: (line, data)}, later lines winning."""
+        rows = {}
+        for line, raw in batch:
+            self.result.rows += 1
+            if not isinstance(raw, dict):
+                self.result.error(line, None, raw if isinstance(raw, str) else "Expected an object.")
+                continue
+            try:
+                data = self.validator.run_validation(raw)
+            except serializers.ValidationError as exc:
+                self.result.error(line, raw.get('sku'), error_text(exc.detail))
+            else:
+                rows[data['sku']] = (line, data)
+        return rows
+
+    def resolve_categories(self, names):
+        missing = set(names) - set(self.categories)
+        if missing:
+            self.categories.update(
+                (category.name, category) for category in Category.objects.filter(name__in=missing).order_by('-pk')
+            )
+            new = [Category(name=name) for name in missing - set(self.categories)]
+            self.categories.update((category.name, category) for category in Category.objects.bulk_create(new))
+
+    def import_batch(self, batch):
+        rows = self.validate(batch)
+        if not rows:
+            return
+        with transaction.atomic():
+            existing = {
+                row['sku']: row for row in Product.objects.filter(sku__in=rows).values('id', *UPSERT_COLUMNS)
+            }
+            for sku, (line, data) in list(rows.items()):
+                missing = [name for name in REQUIRED_FOR_NEW if name not in data]
+                if sku not in existing and missing:
+                    self.result.error(line, sku, f"New products need {', '.join(missing)}.")
+                    del rows[sku]
+            self.resolve_categories({data['category'] for _, data in rows.values() if 'category' in data})
+
+            created, updated, fields = [], [], set()
+            for sku, (_, data) in rows.items():
+                values = {name: data[name] for name in PRODUCT_FIELDS if name in data}
+                if 'category' in values:
+                    values['category_id'] = self.categories[values.pop('category')].pk
+                if sku not in existing:
+                    created.append(Product(sku=sku, effective_price=values['price'], **values))
+                    continue
+                stored = {name: value for name, value in existing[sku].items() if name != 'id'}
+                updated.append(Product(**{**stored, **values}))
+                fields.update(values)
+            Product.objects.bulk_create(created)
+            if updated and fields:
+                # Rows carry every column a batch may set, so one INSERT ... ON
+                # CONFLICT (sku) DO UPDATE rewrites them; bulk_update's per-column
+                # CASE grows with the batch on every row it touches.
+                Product.objects.bulk_create(
+                    updated, update_conflicts=True, unique_fields=['sku'],
+                    update_fields=sorted(name.removesuffix('_id') for name in fields),
+                )
+            for product in updated:
+                product.pk = existing[product.sku]['id']
+            products = {product.sku: product for product in created + updated}
+
+            self.write_discounts(rows, products)
+            self.write_images(rows, products)
+
+            touched = Product.objects.filter(pk__in=[product.pk for product in products.values()])
+            touched.refresh_effective_price()
+            get_search_engine().index(touched.select_related('category'))
+
+        self.result.created += len(created)
+        self.result.updated += len(updated)
+
+    def write_discounts(self, rows, products):
+        """
+        Upsert each row's discount by (product, title), refusing windows that
+        overlap another active one. Unchanged discounts are not rewritten.
+        """
+        wanted = {
+            sku: data for sku, (_, data) in rows.items() if 'discount_percentage' in data
+        }
+        if not wanted:
+            return
+        product_ids = [products[sku].pk for sku in wanted]
+        current = {}
+        for discount in Discount.objects.filter(product__in=product_ids):
+            current.setdefault(discount.product_id, []).append(discount)
+
+        created, updated = [], []
+        for sku, data in wanted.items():
+            product = products[sku]
+            title = data.get('discount_title', 'Supplier discount')
+            start, end = data['discount_start'], data['discount_end']
+            others = current.get(product.pk, [])
+            if any(
+                other.active and other.title != title and other.start_date <= end and other.end_date >= start
+                for other in others
+            ):
+                self.result.error(rows[sku][0], sku, "The discount overlaps another active discount.")
+                continue
+            values = (data['discount_percentage'], start, end, True)
+            discount = next((other for other in others if other.title == title), None)
+            if discount is None:
+                discount = Discount(product=product, title=title)
+                created.append(discount)
+            elif (discount.percentage, discount.start_date, discount.end_date, discount.active) != values:
+                updated.append(discount)
+            else:
+                continue
+            discount.percentage, discount.start_date, discount.end_date, discount.active = values
+        Discount.objects.bulk_create(created)
+        # bulk_update's CASE per column is as long as its batch, so keep batches short.
+        Discount.objects.bulk_update(updated, ['percentage', 'start_date', 'end_date', 'active'], batch_size=100)
+        self.result.discounts += len(created) + len(updated)
+
+    def write_images(self, rows, products):
+        """Attach image names a product does not have yet; existing images are kept."""
+        wanted = {sku: data['images'] for sku, (_, data) in rows.items() if data.get('images')}
+        if not wanted:
+            return
+        have = set(
+            Image.objects.filter(product__in=[products[sku].pk for sku in wanted]).values_list('product_id', 'image')
+        )
+        images = []
+        for sku, names in wanted.items():
+            product_id = products[sku].pk
+            for name in dict.fromkeys(names):
+                if (product_id, name) not in have:
+                    images.append(Image(product_id=product_id, image=name))
+        Image.objects.bulk_create(images)
+        self.result.images += len(images)
+
+
+def import_catalog(stream, format, batch_size=1000, progress=None):
+    """Import a CSV or JSONL catalog text stream; see CatalogImporter."""
+    return CatalogImporter(batch_size, progress).run(stream, format)
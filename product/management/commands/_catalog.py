@@ -0,0 +1,54 @@
+"""Synthetic catalog shared by the bench_* commands."""
+import random
+from datetime import timedelta
+
+from django.utils import timezone
+
+from product.models import Category, Discount, Image, Product
+from product.search import get_search_engine
+
+WORDS = [
+    'phone', 'laptop', 'cable', 'charger', 'case', 'screen', 'watch', 'speaker',
+    'camera', 'keyboard', 'mouse', 'monitor', 'router', 'tablet', 'headphones',
+    'drone', 'printer', 'lamp', 'kettle', 'blender', 'bottle', 'jacket', 'shoes',
+]
+BRANDS = ['Apple', 'Samsung', 'Xiaomi', 'Sony', 'Philips', 'Bosch', 'Lenovo', 'Asus']
+
+
+def seed_catalog(count, with_extras=False, batch_size=5000):
+    """
+    Bulk-create `count` products. `with_extras` adds a running discount to
+    every third product and an image to every second one. Signals are not
+    sent, so the search index is rebuilt at the end and effective prices
+    are refreshed. Call inside a transaction that the caller rolls back.
+    """
+    rng = random.Random(42)
+    categories = Category.objects.bulk_create(Category(name=word.title()) for word in WORDS)
+    first_id = None
+    for start in range(0, count, batch_size):
+        products = []
+        for i in range(start, min(start + batch_size, count)):
+            price = round(rng.uniform(1, 1000), 2)
+            products.append(Product(
+                name=' '.join(rng.sample(WORDS, 3)) + f' {i}',
+                brand=rng.choice(BRANDS), price=price, effective_price=price, amount=10,
+                rating=round(rng.uniform(0, 5), 1), category=rng.choice(categories),
+                description=f'Synthetic product {i}',
+            ))
+        products = Product.objects.bulk_create(products)
+        first_id = first_id or products[0].pk
+        if with_extras:
+            now = timezone.now()
+            Discount.objects.bulk_create(
+                Discount(title='Sale', product=product, percentage=rng.choice([5, 10, 25]), active=True,
+                         start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+                for product in products[::3]
+            )
+            Image.objects.bulk_create(
+                Image(product=product, image=f'images/products/{product.pk}.jpg') for product in products[::2]
+            )
+    products = Product.objects.filter(pk__gte=first_id) if first_id else Product.objects.none()
+    if with_extras:
+        products.refresh_effective_price()
+    get_search_engine().rebuild()
+    return products
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from product.serializers import ProductSerializer, ProductValuesSerializer
+from ._catalog import seed_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Rows per second of ProductSerializer versus ProductValuesSerializer, "
+        "serializing the catalog page by page including the page queries. "
+        "The catalog is created inside a transaction and rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1_000, 10_000, 100_000])
+        parser.add_argument('--page-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get('/api/products/'))
+        context = {'request': request}
+        page_size = options['page_size']
+
+        with transaction.atomic():
+            products = seed_catalog(max(options['sizes']), with_extras=True).order_by('pk')
+            ids = list(products.values_list('pk', flat=True))
+
+            for size in options['sizes']:
+                pages = [ids[start:start + page_size] for start in range(0, size, page_size)]
+
+                start = time.perf_counter()
+                for page in pages:
+                    ProductSerializer(
+                        products.filter(pk__in=page).with_related(), many=True, context=context
+                    ).data
+                model_rate = size / (time.perf_counter() - start)
+
+                start = time.perf_counter()
+                for page in pages:
+                    ProductValuesSerializer(
+                        list(products.filter(pk__in=page).values(*ProductValuesSerializer.columns)),
+                        context=context,
+                    ).data
+                values_rate = size / (time.perf_counter() - start)
+
+                self.stdout.write(
+                    f"{size:>8} products  ProductSerializer {model_rate:>9,.0f} rows/s   "
+                    f"ProductValuesSerializer {values_rate:>9,.0f} rows/s   x{values_rate / model_rate:.1f}"
+                )
+            transaction.set_rollback(True)
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework import filters
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from product.filters import ProductSearchFilter
+from product.models import Product
+from product.views import ProductViewSet
+from ._catalog import seed_catalog
+
+QUERIES = ['phone', 'sam', 'sony camera', 'usb cable charger', 'zzz']
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare ProductSearchFilter with DRF's SearchFilter on a synthetic catalog. "
+        "The catalog is created inside a transaction and rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            seed_catalog(options['products'])
+            self.stdout.write(f"Seeded {options['products']} products.")
+            view = ProductViewSet(action='list', ordering=['-rating'])
+            for query in QUERIES:
+                request = Request(APIRequestFactory().get('/api/products/', {'search': query}))
+                like = self.time(filters.SearchFilter(), request, view, options['repeat'])
+                fts = self.time(ProductSearchFilter(), request, view, options['repeat'])
+                self.stdout.write(
+                    f"{query!r:22} SearchFilter {like * 1000:8.1f} ms   "
+                    f"ProductSearchFilter {fts * 1000:8.1f} ms   x{like / fts:.1f}"
+                )
+            transaction.set_rollback(True)
+
+    def time(self, backend, request, view, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            list(backend.filter_queryset(request, Product.objects.order_by('-rating'), view)[:20])
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
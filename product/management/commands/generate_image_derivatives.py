@@ -0,0 +1,45 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from product.images import generate_derivatives, mark_derivatives_ready
+from product.models import Banner, Image
+
+
+class Command(BaseCommand):
+    help = "Generate missing thumbnails and responsive derivatives for product images and banners."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--overwrite', action='store_true', help='Regenerate existing derivatives too.')
+
+    def handle(self, *args, **options):
+        jobs = [
+            (name, model._meta.get_field('image').storage)
+            for model in (Image, Banner)
+            for name in model.objects.exclude(image='').values_list('image', flat=True).iterator()
+        ]
+        written = failed = 0
+        done_names = []
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = [
+                (name, executor.submit(generate_derivatives, name, storage, options['overwrite']))
+                for name, storage in jobs
+            ]
+            for done, (name, future) in enumerate(futures, 1):
+                try:
+                    written += len(future.result())
+                    done_names.append(name)
+                except Exception as exc:
+                    failed += 1
+                    self.stderr.write(f"{name}: {exc}")
+                if done % 500 == 0:
+                    self.stdout.write(f"{done}/{len(jobs)} images processed")
+
+        # Recorded from this thread, in batches, once the files are all there.
+        for start in range(0, len(done_names), 500):
+            mark_derivatives_ready(done_names[start:start + 500])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {len(jobs)} images: {written} derivatives written, {failed} failed."
+        ))
@@ -0,0 +1,42 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from product.imports import FORMATS, import_catalog
+
+
+class Command(BaseCommand):
+    help = (
+        "Create or update products, their discount and images from a CSV or JSONL supplier "
+        "catalog, matching existing products by sku. The file is streamed in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                            help='Input format; guessed from the file extension by default.')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or FORMATS.get(os.path.splitext(path)[1].lower())
+        if format is None:
+            raise CommandError(f"Cannot tell the format of {path}; pass --format.")
+        try:
+            stream = open(path, encoding='utf-8-sig', newline='')
+        except OSError as exc:
+            raise CommandError(exc)
+
+        def progress(result):
+            self.stdout.write(f"{result.rows} rows read, {result.created} created, "
+                              f"{result.updated} updated, {result.error_count} rejected")
+
+        with stream:
+            result = import_catalog(stream, format, options['batch_size'], progress)
+        for line, sku, message in result.errors:
+            self.stderr.write(f"Line {line} ({sku or 'no sku'}): {message}")
+        if result.error_count > len(result.errors):
+            self.stderr.write(f"... and {result.error_count - len(result.errors)} more rejected rows.")
+        self.stdout.write(self.style.SUCCESS(f"Imported {result}."))
+        if result.images:
+            self.stdout.write("Run generate_image_derivatives to render thumbnails of the new images.")
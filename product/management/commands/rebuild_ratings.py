@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Coalesce
+
+from product.cache import bump_catalog_version
+from product.models import Product
+
+
+class Command(BaseCommand):
+    help = "Rebuild the review counters (rating_sum, rating_count, rating) of every product."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Only compare the stored counters with the reviews and fail on drift.',
+        )
+
+    def handle(self, *args, **options):
+        if options['verify']:
+            self.verify()
+            return
+        updated = Product.objects.recompute_ratings()
+        bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt ratings of {updated} products."))
+
+    def verify(self):
+        drifted = (
+            Product.objects
+            .annotate(actual_sum=Coalesce(Sum('reviews__rating'), 0), actual_count=Count('reviews'))
+            .filter(~Q(rating_sum=F('actual_sum')) | ~Q(rating_count=F('actual_count')))
+            .values_list('pk', 'rating_sum', 'actual_sum', 'rating_count', 'actual_count')
+        )
+        rows = list(drifted)
+        for pk, stored_sum, actual_sum, stored_count, actual_count in rows:
+            self.stdout.write(
+                f"Product {pk}: stored sum/count {stored_sum}/{stored_count}, "
+                f"reviews {actual_sum}/{actual_count}"
+            )
+        if rows:
+            raise CommandError(f"{len(rows)} products have drifted rating counters.")
+        self.stdout.write(self.style.SUCCESS("All rating counters match their reviews."))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from product.search import get_search_engine
+
+
+class Command(BaseCommand):
+    help = "Rebuild the product search index from the catalog."
+
+    def handle(self, *args, **options):
+        engine = get_search_engine()
+        engine.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {type(engine).__name__} index."))
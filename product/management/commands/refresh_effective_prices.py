@@ -0,0 +1,35 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from product.cache import bump_catalog_version
+from product.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute Product.effective_price. Schedule it every few minutes with "
+        "--since so discounts that started or ended since the last tick are applied."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--since', type=int, metavar='MINUTES',
+            help='Only refresh products whose discount window opened or closed in the last MINUTES.',
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options['since'] is not None:
+            now = timezone.now()
+            window = Q(discounts__start_date__range=(now - timedelta(minutes=options['since']), now)) | \
+                Q(discounts__end_date__range=(now - timedelta(minutes=options['since']), now))
+            products = Product.objects.filter(
+                pk__in=Product.objects.filter(window).values('pk')
+            )
+        updated = products.refresh_effective_price()
+        if updated:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(f"Refreshed effective price of {updated} products."))
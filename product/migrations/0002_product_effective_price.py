@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:52
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+
+def populate_effective_price(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    Discount = apps.get_model('product', 'Discount')
+    now = timezone.now()
+    best = (
+        Discount.objects.filter(
+            product=OuterRef('pk'), active=True, start_date__lte=now, end_date__gte=now
+        )
+        .order_by('-percentage')
+        .values('percentage')[:1]
+    )
+    discounted = Round(F('price') * (Value(1.0) - Subquery(best) / Value(100.0)), 2)
+    Product.objects.update(effective_price=Coalesce(discounted, F('price')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.FloatField(db_index=True, default=0.0, editable=False),
+        ),
+        migrations.RunPython(populate_effective_price, migrations.RunPython.noop),
+    ]
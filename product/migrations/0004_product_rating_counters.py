@@ -0,0 +1,43 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:58
+
+from django.db import migrations, models
+from django.db.models import Count, FloatField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
+
+
+def populate_rating_counters(apps, schema_editor):
+    Product = apps.get_model('product', 'Product')
+    Review = apps.get_model('product', 'Review')
+    reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+    total = Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0)
+    count = Coalesce(Subquery(reviews.annotate(count=Count('pk')).values('count')), 0)
+    Product.objects.update(
+        rating_sum=total,
+        rating_count=count,
+        rating=Coalesce(
+            Round(Cast(total, FloatField()) / NullIf(count, Value(0)), 1),
+            Value(0.0),
+            output_field=FloatField(),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0003_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(populate_rating_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:21
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_cart_items(apps, schema_editor):
+    """Fold duplicate (cart, product) lines into the oldest one, summing quantities."""
+    CartItem = apps.get_model('product', 'CartItem')
+    duplicates = (
+        CartItem.objects.values('cart', 'product')
+        .annotate(lines=Count('pk'), keep=Min('pk'), total=Sum('quantity'))
+        .filter(lines__gt=1)
+    )
+    for row in list(duplicates):
+        CartItem.objects.filter(pk=row['keep']).update(quantity=row['total'])
+        CartItem.objects.filter(cart=row['cart'], product=row['product']).exclude(pk=row['keep']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0005_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_cart_items, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='cartitem',
+            name='cartitem_cart_product_idx',
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cartitem_cart_product_uniq'),
+        ),
+    ]
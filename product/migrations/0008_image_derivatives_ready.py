@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product', '0007_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='banner',
+            name='derivatives_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='derivatives_ready',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -1,14 +1,17 @@
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
-from django.db.models import Avg
+from django.db import connection, models, transaction
+from django.db.models import Count, F, FloatField, OuterRef, Prefetch, Subquery, Sum, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Round
 from users.models import User
 
 # --- Category ---
 class Banner(models.Model):
     title = models.CharField(max_length=31)
     image = models.ImageField(upload_to='banners/')
+    # Set once the derivatives of `image` are stored (see product.images).
+    derivatives_ready = models.BooleanField(default=False, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -21,8 +24,52 @@ class Category(models.Model):
 
 
 # --- Product ---
+class ProductQuerySet(models.QuerySet):
+    def with_related(self, fields=None):
+        """Batch-load what ProductSerializer reads for a page of products (see product_prefetches)."""
+        return self.prefetch_related(*product_prefetches(fields=fields))
+
+    def refresh_effective_price(self):
+        """Recompute the stored `effective_price` of these products in one UPDATE."""
+        best = (
+            Discount.objects.running()
+            .filter(product=OuterRef('pk'))
+            .order_by('-percentage')
+            .values('percentage')[:1]
+        )
+        discounted = Round(F('price') * (Value(1.0) - Subquery(best) / Value(100.0)), 2)
+        return self.update(effective_price=Coalesce(discounted, F('price')))
+
+    def apply_rating_change(self, sum_delta, count_delta):
+        """
+        Shift the running review counters with one atomic UPDATE and derive
+        `rating` from them in the same statement.
+        """
+        total = F('rating_sum') + sum_delta
+        count = F('rating_count') + count_delta
+        return self.update(rating_sum=total, rating_count=count, rating=average_rating(total, count))
+
+    def recompute_ratings(self):
+        """Rebuild the review counters of these products from their reviews in one UPDATE."""
+        reviews = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+        total = Coalesce(Subquery(reviews.annotate(total=Sum('rating')).values('total')), 0)
+        count = Coalesce(Subquery(reviews.annotate(count=Count('pk')).values('count')), 0)
+        return self.update(rating_sum=total, rating_count=count, rating=average_rating(total, count))
+
+
+def average_rating(total, count):
+    """`total / count` rounded to one decimal, or 0.0 without reviews."""
+    return Coalesce(
+        Round(Cast(total, FloatField()) / NullIf(count, Value(0)), 1),
+        Value(0.0),
+        output_field=FloatField(),
+    )
+
+
 class Product(models.Model):
     name = models.CharField(max_length=200)
+    # Supplier stock-keeping unit; catalog imports match existing products by it.
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     brand = models.CharField(max_length=50)
     description = models.TextField(blank=True, null=True)
     price = models.FloatField(validators=[MinValueValidator(0.0)])
@@ -30,26 +77,49 @@ class Product(models.Model):
     rating = models.FloatField(
         validators=[MinValueValidator(0.0), MaxValueValidator(5.0),], default=0.0
     )
+    # Running review totals; `rating` is derived from them (see product.signals).
+    rating_sum = models.IntegerField(default=0, editable=False)
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    # Price after the currently running discount; kept in sync by signals and
+    # the `refresh_effective_prices` command so it can be filtered and sorted in SQL.
+    effective_price = models.FloatField(default=0.0, db_index=True, editable=False)
     is_available = models.BooleanField(default=True)
     category = models.ForeignKey('Category', on_delete=models.CASCADE, related_name='products')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ProductQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Category pages: filter by category/availability, default -rating order.
+            models.Index(fields=['category', 'is_available', '-rating'], name='product_cat_avail_rating_idx'),
+            # Unfiltered list under each allowed ordering; the pk tiebreaker
+            # used by KeysetPagination rides on the implicit rowid suffix.
+            models.Index(fields=['rating'], name='product_rating_idx'),
+            models.Index(fields=['price'], name='product_price_idx'),
+            models.Index(fields=['created_at'], name='product_created_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or 'price' in update_fields:
+            self.effective_price = self.discounted_price if self.pk else self.price
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'effective_price'}
+        super().save(*args, **kwargs)
+
     def update_rating(self):
-        avg = self.reviews.aggregate(Avg('rating'))['rating__avg'] or 0
-        self.rating = round(avg, 1)
-        self.save(update_fields=["rating"])
+        """Recount this product's reviews from scratch."""
+        Product.objects.filter(pk=self.pk).recompute_ratings()
+        self.refresh_from_db(fields=['rating', 'rating_sum', 'rating_count'])
 
 
     def get_active_discount(self):
         """Return the active discount object if any, otherwise None."""
-        now = timezone.now()
-        return (
-            self.discounts.filter(
-                active=True,
-                start_date__lte=now,
-                end_date__gte=now
-            ).order_by('-percentage').first()
-        )
+        if hasattr(self, 'active_discounts'):
+            # Loaded in bulk by active_discount_prefetch().
+            return self.active_discounts[0] if self.active_discounts else None
+        return self.discounts.running().order_by('-percentage').first()
 
     @property
     def discounted_price(self):
@@ -65,6 +135,13 @@ class Product(models.Model):
         return self.name
 
 
+class DiscountQuerySet(models.QuerySet):
+    def running(self, now=None):
+        """Discounts that are switched on and whose window contains `now`."""
+        now = now or timezone.now()
+        return self.filter(active=True, start_date__lte=now, end_date__gte=now)
+
+
 class Discount(models.Model):
     title = models.CharField(max_length=200)
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='discounts')
@@ -76,6 +153,14 @@ class Discount(models.Model):
     active = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = DiscountQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # get_active_discount(), active_discount_prefetch() and clean().
+            models.Index(fields=['product', 'active', 'start_date', 'end_date'], name='discount_running_idx'),
+        ]
+
     def clean(self):
         super().clean()
         if self.end_date <= self.start_date:
@@ -93,9 +178,37 @@ class Discount(models.Model):
     def __str__(self):
         return f"{self.title} - {self.percentage}%"
 
+def active_discount_prefetch(lookup='discounts'):
+    """
+    Prefetch the running discounts of every product reached through `lookup`
+    into `product.active_discounts`, best first, in a single query.
+    """
+    return Prefetch(
+        lookup,
+        queryset=Discount.objects.running().order_by('-percentage'),
+        to_attr='active_discounts',
+    )
+
+
+def product_prefetches(prefix='', fields=None):
+    """
+    Prefetch lookups for ProductSerializer, optionally through a relation.
+    With a `fields` selection only the lookups those fields read are returned.
+    """
+    path = f'{prefix}__' if prefix else ''
+    lookups = []
+    if fields is None or {'active_discount', 'discounted_price'} & set(fields):
+        lookups.append(active_discount_prefetch(f'{path}discounts'))
+    if fields is None or 'images' in fields:
+        lookups.append(f'{path}image_set')
+    return lookups
+
+
 class Image(models.Model):
     product=models.ForeignKey(Product,on_delete=models.CASCADE)
     image=models.ImageField(upload_to='images/products')
+    # Set once the derivatives of `image` are stored (see product.images).
+    derivatives_ready = models.BooleanField(default=False, editable=False)
 
     def __str__(self):
         return self.product.name
@@ -129,7 +242,58 @@ class Cart(models.Model):
 
     @property
     def total(self):
-        return sum(item.total_price() for item in self.items.all())
+        from .pricing import price_cart
+        return price_cart(self).total
+
+
+class CartItemQuerySet(models.QuerySet):
+    def add_quantity(self, cart_id, product_id, quantity):
+        """
+        Insert a line or add to its quantity in a single statement, so
+        concurrent adds of the same product never lose an update. Returns
+        the line with its new quantity.
+        """
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            with transaction.atomic():
+                item, created = self.select_for_update().get_or_create(
+                    cart_id=cart_id, product_id=product_id, defaults={'quantity': quantity}
+                )
+                if not created:
+                    self.filter(pk=item.pk).update(quantity=F('quantity') + quantity)
+                    item.refresh_from_db(fields=['quantity'])
+                return item
+
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES (%s, %s, %s) '
+                f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity '
+                f'RETURNING id, quantity',
+                [cart_id, product_id, quantity],
+            )
+            pk, total = cursor.fetchone()
+        return self.model(pk=pk, cart_id=cart_id, product_id=product_id, quantity=total)
+
+    def add_quantities(self, cart_id, quantities):
+        """
+        add_quantity for several {product_id: quantity} lines of one cart, in
+        a single INSERT ... ON CONFLICT DO UPDATE.
+        """
+        if not quantities:
+            return
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            for product_id, quantity in quantities.items():
+                self.add_quantity(cart_id, product_id, quantity)
+            return
+
+        table = self.model._meta.db_table
+        rows = ', '.join(['(%s, %s, %s)'] * len(quantities))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (cart_id, product_id, quantity) VALUES {rows} '
+                f'ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = {table}.quantity + excluded.quantity',
+                [param for product_id, quantity in quantities.items() for param in (cart_id, product_id, quantity)],
+            )
 
 
 class CartItem(models.Model):
@@ -137,6 +301,14 @@ class CartItem(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = CartItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # One line per product; also the index for a cart's lookups by product.
+            models.UniqueConstraint(fields=['cart', 'product'], name='cartitem_cart_product_uniq'),
+        ]
+
     @property
     def total_price(self):
         return self.product.discounted_price * self.quantity
@@ -0,0 +1,74 @@
+from decimal import Decimal
+
+from .models import CartItem, Product, active_discount_prefetch
+
+CENT = Decimal('0.01')
+
+
+def money(value):
+    """A float price as a Decimal rounded to cents."""
+    return Decimal(str(value)).quantize(CENT)
+
+
+def line_total(product, quantity):
+    """Discounted price of `quantity` units of `product`."""
+    return (money(product.discounted_price) * quantity).quantize(CENT)
+
+
+class PricedLine:
+    def __init__(self, product, quantity, item=None):
+        self.item = item
+        self.id = item.pk if item is not None else None
+        self.product = product
+        self.quantity = quantity
+        self.discount = product.get_active_discount()
+        self.discount_percentage = self.discount.percentage if self.discount else None
+        self.unit_price = money(product.price)
+        self.discounted_unit_price = money(product.discounted_price)
+        self.subtotal = (self.unit_price * quantity).quantize(CENT)
+        self.total = line_total(product, quantity)
+        self.savings = self.subtotal - self.total
+
+
+class PricedCart:
+    def __init__(self, lines, cart=None, token=None):
+        self.cart = cart
+        self.id = cart.pk if cart is not None else None
+        self.user = cart.user_id if cart is not None else None
+        self.created_at = cart.created_at if cart is not None else None
+        self.token = token
+        self.lines = lines
+        self.item_count = sum(line.quantity for line in lines)
+        self.subtotal = sum((line.subtotal for line in lines), Decimal('0.00'))
+        self.total = sum((line.total for line in lines), Decimal('0.00'))
+        self.savings = self.subtotal - self.total
+
+
+def pricing_queryset(items=None):
+    """
+    Cart items with their products and the products' running discounts,
+    loaded in two queries however many lines the cart has.
+    """
+    items = CartItem.objects.all() if items is None else items
+    return items.select_related('product').prefetch_related(active_discount_prefetch('product__discounts'))
+
+
+def price_items(items, cart=None):
+    """Price cart items whose products were loaded through pricing_queryset()."""
+    return PricedCart([PricedLine(item.product, item.quantity, item) for item in items], cart)
+
+
+def price_cart(cart):
+    if cart is None:
+        return PricedCart([])
+    return price_items(pricing_queryset(cart.items.order_by('pk')), cart)
+
+
+def price_guest_cart(guest):
+    """Price a GuestCart's {product_id: quantity} in two queries, skipping removed products."""
+    products = Product.objects.filter(pk__in=guest.items).prefetch_related(active_discount_prefetch()).in_bulk()
+    lines = [
+        PricedLine(products[product_id], quantity)
+        for product_id, quantity in guest.items.items() if product_id in products
+    ]
+    return PricedCart(lines, token=guest.token)
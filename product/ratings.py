@@ -0,0 +1,42 @@
+import threading
+from contextlib import contextmanager
+
+from .cache import bump_catalog_version
+from .models import Product
+
+_state = threading.local()
+
+
+def rating_updates_deferred():
+    return getattr(_state, 'product_ids', None) is not None
+
+
+def defer_rating_update(product_ids):
+    _state.product_ids.update(pk for pk in product_ids if pk is not None)
+
+
+@contextmanager
+def bulk_rating_updates(chunk_size=500):
+    """
+    Suspend the per-review counter updates done by the review signals and
+    recompute every touched product once on exit. Wrap mass review imports
+    and queryset deletes in it:
+
+        with bulk_rating_updates():
+            Review.objects.filter(user=spammer).delete()
+    """
+    if rating_updates_deferred():
+        yield
+        return
+
+    _state.product_ids = set()
+    try:
+        yield
+        product_ids = sorted(_state.product_ids)
+    finally:
+        _state.product_ids = None
+
+    for start in range(0, len(product_ids), chunk_size):
+        Product.objects.filter(pk__in=product_ids[start:start + chunk_size]).recompute_ratings()
+    if product_ids:
+        bump_catalog_version()
@@ -0,0 +1,121 @@
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Product
+
+
+class BaseSearchEngine:
+    """
+    Product search index. Engines keep their own index in sync through
+    `index()`/`remove()` (called from signals) and answer `search()` with
+    product ids, most relevant first.
+    """
+
+    def index(self, products):
+        """Add or replace the given products in the index."""
+
+    def remove(self, product_ids):
+        """Drop the given product ids from the index."""
+
+    def rebuild(self):
+        """Re-index the whole catalog."""
+
+    def search(self, query, limit, within=None):
+        """
+        Ids of up to `limit` matches of `query`, most relevant first. Given a
+        Product queryset `within`, only products in it are ranked, so the
+        limit applies after the caller's filters.
+        """
+        raise NotImplementedError
+
+
+class DatabaseSearchEngine(BaseSearchEngine):
+    """Un-indexed fallback that searches the product table with LIKE."""
+
+    fields = ['name', 'brand', 'category__name']
+
+    def search(self, query, limit, within=None):
+        products = Product.objects.all()
+        if within is not None:
+            products = products.filter(pk__in=within.order_by().values('pk'))
+        for term in query.split():
+            condition = Q()
+            for field in self.fields:
+                condition |= Q(**{f'{field}__icontains': term})
+            products = products.filter(condition)
+        return list(products.order_by('-rating', 'pk').values_list('pk', flat=True)[:limit])
+
+
+class SQLiteFTSSearchEngine(BaseSearchEngine):
+    """
+    SQLite FTS5 index of product name, brand and category name, keyed by
+    product id and ranked with bm25. Every query term is matched as a prefix
+    so results follow the user while they type.
+    """
+
+    table = 'product_search'
+    # bm25 weights for the name, brand and category columns.
+    weights = (10.0, 5.0, 2.0)
+    token_re = re.compile(r'\w+', re.UNICODE)
+
+    def index(self, products):
+        rows = [
+            (product.pk, product.name, product.brand, product.category.name)
+            for product in products
+        ]
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.table} (rowid, name, brand, category) VALUES (%s, %s, %s, %s)', rows
+            )
+
+    def remove(self, product_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.table} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, name, brand, category) '
+                f'SELECT p.id, p.name, p.brand, c.name '
+                f'FROM product_product p JOIN product_category c ON c.id = p.category_id'
+            )
+
+    def build_match(self, query):
+        return ' '.join(f'"{token}"*' for token in self.token_re.findall(query))
+
+    def search(self, query, limit, within=None):
+        match = self.build_match(query)
+        if not match:
+            return []
+        weights = ', '.join(str(weight) for weight in self.weights)
+        candidates, candidate_params = '', []
+        if within is not None:
+            subquery, candidate_params = within.order_by().values('pk').query.sql_with_params()
+            candidates = f'AND rowid IN ({subquery}) '
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s {candidates}'
+                f'ORDER BY bm25({self.table}, {weights}) LIMIT %s',
+                [match, *candidate_params, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+@lru_cache(maxsize=None)
+def get_search_engine():
+    """Return the engine configured in PRODUCT_SEARCH_ENGINE, or one that suits the database."""
+    path = getattr(settings, 'PRODUCT_SEARCH_ENGINE', None)
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTSSearchEngine()
+    return DatabaseSearchEngine()
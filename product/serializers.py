@@ -1,4 +1,7 @@
 from rest_framework import serializers
+from rest_framework.settings import api_settings
+from .carts import ADD, SET, REMOVE, GuestCart, apply_operations, update_cart
+from .images import derivative_urls
 from .models import (
                     Banner, Category, Product,
                     Discount, Image, Wishlist,
@@ -6,13 +9,95 @@ from .models import (
 )
 
 
-class BannerSerializer(serializers.ModelSerializer):
+def parse_field_tree(value):
+    """
+    Parse a `?fields=` / `?expand=` value into a tree:
+    'id,product.name' -> {'id': None, 'product': {'name': None}}.
+    None means the field is requested as a whole.
+    """
+    tree = {}
+    for path in (value or '').split(','):
+        names = [name for name in path.strip().split('.') if name]
+        node = tree
+        for depth, name in enumerate(names):
+            if depth == len(names) - 1:
+                node[name] = None
+            elif node.get(name, {}) is None:
+                break
+            else:
+                node = node.setdefault(name, {})
+    return tree
+
+
+def requested_fields(request):
+    """The `?fields=` tree of a request, or None when every field is wanted."""
+    return parse_field_tree(request.query_params.get('fields')) or None
+
+
+def requested_expansions(request):
+    return parse_field_tree(request.query_params.get('expand'))
+
+
+class DynamicFieldsMixin:
+    """
+    Sparse fieldsets and opt-in expansion.
+
+    `?fields=id,name,product.name` drops every other field before anything is
+    evaluated. Relations listed in `expandable_fields` render as a primary
+    key unless named in `?expand=`, in which case the given serializer is
+    nested. The query string is read by the top-level serializer only; nested
+    ones receive their part of the selection as `fields`/`expand` kwargs.
+    """
+    expandable_fields = {}
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        expand = kwargs.pop('expand', None)
+        super().__init__(*args, **kwargs)
+
+        request = self.context.get('request')
+        if fields is None and expand is None and request is not None:
+            fields = requested_fields(request)
+            expand = requested_expansions(request)
+        self.select(fields, expand or {})
+
+    def select(self, fields, expand):
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+        for name, serializer_class in self.expandable_fields.items():
+            if name not in self.fields:
+                continue
+            if name in expand:
+                self.fields[name] = serializer_class(
+                    read_only=True,
+                    fields=fields.get(name) if fields else None,
+                    expand=expand[name] or {},
+                )
+            else:
+                self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+
+        # Narrow nested serializers that are always embedded, e.g. `images.id`.
+        for name, subfields in (fields or {}).items():
+            if subfields and name not in self.expandable_fields:
+                nested = getattr(self.fields[name], 'child', self.fields[name])
+                if isinstance(nested, DynamicFieldsMixin):
+                    nested.select(subfields, {})
+
+
+class BannerSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Banner
-        fields = ['id', 'title', 'image']
+        fields = ['id', 'title', 'image', 'thumbnails']
+
+    def get_thumbnails(self, obj):
+        return derivative_urls(obj.image, obj.derivatives_ready, self.context.get('request'))
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     banner = BannerSerializer(read_only=True)
 
     class Meta:
@@ -29,16 +114,21 @@ class CategoryCreateSerializer(serializers.ModelSerializer):
 class ProductDiscountSerializer(serializers.ModelSerializer):
     class Meta:
         model = Discount
-        fields = ['id', 'title', 'start_date', 'end_date', 'is_active']
+        fields = ['id', 'title', 'start_date', 'end_date', 'active']
 
 
-class ProductImageSerializer(serializers.ModelSerializer):
+class ProductImageSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    thumbnails = serializers.SerializerMethodField()
+
     class Meta:
         model = Image
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'thumbnails']
+
+    def get_thumbnails(self, obj):
+        return derivative_urls(obj.image, obj.derivatives_ready, self.context.get('request'))
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     active_discount = serializers.SerializerMethodField()
     discounted_price = serializers.SerializerMethodField()
     images = ProductImageSerializer(many=True, read_only=True, source='image_set')
@@ -55,9 +145,112 @@ class ProductSerializer(serializers.ModelSerializer):
         return ProductDiscountSerializer(discount).data if discount else None
 
     def get_discounted_price(self, obj):
-        return obj.get_discounted_price
-
-
+        return obj.discounted_price
+
+
+
+
+class ProductValuesSerializer:
+    """
+    Read-only twin of `ProductSerializer(many=True)` for list pages.
+
+    Builds the very same output straight from `.values()` rows plus one
+    batched query each for running discounts and images, without model
+    instances or DRF's per-field machinery. Only flat `?fields=` selections
+    are supported; anything else should go through ProductSerializer.
+    """
+    columns = [
+        'id', 'name', 'brand', 'description', 'price', 'amount', 'rating',
+        'is_available', 'category_id', 'created_at',
+    ]
+    datetime_field = serializers.DateTimeField()
+
+    def __init__(self, rows, context=None, fields=None):
+        self.rows = rows
+        self.context = context or {}
+        self.fields = fields
+
+    def wants(self, *names):
+        return self.fields is None or any(name in self.fields for name in names)
+
+    def running_discounts(self, ids):
+        discounts = {}
+        for discount in (
+            Discount.objects.running().filter(product__in=ids).order_by('-percentage')
+            .values('id', 'title', 'start_date', 'end_date', 'active', 'percentage', 'product_id')
+        ):
+            discounts.setdefault(discount['product_id'], discount)
+        return discounts
+
+    def images(self, ids):
+        request = self.context.get('request')
+        storage = Image._meta.get_field('image').storage
+        images = {}
+        for image in Image.objects.filter(product__in=ids).values('id', 'image', 'product_id', 'derivatives_ready'):
+            url = None
+            if image['image']:
+                url = storage.url(image['image'])
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+            images.setdefault(image['product_id'], []).append({
+                'id': image['id'],
+                'image': url,
+                'thumbnails': derivative_urls(image['image'], image['derivatives_ready'], request, storage),
+            })
+        return images
+
+    def datetime_formatter(self):
+        """DateTimeField.to_representation with the timezone lookup hoisted out of the loop."""
+        field = self.datetime_field
+        if getattr(field, 'format', api_settings.DATETIME_FORMAT).lower() != 'iso-8601':
+            return field.to_representation
+        tz = field.default_timezone()
+        if tz is None:
+            return field.to_representation
+
+        def to_representation(value):
+            if not value:
+                return None
+            value = value.astimezone(tz).isoformat()
+            return value[:-6] + 'Z' if value.endswith('+00:00') else value
+        return to_representation
+
+    @property
+    def data(self):
+        ids = [row['id'] for row in self.rows]
+        discounts = self.running_discounts(ids) if ids and self.wants('active_discount', 'discounted_price') else {}
+        images = self.images(ids) if ids and self.wants('images') else {}
+        datetime = self.datetime_formatter()
+
+        data = []
+        for row in self.rows:
+            price = row['price']
+            discount = discounts.get(row['id'])
+            item = {
+                'id': row['id'],
+                'name': row['name'],
+                'brand': row['brand'],
+                'description': row['description'],
+                'price': float(price),
+                'discounted_price': round(price * (1 - discount['percentage'] / 100), 2) if discount else price,
+                'active_discount': {
+                    'id': discount['id'],
+                    'title': discount['title'],
+                    'start_date': datetime(discount['start_date']),
+                    'end_date': datetime(discount['end_date']),
+                    'active': discount['active'],
+                } if discount else None,
+                'amount': row['amount'],
+                'rating': float(row['rating']),
+                'is_available': row['is_available'],
+                'category': row['category_id'],
+                'images': images.get(row['id'], []),
+                'created_at': datetime(row['created_at']),
+            }
+            if self.fields is not None:
+                item = {name: value for name, value in item.items() if name in self.fields}
+            data.append(item)
+        return data
 
 
 class ProductCreateSerializer(serializers.ModelSerializer):
@@ -67,9 +260,11 @@ class ProductCreateSerializer(serializers.ModelSerializer):
                   'price', 'amount', 'rating',
                   'is_available', 'category'
                   ]
+        # Kept in step with rating_sum / rating_count by the reviews.
+        read_only_fields = ['rating']
 
-class DiscountSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+class DiscountSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {'product': ProductSerializer}
 
     class Meta:
         model = Discount
@@ -80,12 +275,16 @@ class DiscountCreateSerializer(serializers.ModelSerializer):
         model = Discount
         fields = ['title', 'product', 'start_date', 'end_date', 'active']
 
-class ImageSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+class ImageSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {'product': ProductSerializer}
+    thumbnails = serializers.SerializerMethodField()
 
     class Meta:
         model = Image
-        fields = ['id', 'product', 'image']
+        fields = ['id', 'product', 'image', 'thumbnails']
+
+    def get_thumbnails(self, obj):
+        return derivative_urls(obj.image, obj.derivatives_ready, self.context.get('request'))
 
 
 
@@ -96,8 +295,8 @@ class ImageCreateSerializer(serializers.ModelSerializer):
 
 
 
-class WishlistSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+class WishlistSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {'product': ProductSerializer}
 
     class Meta:
         model = Wishlist
@@ -110,8 +309,8 @@ class WishlistCreateSerializer(serializers.ModelSerializer):
         fields = ['user', 'product']
 
 
-class ReviewSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+class ReviewSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {'product': ProductSerializer}
 
     class Meta:
         model = Review
@@ -123,14 +322,13 @@ class ReviewCreateSerializer(serializers.ModelSerializer):
         fields = ['user', 'product', 'rating', 'comment']
 
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Cart
         fields = ['id', 'user', 'created_at']
 
-class CartItemSerializer(serializers.ModelSerializer):
-    cart = CartSerializer(read_only=True)
-    product = ProductSerializer(read_only=True)
+class CartItemSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
+    expandable_fields = {'cart': CartSerializer, 'product': ProductSerializer}
 
     class Meta:
         model = CartItem
@@ -144,18 +342,80 @@ class CartItemCreateUpdateSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         cart = self.context['cart']
-        product = self.context['product']
-
-        item, created = CartItem.objects.get_or_create(
-            cart = cart,
-            product = product,
-            defaults={'quantity': validated_data['quantity']}
-        )
-
-        if not created:
-            item.quantity += validated_data['quantity']
-            item.save()
-        return item
+        return CartItem.objects.add_quantity(cart.pk, validated_data['product'].pk, validated_data['quantity'])
+
+
+class CartOperationSerializer(serializers.Serializer):
+    op = serializers.ChoiceField(choices=[ADD, SET, REMOVE])
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=0, required=False)
+
+    def validate(self, attrs):
+        if attrs['op'] == ADD and attrs.get('quantity', 1) < 1:
+            raise serializers.ValidationError({'quantity': 'Must be at least 1 when adding.'})
+        if attrs['op'] == SET and 'quantity' not in attrs:
+            raise serializers.ValidationError({'quantity': 'This field is required.'})
+        return attrs
+
+
+class CartBatchSerializer(serializers.Serializer):
+    """
+    A list of add / set / remove operations applied, in order and in one
+    go, to the cart in context: a Cart, written through carts.update_cart,
+    or a GuestCart kept in the cache. Products are checked in one query.
+    """
+    operations = CartOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, operations):
+        ids = {operation['product'] for operation in operations}
+        unknown = ids - set(Product.objects.filter(pk__in=ids).values_list('pk', flat=True))
+        if unknown:
+            raise serializers.ValidationError(f"Unknown products: {sorted(unknown)}")
+        return operations
+
+    def create(self, validated_data):
+        cart = self.context['cart']
+        operations = validated_data['operations']
+        if isinstance(cart, GuestCart):
+            cart.items = apply_operations(cart.items, operations)
+            cart.save()
+            return cart
+        product_ids = {operation['product'] for operation in operations}
+        return update_cart(cart, product_ids, lambda current: apply_operations(current, operations))
+
+
+def money_field(**kwargs):
+    return serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True, **kwargs)
+
+
+class PricedLineSerializer(serializers.Serializer):
+    """A cart line priced by product.pricing."""
+    id = serializers.IntegerField(read_only=True)
+    product = serializers.IntegerField(source='product.pk', read_only=True)
+    name = serializers.CharField(source='product.name', read_only=True)
+    quantity = serializers.IntegerField(read_only=True)
+    unit_price = money_field()
+    discounted_unit_price = money_field()
+    discount_percentage = serializers.FloatField(read_only=True)
+    subtotal = money_field()
+    savings = money_field()
+    total = money_field()
+
+
+class PricedCartSerializer(serializers.Serializer):
+    """
+    A whole cart priced by product.pricing. Guest carts have no id, user or
+    created_at but carry the token to send back in X-Cart-Token.
+    """
+    id = serializers.IntegerField(read_only=True)
+    user = serializers.IntegerField(read_only=True)
+    created_at = serializers.DateTimeField(read_only=True)
+    token = serializers.CharField(read_only=True)
+    items = PricedLineSerializer(source='lines', many=True, read_only=True)
+    item_count = serializers.IntegerField(read_only=True)
+    subtotal = money_field()
+    savings = money_field()
+    total = money_field()
 
 
 
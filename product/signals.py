@@ -1,14 +1,123 @@
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from django.db.models import Avg
-from .models import Product, Review
+from .models import Product, Review, Discount, Category, Image, Banner
+from .search import get_search_engine
+from .cache import bump_catalog_version
+from .ratings import rating_updates_deferred, defer_rating_update
+from .images import derivatives_known_ready, schedule_derivative_cleanup, schedule_derivatives
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    instance._previous_rating = (
+        Review.objects.filter(pk=instance.pk).values_list('product_id', 'rating').first()
+        if instance.pk else None
+    )
+
 
 @receiver(post_save, sender=Review)
 def update_product_rating_on_save(sender, instance, **kwargs):
-    instance.product.update_rating()
+    previous = getattr(instance, '_previous_rating', None)
+    if rating_updates_deferred():
+        defer_rating_update([instance.product_id, previous and previous[0]])
+        return
+
+    products = Product.objects.filter(pk=instance.product_id)
+    if previous is None:
+        products.apply_rating_change(instance.rating, 1)
+    elif previous[0] == instance.product_id:
+        products.apply_rating_change(instance.rating - previous[1], 0)
+    else:
+        Product.objects.filter(pk=previous[0]).apply_rating_change(-previous[1], -1)
+        products.apply_rating_change(instance.rating, 1)
+    bump_catalog_version()
 
 
 @receiver(post_delete, sender=Review)
 def delete_product_rating_on_save(sender, instance, **kwargs):
-    instance.product.update_rating()
+    if rating_updates_deferred():
+        defer_rating_update([instance.product_id])
+        return
+    Product.objects.filter(pk=instance.product_id).apply_rating_change(-instance.rating, -1)
+    bump_catalog_version()
+
+
+
+@receiver(pre_save, sender=Discount)
+def remember_discount_product(sender, instance, **kwargs):
+    instance._previous_product_id = (
+        Discount.objects.filter(pk=instance.pk).values_list('product_id', flat=True).first()
+        if instance.pk else None
+    )
+
+
+@receiver(post_save, sender=Discount)
+def refresh_effective_price_on_discount_save(sender, instance, **kwargs):
+    product_ids = {instance.product_id, getattr(instance, '_previous_product_id', None)}
+    Product.objects.filter(pk__in=product_ids - {None}).refresh_effective_price()
+
+
+@receiver(post_delete, sender=Discount)
+def refresh_effective_price_on_discount_delete(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).refresh_effective_price()
+
+
+@receiver(post_save, sender=Product)
+def index_product_on_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not {'name', 'brand', 'category'} & set(update_fields):
+        return
+    get_search_engine().index([instance])
+
+
+@receiver(post_delete, sender=Product)
+def remove_product_from_index(sender, instance, **kwargs):
+    get_search_engine().remove([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created, **kwargs):
+    if not created:
+        get_search_engine().index(instance.products.select_related('category'))
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Discount)
+@receiver([post_save, post_delete], sender=Image)
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Banner)
+def invalidate_catalog_cache(sender, **kwargs):
+    bump_catalog_version()
+
+
+@receiver(pre_save, sender=Image)
+@receiver(pre_save, sender=Banner)
+def remember_image_upload(sender, instance, **kwargs):
+    # A freshly uploaded file is still uncommitted until the field saves it.
+    instance._image_uploaded = bool(instance.image) and not instance.image._committed
+    stored = sender.objects.filter(pk=instance.pk).values_list('image', flat=True).first() if instance.pk else None
+    # The file this save replaces, whose derivatives go once it commits.
+    instance._replaced_image = (
+        stored if stored and (instance._image_uploaded or stored != instance.image.name) else None
+    )
+    if instance._image_uploaded:
+        instance.derivatives_ready = False
+    elif stored != instance.image.name:
+        # An already stored file, e.g. one an import or the backfill has seen.
+        instance.derivatives_ready = bool(instance.image) and derivatives_known_ready(instance.image.name)
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_save, sender=Banner)
+def generate_image_derivatives(sender, instance, **kwargs):
+    if getattr(instance, '_image_uploaded', False):
+        schedule_derivatives(instance.image)
+    replaced = getattr(instance, '_replaced_image', None)
+    if replaced:
+        schedule_derivative_cleanup(replaced, instance.image.storage)
+
 
+@receiver(post_delete, sender=Image)
+@receiver(post_delete, sender=Banner)
+def delete_image_derivatives(sender, instance, **kwargs):
+    if instance.image:
+        schedule_derivative_cleanup(instance.image.name, instance.image.storage)
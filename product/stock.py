@@ -0,0 +1,118 @@
+from collections import Counter, defaultdict
+
+from django.db import connection, transaction
+from django.db.models import Case, F, Q, Value, When
+
+from .cache import bump_catalog_version
+from .models import Product
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"Not enough stock for products {self.product_ids}")
+
+
+def _quantities(lines):
+    """Sum (product_id, quantity) pairs into {product_id: quantity}."""
+    quantities = Counter()
+    for product_id, quantity in lines:
+        if product_id is not None:
+            quantities[product_id] += quantity
+    return quantities
+
+
+def _by_quantity(quantities):
+    """{quantity: [product_id, ...]}, so a CASE needs one branch per distinct quantity."""
+    groups = defaultdict(list)
+    for product_id, quantity in quantities.items():
+        groups[quantity].append(product_id)
+    return groups
+
+
+def _per_product(groups):
+    return Case(*[When(pk__in=ids, then=Value(quantity)) for quantity, ids in groups.items()])
+
+
+def _lock(product_ids):
+    """Lock the product rows in id order, so concurrent checkouts never deadlock."""
+    if connection.features.has_select_for_update:
+        list(Product.objects.select_for_update().filter(pk__in=product_ids).order_by('pk').values_list('pk'))
+
+
+def shortages(lines):
+    """Ids of the products that have less stock than `(product_id, quantity)` lines ask for."""
+    quantities = _quantities(lines)
+    available = dict(Product.objects.filter(pk__in=quantities).values_list('pk', 'amount'))
+    return sorted(pk for pk, quantity in quantities.items() if available.get(pk, 0) < quantity)
+
+
+def reserve_stock(lines):
+    """
+    Take `(product_id, quantity)` lines out of stock, all or nothing.
+
+    The decrement is a single conditional UPDATE (`amount >= quantity` in
+    SQL), so two checkouts racing for the last unit cannot both win.
+    Products that sell out are marked unavailable. Raises InsufficientStock
+    naming every product that is short; nothing is changed in that case.
+    """
+    quantities = _quantities(lines)
+    if not quantities:
+        return
+    groups = _by_quantity(quantities)
+
+    try:
+        with transaction.atomic():
+            _lock(quantities)
+            enough = Q()
+            for quantity, ids in groups.items():
+                enough |= Q(pk__in=ids, amount__gte=quantity)
+            updated = Product.objects.filter(enough).update(
+                amount=F('amount') - _per_product(groups),
+                is_available=Case(
+                    *[When(pk__in=ids, amount=quantity, then=Value(False)) for quantity, ids in groups.items()],
+                    default=F('is_available'),
+                ),
+            )
+            if updated != len(quantities):
+                raise InsufficientStock(quantities)
+    except InsufficientStock:
+        # The partial decrement is rolled back; name the products that are short.
+        raise InsufficientStock(shortages(quantities.items()) or quantities) from None
+    bump_catalog_version()
+
+
+def release_stock(lines):
+    """
+    Put `(product_id, quantity)` lines back in stock, e.g. for a cancelled
+    order. Products that were sold out become available again.
+    """
+    quantities = _quantities(lines)
+    if not quantities:
+        return
+    with transaction.atomic():
+        _lock(quantities)
+        Product.objects.filter(pk__in=quantities).update(
+            amount=F('amount') + _per_product(_by_quantity(quantities)),
+            is_available=Case(When(amount=0, then=Value(True)), default=F('is_available')),
+        )
+    bump_catalog_version()
+
+
+def stock_delta(before, after):
+    """{product_id: quantity} that `after` lines take out of stock beyond `before` (negative: put back)."""
+    delta = _quantities(after)
+    delta.subtract(_quantities(before))
+    return {product_id: quantity for product_id, quantity in delta.items() if quantity}
+
+
+def adjust_stock(before, after):
+    """
+    Move a reservation of `before` lines to `after` lines, e.g. for an
+    edited order line: reserve what grew and release what shrank. Raises
+    InsufficientStock, changing nothing.
+    """
+    delta = stock_delta(before, after)
+    with transaction.atomic():
+        reserve_stock((product_id, quantity) for product_id, quantity in delta.items() if quantity > 0)
+        release_stock((product_id, -quantity) for product_id, quantity in delta.items() if quantity < 0)
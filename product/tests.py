@@ -1,3 +1,1296 @@
-from django.test import TestCase
+import json
+import os
+import re
+import shutil
+import threading
+import tempfile
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin import site
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command, CommandError
+from django.core.cache import cache
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.test import APIClient
+
+from core.db import routing_scope, use_read_replica
+from order.models import Order, OrderItem
+from users.models import User
+from .cache import get_cache_stats, get_catalog_version, reset_cache_stats
+from .carts import GuestCart, apply_operations, update_cart
+from .models import Banner, Cart, CartItem, Category, Product, Discount, Image, Review, Wishlist
+from .images import derivative_name, derivative_urls, schedule_derivatives
+from .imports import import_catalog
+from .ratings import bulk_rating_updates
+from .search import DatabaseSearchEngine, get_search_engine
+from .views import ProductViewSet
+
+
+def make_products(category, count, **kwargs):
+    now = timezone.now()
+    products = []
+    for i in range(count):
+        product = Product.objects.create(
+            name=f'Product {i}', brand='Brand', price=100.0 + i,
+            amount=10, category=category, **kwargs
+        )
+        Discount.objects.create(
+            title=f'Sale {i}', product=product, percentage=10.0, active=True,
+            start_date=now - timedelta(days=1), end_date=now + timedelta(days=1),
+        )
+        products.append(product)
+    return products
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ProductListQueryCountTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Phones')
+
+    def test_list_query_count_does_not_grow_with_products(self):
+        make_products(self.category, 2)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+
+        make_products(self.category, 20)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_returns_best_running_discount(self):
+        product, = make_products(self.category, 1)
+        now = timezone.now()
+        Discount.objects.create(
+            title='Expired', product=product, percentage=50.0, active=True,
+            start_date=now - timedelta(days=3), end_date=now - timedelta(days=2),
+        )
+        response = self.client.get('/api/products/')
+        row = response.json()['results'][0]
+        self.assertEqual(row['active_discount']['title'], 'Sale 0')
+        self.assertEqual(row['discounted_price'], 90.0)
+
+    def test_nested_product_serializers_are_batched(self):
+        user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client.force_authenticate(user)
+        for product in make_products(self.category, 5):
+            Review.objects.create(product=product, user=user, rating=4)
+            Wishlist.objects.create(product=product, user=user)
+
+        # rows + discounts + images
+        with self.assertNumQueries(3):
+            self.client.get('/api/reviews/?expand=product')
+        with self.assertNumQueries(3):
+            self.client.get('/api/wishlists/?expand=product')
+
+
+class EffectivePriceTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Phones')
+        self.product = Product.objects.create(
+            name='Phone', brand='Brand', price=200.0, amount=5, category=self.category
+        )
+
+    def test_new_product_uses_list_price(self):
+        self.assertEqual(self.product.effective_price, 200.0)
+
+    def test_discount_save_and_delete_refresh_effective_price(self):
+        now = timezone.now()
+        discount = Discount.objects.create(
+            title='Sale', product=self.product, percentage=25.0, active=True,
+            start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1),
+        )
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_price, 150.0)
+
+        discount.delete()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_price, 200.0)
+
+    def test_price_change_keeps_discount_applied(self):
+        make_products(self.category, 1)
+        product = Product.objects.get(name='Product 0')
+        product.price = 50.0
+        product.save()
+        product.refresh_from_db()
+        self.assertEqual(product.effective_price, 45.0)
+
+    def test_command_applies_expired_windows(self):
+        now = timezone.now()
+        discount = Discount.objects.create(
+            title='Sale', product=self.product, percentage=50.0, active=True,
+            start_date=now - timedelta(hours=1), end_date=now + timedelta(hours=1),
+        )
+        Discount.objects.filter(pk=discount.pk).update(end_date=now - timedelta(minutes=1))
+        call_command('refresh_effective_prices', since=5, stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.effective_price, 200.0)
+
+    def test_list_filters_and_sorts_by_effective_price(self):
+        make_products(self.category, 3)  # 100, 101, 102 at 10% off
+        response = self.client.get('/api/products/', {
+            'max_effective_price': 91, 'ordering': 'effective_price'
+        })
+        self.assertEqual([row['name'] for row in response.json()['results']], ['Product 0', 'Product 1'])
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.phones = Category.objects.create(name='Phones')
+        self.cases = Category.objects.create(name='Cases')
+
+    def search(self, query, **params):
+        response = self.client.get('/api/products/', {'search': query, **params})
+        return [row['name'] for row in response.json()['results']]
+
+    def test_results_are_ranked_by_relevance(self):
+        Product.objects.create(name='Leather cover', brand='Acme', price=5, amount=1,
+                               rating=5.0, category=self.phones)
+        Product.objects.create(name='Galaxy phone', brand='Samsung', price=500, amount=1,
+                               rating=1.0, category=self.phones)
+        self.assertEqual(self.search('phone'), ['Galaxy phone', 'Leather cover'])
+
+    def test_prefix_terms_match_while_typing(self):
+        Product.objects.create(name='Galaxy phone', brand='Samsung', price=500, amount=1,
+                               category=self.phones)
+        self.assertEqual(self.search('sams gal'), ['Galaxy phone'])
+        self.assertEqual(self.search('nokia'), [])
+
+    def test_explicit_ordering_wins_over_relevance(self):
+        Product.objects.create(name='Cheap phone', brand='Acme', price=5, amount=1, category=self.cases)
+        Product.objects.create(name='Phone phone', brand='Acme', price=50, amount=1, category=self.phones)
+        self.assertEqual(self.search('phone', ordering='price'), ['Cheap phone', 'Phone phone'])
+
+    @override_settings(PRODUCT_SEARCH_MAX_RESULTS=3)
+    def test_filters_apply_before_the_result_cap(self):
+        for number in range(5):
+            Product.objects.create(name=f'Phone phone {number}', brand='Acme', price=500, amount=1,
+                                   category=self.phones)
+        Product.objects.create(name='Leather cover', brand='Phoneworks', price=5, amount=1, category=self.cases)
+
+        self.assertEqual(len(self.search('phone')), 3)
+        self.assertEqual(self.search('phone', category=self.cases.pk), ['Leather cover'])
+        within = Product.objects.filter(category=self.cases)
+        self.assertEqual(DatabaseSearchEngine().search('phone', 3, within), list(within.values_list('pk', flat=True)))
+
+    def test_index_follows_product_and_category_changes(self):
+        product = Product.objects.create(name='Galaxy', brand='Samsung', price=500, amount=1,
+                                         category=self.cases)
+        product.name = 'Pixel'
+        product.save()
+        self.assertEqual(self.search('galaxy'), [])
+        self.assertEqual(self.search('pixel'), ['Pixel'])
+
+        self.cases.name = 'Smartphones'
+        self.cases.save()
+        self.assertEqual(self.search('smartphones'), ['Pixel'])
+
+        product.delete()
+        self.assertEqual(self.search('pixel'), [])
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name='Phones')
+        # Many ties on rating and price so the id tiebreaker matters.
+        for i in range(25):
+            Product.objects.create(name=f'P{i}', brand='Brand', price=float(i % 4),
+                                   rating=float(i % 3), amount=1, category=category)
+
+    def walk(self, params):
+        names, url, pages = [], '/api/products/', 0
+        response = self.client.get(url, params)
+        while True:
+            body = response.json()
+            names += [row['name'] for row in body['results']]
+            pages += 1
+            if not body['next']:
+                return names, body, pages
+            response = self.client.get(body['next'])
+
+    def expected(self, *ordering):
+        return list(Product.objects.order_by(*ordering).values_list('name', flat=True))
+
+    def test_walks_every_ordering_without_gaps_or_duplicates(self):
+        for ordering, expected in [
+            (None, self.expected('-rating', '-id')),
+            ('price', self.expected('price', 'id')),
+            ('-price', self.expected('-price', '-id')),
+            ('created_at', self.expected('created_at', 'id')),
+        ]:
+            params = {'page_size': 4}
+            if ordering:
+                params['ordering'] = ordering
+            names, _, pages = self.walk(params)
+            self.assertEqual(names, expected, ordering)
+            self.assertEqual(pages, 7)
+
+    def test_previous_link_walks_back(self):
+        first = self.client.get('/api/products/', {'page_size': 10}).json()
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+        self.assertEqual(self.client.get(back['next']).json()['results'], second['results'])
+
+    def test_deep_pages_cost_one_query(self):
+        url = self.client.get('/api/products/', {'page_size': 5}).json()['next']
+        for _ in range(3):
+            url = self.client.get(url).json()['next']
+        with self.assertNumQueries(3):
+            self.client.get(url)
+
+    def test_offset_pagination_is_opt_in(self):
+        body = self.client.get('/api/products/', {'limit': 5, 'offset': 20}).json()
+        self.assertEqual(body['count'], 25)
+        self.assertEqual(len(body['results']), 5)
+
+    def test_rejects_cursor_from_another_ordering(self):
+        url = self.client.get('/api/products/', {'page_size': 5}).json()['next']
+        response = self.client.get(url.replace('page_size=5', 'page_size=5&ordering=price'))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.client.get('/api/products/', {'cursor': 'junk'}).status_code, 404)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name='Phones')
+        self.product = Product.objects.create(
+            name='Phone', brand='Brand', price=200.0, amount=5, category=self.category
+        )
+
+    def test_repeated_reads_are_served_from_cache(self):
+        first = self.client.get('/api/products/?ordering=price')
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get('/api/products/?ordering=price')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.json(), first.json())
+        # A different query string is a different entry.
+        self.assertEqual(self.client.get('/api/products/?ordering=-price')['X-Cache'], 'MISS')
+
+    def test_writes_invalidate_cached_responses(self):
+        self.client.get(f'/api/products/{self.product.pk}/')
+        self.product.name = 'Renamed'
+        self.product.save()
+        response = self.client.get(f'/api/products/{self.product.pk}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['name'], 'Renamed')
+
+        self.client.get('/api/banners/')
+        Banner.objects.create(title='Sale', image='banners/sale.png')
+        self.assertEqual(self.client.get('/api/banners/')['X-Cache'], 'MISS')
+
+    def test_entries_expire_at_the_next_discount_boundary(self):
+        now = timezone.now()
+        Discount.objects.create(
+            title='Sale', product=self.product, percentage=10.0, active=True,
+            start_date=now - timedelta(hours=1), end_date=now + timedelta(seconds=30),
+        )
+        with self.settings(CATALOG_CACHE_TIMEOUT=3600), \
+                mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.client.get('/api/products/')
+        timeouts = [call.args[2] for call in cache_set.call_args_list if ':product:' in call.args[0]]
+        self.assertTrue(0 < timeouts[0] <= 30)
+
+    def test_stats_endpoint_is_admin_only(self):
+        reset_cache_stats()
+        self.client.get('/api/categories/')
+        self.client.get('/api/categories/')
+        self.assertEqual(self.client.get('/api/cache/stats/').status_code, 401)
+
+        admin = User.objects.create_user(username='admin', password='pass12345', role='admin')
+        self.client.force_authenticate(admin)
+        stats = self.client.get('/api/cache/stats/').json()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_ratio'], 0.5)
+
+
+class RatingCounterTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Phones')
+        self.product = Product.objects.create(name='Phone', brand='Brand', price=10, amount=1,
+                                              category=category)
+        self.other = Product.objects.create(name='Case', brand='Brand', price=1, amount=1,
+                                            category=category)
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+
+    def assertRating(self, product, rating, total, count):
+        product.refresh_from_db()
+        self.assertEqual((product.rating, product.rating_sum, product.rating_count), (rating, total, count))
+
+    def test_rating_cannot_be_written_directly(self):
+        Review.objects.create(product=self.product, user=self.user, rating=4)
+        admin = User.objects.create_user(username='staff', password='pass12345', role='admin')
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        response = client.patch(f'/api/products/{self.product.pk}/', {'rating': 1, 'price': 12}, format='json')
+
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertRating(self.product, 4.0, 4, 1)
+        self.assertIn('rating', site._registry[Product].readonly_fields)
+
+    def test_counters_follow_insert_update_and_delete(self):
+        first = Review.objects.create(product=self.product, user=self.user, rating=5)
+        Review.objects.create(product=self.product, user=self.user, rating=2)
+        self.assertRating(self.product, 3.5, 7, 2)
+
+        first.rating = 3
+        first.save()
+        self.assertRating(self.product, 2.5, 5, 2)
+
+        first.product = self.other
+        first.save()
+        self.assertRating(self.product, 2.0, 2, 1)
+        self.assertRating(self.other, 3.0, 3, 1)
+
+        first.delete()
+        self.assertRating(self.other, 0.0, 0, 0)
+
+    def test_single_review_write_does_not_aggregate(self):
+        with self.assertNumQueries(2):  # INSERT review + UPDATE product counters
+            Review.objects.create(product=self.product, user=self.user, rating=4)
+
+    def test_bulk_path_recomputes_each_product_once(self):
+        with bulk_rating_updates():
+            for rating in range(1, 6):
+                Review.objects.create(product=self.product, user=self.user, rating=rating)
+            Review.objects.bulk_create([Review(product=self.other, user=self.user, rating=4)])
+            self.assertRating(self.product, 0.0, 0, 0)
+        self.assertRating(self.product, 3.0, 15, 5)
+        # bulk_create sends no signals, so the import only lands once recomputed.
+        self.assertRating(self.other, 0.0, 0, 0)
+        Product.objects.filter(pk=self.other.pk).recompute_ratings()
+        self.assertRating(self.other, 4.0, 4, 1)
+
+        with bulk_rating_updates():
+            Review.objects.filter(product=self.product, rating__gte=4).delete()
+        self.assertRating(self.product, 2.0, 6, 3)
+
+    def test_rebuild_ratings_command_verifies_and_repairs(self):
+        Review.objects.create(product=self.product, user=self.user, rating=4)
+        Product.objects.filter(pk=self.product.pk).update(rating_sum=0, rating_count=0, rating=0)
+        with self.assertRaises(CommandError):
+            call_command('rebuild_ratings', verify=True, stdout=StringIO())
+        call_command('rebuild_ratings', stdout=StringIO())
+        call_command('rebuild_ratings', verify=True, stdout=StringIO())
+        self.assertRating(self.product, 4.0, 4, 1)
+
+
+def query_plan(sql):
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def pages_in_key_order(sql, table):
+    """Whether `sql` pages through all of `table` by primary key, which a rowid scan stops after one page of."""
+    return ' WHERE ' not in sql and re.search(rf'FROM "{table}" .*ORDER BY "{table}"."id" (ASC|DESC) LIMIT \d+$', sql)
+
+
+def full_table_scans(sql):
+    """
+    Steps in which the SQLite planner reads a whole table without an index
+    for `sql`. The only rowid scan allowed is one page of an unfiltered
+    table in primary key order.
+    """
+    return [
+        step for step in query_plan(sql)
+        if step.startswith('SCAN ') and not any(
+            usage in step for usage in ('USING INDEX', 'USING COVERING INDEX', 'VIRTUAL TABLE INDEX', 'CONSTANT ROW')
+        )
+        and not (step.count(' ') == 1 and pages_in_key_order(sql, step.split()[1]))
+    ]
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class QueryPlanTests(TestCase):
+    """Every query behind the hot endpoints must be served by an index."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='pass12345', role='admin')
+        categories = [Category.objects.create(name=name) for name in ['Phones', 'Cases', 'Cables']]
+        for i, category in enumerate(categories):
+            for product in make_products(category, 10):
+                Review.objects.create(product=product, user=cls.user, rating=i + 1)
+        Wishlist.objects.create(user=cls.user, product=Product.objects.first())
+        cls.category = categories[0]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertIndexed(self, request, *args, **kwargs):
+        with CaptureQueriesContext(connection) as queries:
+            response = request(*args, **kwargs)
+        self.assertLess(response.status_code, 300, response.content)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            self.assertEqual(full_table_scans(sql), [], f'{args[0]}: {sql}\n{query_plan(sql)}')
+        return response
+
+    def test_product_list_orderings(self):
+        for params in [{}, {'ordering': 'price'}, {'ordering': '-created_at'},
+                       {'ordering': 'effective_price'}, {'category': self.category.pk},
+                       {'category': self.category.pk, 'max_price': 106}, {'search': 'product'}]:
+            response = self.assertIndexed(self.client.get, '/api/products/', {**params, 'page_size': 5})
+            self.assertIndexed(self.client.get, response.json()['next'])
+
+        filtered = self.client.get('/api/products/', {'category': self.category.pk, 'max_price': 106})
+        self.assertEqual(sorted(row['price'] for row in filtered.json()['results']), [100.0 + i for i in range(7)])
+
+    def test_unindexed_pages_are_caught(self):
+        self.assertEqual(full_table_scans(str(Product.objects.order_by('pk')[:5].query)), [])
+        self.assertNotEqual(full_table_scans(str(Product.objects.filter(amount=3).order_by('pk')[:5].query)), [])
+        self.assertNotEqual(full_table_scans(str(Review.objects.order_by('comment')[:5].query)), [])
+
+    def test_product_detail_and_nested_lists(self):
+        product = Product.objects.first()
+        self.assertIndexed(self.client.get, f'/api/products/{product.pk}/')
+        for url in ['/api/discounts/', '/api/reviews/', '/api/wishlists/']:
+            self.assertIndexed(self.client.get, url, {'expand': 'product'})
+
+    def test_cart_add(self):
+        product = Product.objects.first()
+        for _ in range(2):
+            self.assertIndexed(self.client.post, '/api/cart/items/add/',
+                               {'product': product.pk, 'quantity': 1}, format='json')
+
+    def test_discount_overlap_check(self):
+        discount = Discount.objects.first()
+        with CaptureQueriesContext(connection) as queries:
+            discount.clean()
+        for query in queries.captured_queries:
+            self.assertEqual(full_table_scans(query['sql']), [], query['sql'])
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class SparseFieldsetTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client.force_authenticate(self.user)
+        category = Category.objects.create(name='Phones')
+        for product in make_products(category, 3):
+            Review.objects.create(product=product, user=self.user, rating=5, comment='Great')
+
+    def test_fields_limit_output_and_skip_prefetches(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/products/', {'fields': 'id,name'})
+        self.assertEqual(set(response.json()['results'][0]), {'id', 'name'})
+
+        with self.assertNumQueries(2):  # rows + discounts, no images
+            response = self.client.get('/api/products/', {'fields': 'id,discounted_price', 'ordering': 'price'})
+        self.assertEqual(response.json()['results'][0]['discounted_price'], 90.0)
+
+    def test_nested_relations_are_primary_keys_unless_expanded(self):
+        with self.assertNumQueries(1):
+            row = self.client.get('/api/reviews/').json()['results'][0]
+        self.assertIsInstance(row['product'], int)
+
+        with self.assertNumQueries(1):  # joined product, nothing to prefetch
+            row = self.client.get('/api/reviews/', {
+                'expand': 'product', 'fields': 'id,rating,product.id,product.name',
+            }).json()['results'][0]
+        self.assertEqual(set(row), {'id', 'rating', 'product'})
+        self.assertEqual(set(row['product']), {'id', 'name'})
+
+        row = self.client.get('/api/reviews/', {'expand': 'product'}).json()['results'][0]
+        self.assertEqual(row['product']['active_discount']['title'], row['product']['name'].replace('Product', 'Sale'))
+
+    def test_embedded_serializers_can_be_narrowed(self):
+        row = self.client.get('/api/products/', {'fields': 'id,images.id'}).json()['results'][0]
+        self.assertEqual(row, {'id': row['id'], 'images': []})
+
+
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ProductValuesSerializerParityTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        category = Category.objects.create(name='Phones')
+        other = Category.objects.create(name='Cases')
+        now = timezone.now()
+        for i, product in enumerate(make_products(category, 4) + make_products(other, 3)):
+            product.price = 19.99 + i * 7.13
+            product.description = None if i % 2 else f'Description {i}'
+            product.rating = (i % 5) + 0.5
+            product.is_available = bool(i % 3)
+            product.save()
+            for n in range(i % 3):
+                Image.objects.create(product=product, image=f'images/products/{product.pk}-{n}.png')
+        Discount.objects.filter(product__name='Product 1').update(percentage=33.3)
+        Discount.objects.filter(product__name='Product 2').update(active=False)
+        Discount.objects.create(
+            title='Later', product=Product.objects.get(name='Product 0', category=other),
+            percentage=5, active=True, start_date=now + timedelta(days=2), end_date=now + timedelta(days=3),
+        )
+
+    def assertSameBytes(self, url, params=None):
+        fast = self.client.get(url, params)
+        with mock.patch.object(ProductViewSet, 'fast_list', False):
+            slow = self.client.get(url, params)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_output_is_byte_identical(self):
+        for params in [{}, {'ordering': 'price'}, {'ordering': '-created_at', 'page_size': 3},
+                       {'search': 'product'}, {'fields': 'id,name,discounted_price'},
+                       {'limit': 2, 'offset': 3}]:
+            response = self.assertSameBytes('/api/products/', params)
+            if response.json().get('next'):
+                self.assertSameBytes(response.json()['next'])
+
+    def test_fast_path_runs_no_more_queries(self):
+        with self.assertNumQueries(3):
+            self.client.get('/api/products/')
+
+
+def png_upload(name='photo.png', size=(1200, 800)):
+    buffer = BytesIO()
+    PILImage.new('RGB', size, 'red').save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(IMAGE_DERIVATIVE_WORKERS=0, CATALOG_CACHE_TIMEOUT=0)
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.settings_override = override_settings(MEDIA_ROOT=media_root)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.client = APIClient()
+        category = Category.objects.create(name='Phones')
+        self.product = Product.objects.create(
+            name='Phone', brand='Brand', price=100.0, amount=1, category=category
+        )
+
+    def test_upload_generates_every_size(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(product=self.product, image=png_upload())
+
+        for size, edge in {'small': 160, 'medium': 480, 'large': 960}.items():
+            name = derivative_name(image.image.name, size)
+            self.assertTrue(default_storage.exists(name))
+            with default_storage.open(name) as file:
+                derivative = PILImage.open(file)
+                self.assertEqual(derivative.format, 'WEBP')
+                self.assertEqual(max(derivative.size), edge)
+
+    def test_serializers_expose_thumbnail_urls(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(product=self.product, image=png_upload())
+        expected = {
+            size: f'http://testserver/media/{derivative_name(image.image.name, size)}'
+            for size in ('small', 'medium', 'large')
+        }
+
+        listed = self.client.get('/api/products/').json()['results'][0]
+        self.assertEqual(listed['images'][0]['thumbnails'], expected)
+        detail = self.client.get(f'/api/products/{self.product.pk}/').json()
+        self.assertEqual(detail['images'][0]['thumbnails'], expected)
+
+    def test_resaving_without_new_upload_does_not_regenerate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(product=self.product, image=png_upload())
+        with mock.patch('product.images.generate_derivatives') as generate:
+            with self.captureOnCommitCallbacks(execute=True):
+                image.save()
+        generate.assert_not_called()
+
+    def test_derivatives_not_ready_fall_back_to_the_original(self):
+        name = default_storage.save('images/products/raw.png', png_upload('raw.png'))
+        image = Image.objects.create(product=self.product, image=name)
+
+        self.assertFalse(image.derivatives_ready)
+        self.assertEqual(derivative_urls(image.image, image.derivatives_ready),
+                         dict.fromkeys(['small', 'medium', 'large'], f'/media/{name}'))
+
+    def test_listing_never_asks_the_storage_backend(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Image.objects.create(product=self.product, image=png_upload())
+        with mock.patch.object(FileSystemStorage, 'exists') as exists:
+            listed = self.client.get('/api/products/').json()['results'][0]
+            self.client.get(f'/api/products/{self.product.pk}/')
+        exists.assert_not_called()
+        self.assertTrue(listed['images'][0]['thumbnails']['small'].endswith('_small.webp'))
+
+    def test_finished_derivatives_invalidate_cached_pages(self):
+        image = Image.objects.create(product=self.product, image=png_upload())
+        version = get_catalog_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            schedule_derivatives(image.image)
+
+        image.refresh_from_db()
+        self.assertTrue(image.derivatives_ready)
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_deleting_an_image_removes_its_derivatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = Image.objects.create(product=self.product, image=png_upload())
+            shared = Image.objects.create(product=self.product, image=png_upload('shared.png'))
+            Banner.objects.create(title='Promo', image=shared.image.name)
+        removed, kept = (
+            [derivative_name(image.image.name, size) for size in ('small', 'medium', 'large')]
+            for image in (image, shared)
+        )
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image.delete()
+            shared.delete()
+
+        self.assertFalse(any(default_storage.exists(name) for name in removed))
+        # The banner still shows the same file.
+        self.assertTrue(all(default_storage.exists(name) for name in kept))
+
+    def test_replacing_an_image_removes_the_old_derivatives(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            banner = Banner.objects.create(title='Promo', image=png_upload('old.png'))
+        old = banner.image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            banner.image = png_upload('new.png')
+            banner.save()
+
+        for size in ('small', 'medium', 'large'):
+            self.assertFalse(default_storage.exists(derivative_name(old, size)))
+            self.assertTrue(default_storage.exists(derivative_name(banner.image.name, size)))
+
+    def test_backfill_command_renders_missing_derivatives(self):
+        name = default_storage.save('banners/promo.png', png_upload('promo.png', (400, 100)))
+        Banner.objects.create(title='Promo', image=name)
+        out = StringIO()
+
+        call_command('generate_image_derivatives', '--workers', '2', stdout=out)
+
+        self.assertIn('3 derivatives written', out.getvalue())
+        self.assertTrue(Banner.objects.get().derivatives_ready)
+        self.assertTrue(default_storage.exists(derivative_name(name, 'small')))
+        # The large rendition never upscales past the original.
+        with default_storage.open(derivative_name(name, 'large')) as file:
+            self.assertEqual(PILImage.open(file).size, (400, 100))
+
+
+class CartPricingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.category = Category.objects.create(name='Phones')
+        self.cart = Cart.objects.create(user=self.user)
+
+    def add(self, count, quantity=2):
+        products = make_products(self.category, count)
+        for product in products:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=quantity)
+        return products
+
+    def test_cart_view_returns_priced_lines_and_totals(self):
+        products = self.add(2)
+        Discount.objects.filter(product=products[1]).update(active=False)
+
+        data = self.client.get('/api/cart/').json()
+
+        self.assertEqual(data['id'], self.cart.pk)
+        self.assertEqual(data['item_count'], 4)
+        self.assertEqual(data['items'][0], {
+            'id': data['items'][0]['id'], 'product': products[0].pk, 'name': 'Product 0', 'quantity': 2,
+            'unit_price': '100.00', 'discounted_unit_price': '90.00', 'discount_percentage': 10.0,
+            'subtotal': '200.00', 'savings': '20.00', 'total': '180.00',
+        })
+        self.assertIsNone(data['items'][1]['discount_percentage'])
+        self.assertEqual(
+            (data['subtotal'], data['savings'], data['total']),
+            ('402.00', '20.00', '382.00'),
+        )
+        self.assertEqual(self.cart.total, Decimal('382.00'))
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        self.add(1)
+        with self.assertNumQueries(3):
+            self.client.get('/api/cart/')
+        self.add(20)
+        with self.assertNumQueries(3):
+            data = self.client.get('/api/cart/').json()
+        self.assertEqual(len(data['items']), 21)
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = make_products(Category.objects.create(name='Phones'), 6)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def quantities(self):
+        return dict(CartItem.objects.filter(cart=self.cart).values_list('product__name', 'quantity'))
+
+    def batch(self, *operations):
+        return self.client.post('/api/cart/items/batch/', {'operations': list(operations)}, format='json')
+
+    def test_operations_apply_in_order_and_return_the_priced_cart(self):
+        a, b, c, d = self.products[:4]
+        CartItem.objects.create(cart=self.cart, product=a, quantity=1)
+        CartItem.objects.create(cart=self.cart, product=b, quantity=4)
+        CartItem.objects.create(cart=self.cart, product=c, quantity=2)
+
+        response = self.batch(
+            {'op': 'add', 'product': a.pk, 'quantity': 2},
+            {'op': 'set', 'product': b.pk, 'quantity': 1},
+            {'op': 'remove', 'product': c.pk},
+            {'op': 'add', 'product': d.pk},
+            {'op': 'add', 'product': d.pk, 'quantity': 4},
+            {'op': 'set', 'product': a.pk, 'quantity': 0},
+            {'op': 'add', 'product': a.pk, 'quantity': 7},
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.quantities(), {'Product 0': 7, 'Product 1': 1, 'Product 3': 5})
+        self.assertEqual(response.json()['item_count'], 13)
+        self.assertEqual(response.json()['total'], str(self.cart.total))
+
+    def test_invalid_batch_changes_nothing(self):
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+
+        response = self.batch(
+            {'op': 'remove', 'product': self.products[0].pk},
+            {'op': 'add', 'product': 999999},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('999999', str(response.json()['operations']))
+        self.assertEqual(self.batch({'op': 'set', 'product': self.products[1].pk}).status_code, 400)
+        self.assertEqual(self.batch({'op': 'add', 'product': self.products[1].pk, 'quantity': 0}).status_code, 400)
+        self.assertEqual(self.quantities(), {'Product 0': 1})
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+        CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=1)
+        operations = [
+            {'op': 'set', 'product': self.products[0].pk, 'quantity': 3},
+            {'op': 'remove', 'product': self.products[1].pk},
+            {'op': 'add', 'product': self.products[2].pk},
+        ]
+        with self.assertNumQueries(10):
+            self.batch(*operations)
+        operations = [{'op': 'set', 'product': product.pk, 'quantity': 2} for product in self.products[:5]] + [
+            {'op': 'remove', 'product': self.products[2].pk},
+            {'op': 'add', 'product': self.products[5].pk},
+        ]
+        with self.assertNumQueries(10):
+            self.batch(*operations)
+        self.assertEqual(len(self.quantities()), 5)
+
+    def test_new_lines_add_to_a_line_created_concurrently(self):
+        product = self.products[0]
+
+        def change(current):
+            # Another request adds the same product after this one read the cart.
+            CartItem.objects.add_quantity(self.cart.pk, product.pk, 2)
+            return apply_operations(current, [{'op': 'add', 'product': product.pk, 'quantity': 1}])
+
+        update_cart(self.cart, [product.pk], change)
+        self.assertEqual(self.quantities(), {'Product 0': 3})
+
+
+@override_settings(GUEST_CART_TTL=600)
+class GuestCartTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.products = make_products(Category.objects.create(name='Phones'), 3)
+
+    def guest_batch(self, *operations, token=None):
+        headers = {'X-Cart-Token': token} if token else {}
+        return self.client.post('/api/cart/items/batch/', {'operations': list(operations)},
+                                format='json', headers=headers)
+
+    def test_guest_cart_lives_in_the_cache(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.guest_batch({'op': 'add', 'product': self.products[0].pk, 'quantity': 2})
+        self.assertEqual(response.status_code, 200)
+        token = response['X-Cart-Token']
+        self.assertEqual(response.json()['token'], token)
+        self.assertEqual((response.json()['id'], response.json()['total']), (None, '180.00'))
+
+        response = self.guest_batch({'op': 'add', 'product': self.products[1].pk}, token=token)
+        self.assertEqual(response['X-Cart-Token'], token)
+        data = self.client.get('/api/cart/', headers={'X-Cart-Token': token}).json()
+
+        self.assertEqual([(line['product'], line['quantity']) for line in data['items']],
+                         [(self.products[0].pk, 2), (self.products[1].pk, 1)])
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(any(query['sql'].startswith(('INSERT', 'UPDATE')) for query in queries.captured_queries))
+
+    def test_entries_expire_after_the_ttl(self):
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            self.guest_batch({'op': 'add', 'product': self.products[0].pk})
+        self.assertEqual(cache_set.call_args.args[2], 600)
+
+    def test_forged_or_unknown_tokens_give_an_empty_cart(self):
+        token = self.guest_batch({'op': 'add', 'product': self.products[0].pk})['X-Cart-Token']
+        for bad in [token[:-1] + ('A' if token[-1] != 'A' else 'B'), 'not-a-token']:
+            data = self.client.get('/api/cart/', headers={'X-Cart-Token': bad}).json()
+            self.assertEqual((data['items'], data['token']), ([], None))
+
+    def test_reading_a_cart_never_creates_one(self):
+        user = User.objects.create_user(username='buyer', password='pass12345')
+        self.assertEqual(self.client.get('/api/cart/').json()['items'], [])
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get('/api/cart/').json()['items'], [])
+        self.assertFalse(Cart.objects.exists())
+
+    def test_guest_cart_merges_into_the_user_cart(self):
+        first, second, third = self.products
+        Product.objects.filter(pk=second.pk).update(amount=6)
+        token = self.guest_batch(
+            {'op': 'add', 'product': first.pk, 'quantity': 2},
+            {'op': 'add', 'product': second.pk, 'quantity': 5},
+            {'op': 'add', 'product': third.pk},
+        )['X-Cart-Token']
+        third.delete()
+
+        user = User.objects.create_user(username='buyer', password='pass12345')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=first, quantity=1)
+        CartItem.objects.create(cart=cart, product=second, quantity=3)
+        self.client.force_authenticate(user)
+
+        data = self.client.get('/api/cart/', headers={'X-Cart-Token': token}).json()
+
+        # Summed, capped at the 6 in stock, deleted product dropped.
+        self.assertEqual([(line['product'], line['quantity']) for line in data['items']],
+                         [(first.pk, 3), (second.pk, 6)])
+        self.assertEqual(data['id'], cart.pk)
+        self.assertIsNone(GuestCart.from_token(token))
+        # The token is spent: sending it again changes nothing.
+        data = self.client.get('/api/cart/', headers={'X-Cart-Token': token}).json()
+        self.assertEqual(data['item_count'], 9)
+
+    def test_stock_cap_never_shrinks_the_user_cart(self):
+        token = self.guest_batch({'op': 'add', 'product': self.products[0].pk, 'quantity': 4})['X-Cart-Token']
+        user = User.objects.create_user(username='buyer', password='pass12345')
+        CartItem.objects.create(cart=Cart.objects.create(user=user), product=self.products[0], quantity=12)
+        self.client.force_authenticate(user)
+
+        data = self.client.get('/api/cart/', headers={'X-Cart-Token': token}).json()
+        self.assertEqual(data['items'][0]['quantity'], 12)
+
+    def test_login_then_checkout_keeps_the_guest_lines(self):
+        token = self.guest_batch({'op': 'add', 'product': self.products[0].pk, 'quantity': 2})['X-Cart-Token']
+        user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client.force_authenticate(user)
+
+        response = self.client.post('/orders/checkout/', {
+            'first_name': 'Ali', 'last_name': 'Valiyev', 'phone': '+998900000000', 'address': 'Tashkent',
+        }, format='json', headers={'X-Cart-Token': token})
+
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual([(item['product'], item['quantity']) for item in response.json()['items']],
+                         [('Product 0', 2)])
+        self.assertIsNone(GuestCart.from_token(token))
+
+    def test_login_then_adding_an_item_keeps_the_guest_lines(self):
+        token = self.guest_batch({'op': 'add', 'product': self.products[0].pk, 'quantity': 2})['X-Cart-Token']
+        user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client.force_authenticate(user)
+
+        self.client.post('/api/cart/items/add/', {'product': self.products[1].pk, 'quantity': 1},
+                         format='json', headers={'X-Cart-Token': token})
+
+        self.assertEqual(dict(CartItem.objects.filter(cart__user=user).values_list('product', 'quantity')),
+                         {self.products[0].pk: 2, self.products[1].pk: 1})
+
+    def test_merge_creates_the_user_cart_when_missing(self):
+        token = self.guest_batch({'op': 'add', 'product': self.products[0].pk, 'quantity': 2})['X-Cart-Token']
+        user = User.objects.create_user(username='buyer', password='pass12345')
+        self.client.force_authenticate(user)
+
+        response = self.guest_batch({'op': 'add', 'product': self.products[1].pk}, token=token)
+
+        self.assertEqual(response.json()['user'], user.pk)
+        self.assertEqual(response.json()['item_count'], 3)
+        self.assertNotIn('X-Cart-Token', response)
+
+
+class CartItemUpsertTests(TestCase):
+    def test_adding_twice_increments_one_line(self):
+        user = User.objects.create_user(username='buyer', password='pass12345')
+        product = make_products(Category.objects.create(name='Phones'), 1)[0]
+        client = APIClient()
+        client.force_authenticate(user)
+
+        for quantity in (2, 3):
+            response = client.post('/api/cart/items/add/', {'product': product.pk, 'quantity': quantity})
+            self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(list(CartItem.objects.values_list('quantity', flat=True)), [5])
+        self.assertEqual(response.json(), {'product': product.pk, 'quantity': 5})
+
+
+class ConcurrentCartAddTests(TransactionTestCase):
+    def test_concurrent_adds_lose_no_units(self):
+        user = User.objects.create_user(username='buyer', password='pass12345')
+        product = make_products(Category.objects.create(name='Phones'), 1)[0]
+        cart = Cart.objects.create(user=user)
+        adds = 24
+        barrier = threading.Barrier(adds)
+        statuses = []
+
+        def add():
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                statuses.append(client.post('/api/cart/items/add/', {'product': product.pk, 'quantity': 1}).status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add) for _ in range(adds)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [201] * adds)
+        self.assertEqual(list(CartItem.objects.filter(cart=cart).values_list('quantity', flat=True)), [adds])
+
+
+class ProductExportTests(TestCase):
+    def test_catalog_streams_with_list_filters(self):
+        admin = User.objects.create_user(username='finance', password='pass12345', role='admin')
+        client = APIClient()
+        client.force_authenticate(admin)
+        phones = Category.objects.create(name='Phones')
+        product = make_products(phones, 3)[0]
+        make_products(Category.objects.create(name='Laptops'), 2)
+        Product.objects.filter(name='Product 2', category=phones).update(is_available=False)
+
+        response = client.get('/api/products/export/', {'category': phones.pk, 'is_available': 'true'})
+
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:4], ['id', 'name', 'brand', 'category_id'])
+        self.assertEqual([line.split(',')[1] for line in lines[1:]], ['Product 0', 'Product 1'])
+        self.assertEqual(client.get(f'/api/products/{product.pk}/').status_code, 200)
+
+
+class AdminChangelistQueryTests(TestCase):
+    """Every registered ModelAdmin lists a full page in a fixed number of queries."""
+    # Queries per changelist page, session and permission checks included.
+    BUDGET = {
+        'auth.group': 5,
+        'users.user': 5,
+        'product.banner': 5,
+        'product.category': 6,
+        'product.product': 7,
+        'product.discount': 5,
+        'product.wishlist': 5,
+        'product.review': 6,
+        'product.cart': 7,
+        'order.order': 5,
+    }
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='root', password='pass12345', email='root@example.com')
+        self.client.force_login(self.admin)
+        self.seeded = 0
+
+    def seed(self, count):
+        now = timezone.now()
+        for i in range(self.seeded, self.seeded + count):
+            user = User.objects.create(username=f'user{i}')
+            banner = Banner.objects.create(title=f'Banner {i}', image='banners/banner.png')
+            category = Category.objects.create(name=f'Category {i}', banner=banner)
+            product = Product.objects.create(name=f'Product {i}', brand='Brand', price=10.0, amount=50,
+                                             category=category)
+            Discount.objects.create(title=f'Sale {i}', product=product, percentage=10.0, active=True,
+                                    start_date=now - timedelta(days=1), end_date=now + timedelta(days=1))
+            Wishlist.objects.create(user=user, product=product)
+            Review.objects.create(user=user, product=product, rating=4)
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+            order = Order.objects.create(user=user, first_name='A', last_name='B', phone='1', address='C')
+            OrderItem.objects.create(order=order, product=product, quantity=1)
+        self.seeded += count
+
+    def changelist_queries(self, model):
+        url = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_every_registered_admin_has_a_budget(self):
+        self.assertEqual({model._meta.label_lower for model in site._registry}, set(self.BUDGET))
+
+    def test_changelist_queries_do_not_grow_with_the_page(self):
+        self.seed(2)
+        small = {model: self.changelist_queries(model) for model in site._registry}
+        self.seed(60)
+        for model in site._registry:
+            with self.subTest(model=model._meta.label_lower):
+                full = self.changelist_queries(model)
+                self.assertEqual(full, small[model])
+                self.assertLessEqual(full, self.BUDGET[model._meta.label_lower])
+
+
+class AdminAutocompleteTests(TestCase):
+    """Admin forms and filters referencing products or users don't grow with the catalog."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='root', password='pass12345', email='root@example.com')
+        self.client.force_login(self.admin)
+        self.category = Category.objects.create(name='Phones')
+        self.product = Product.objects.create(name='Phone', brand='B', price=10.0, amount=5, category=self.category)
+        self.cart = Cart.objects.create(user=self.admin)
+        CartItem.objects.create(cart=self.cart, product=self.product, quantity=1)
+        self.order = Order.objects.create(user=self.admin, first_name='A', last_name='B', phone='1', address='C')
+        OrderItem.objects.create(order=self.order, product=self.product, quantity=1)
+
+    def pages(self):
+        return [
+            reverse('admin:product_discount_changelist'),
+            reverse('admin:product_discount_add'),
+            reverse('admin:product_wishlist_add'),
+            reverse('admin:product_review_add'),
+            reverse('admin:product_cart_change', args=[self.cart.pk]),
+            reverse('admin:order_order_change', args=[self.order.pk]),
+        ]
+
+    def render(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.content.decode()
+
+    def test_pages_do_not_list_the_catalog(self):
+        for url in self.pages():
+            self.render(url)  # warm per-process caches (content types, permissions)
+        before = {url: self.render(url)[0] for url in self.pages()}
+        Product.objects.bulk_create(
+            Product(name=f'Bulk {i}', brand='B', price=1.0, amount=1, category=self.category) for i in range(200)
+        )
+        User.objects.bulk_create(User(username=f'bulk{i}') for i in range(200))
+        for url in self.pages():
+            with self.subTest(url=url):
+                count, content = self.render(url)
+                self.assertEqual(count, before[url])
+                self.assertNotIn('Bulk 1', content)
+                self.assertNotIn('bulk1', content)
+
+    def test_product_and_user_fields_search_on_demand(self):
+        for model_name, field_name, term, expected in [
+            ('discount', 'product', 'Pho', 'Phone'),
+            ('review', 'user', 'roo', 'root'),
+        ]:
+            response = self.client.get(reverse('admin:autocomplete'), {
+                'app_label': 'product', 'model_name': model_name, 'field_name': field_name, 'term': term,
+            })
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([row['text'] for row in response.json()['results']], [expected])
+
+    def test_discount_product_filter_applies(self):
+        other = Product.objects.create(name='Case', brand='B', price=2.0, amount=5, category=self.category)
+        now = timezone.now()
+        for product in (self.product, other):
+            Discount.objects.create(title=product.name, product=product, percentage=5.0,
+                                    start_date=now, end_date=now + timedelta(days=1))
+        response = self.client.get(reverse('admin:product_discount_changelist'), {'product__id__exact': other.pk})
+        self.assertEqual([discount.title for discount in response.context['cl'].result_list], ['Case'])
+
+
+class CatalogImportTests(TestCase):
+    HEADER = 'sku,name,brand,category,price,amount,is_available,discount_percentage,discount_start,discount_end,images\n'
+
+    def setUp(self):
+        self.phones = Category.objects.create(name='Phones')
+        self.now = timezone.now()
+        self.window = f'{(self.now - timedelta(days=1)).isoformat()},{(self.now + timedelta(days=1)).isoformat()}'
+
+    def run_import(self, text, format='csv', **kwargs):
+        return import_catalog(StringIO(text), format, **kwargs)
+
+    def csv_rows(self, count, start=0, category='Phones'):
+        return ''.join(
+            f'SKU-{i},Phone {i},Brand,{category},100,5,true,,,,\n' for i in range(start, start + count)
+        )
+
+    def test_creates_products_with_discounts_images_and_categories(self):
+        version = get_catalog_version()
+        result = self.run_import(
+            self.HEADER
+            + f'A-1,Alpha phone,Acme,Phones,200,3,true,25,{self.window},images/products/a.jpg|images/products/b.jpg\n'
+            + 'A-2,Beta laptop,Acme,Laptops,999.5,7,,,,,\n'
+        )
+        self.assertEqual((result.rows, result.created, result.updated, result.error_count), (2, 2, 0, 0))
+        self.assertEqual((result.discounts, result.images), (1, 2))
+
+        alpha = Product.objects.get(sku='A-1')
+        self.assertEqual((alpha.category, alpha.price, alpha.effective_price), (self.phones, 200.0, 150.0))
+        self.assertEqual(sorted(alpha.image_set.values_list('image', flat=True)),
+                         ['images/products/a.jpg', 'images/products/b.jpg'])
+        beta = Product.objects.get(sku='A-2')
+        self.assertEqual((beta.category.name, beta.effective_price, beta.is_available), ('Laptops', 999.5, True))
+        self.assertEqual(get_search_engine().search('beta', 10), [beta.pk])
+        self.assertEqual(get_catalog_version(), version + 1)
+
+    def test_upserts_by_sku_and_keeps_columns_left_out(self):
+        self.run_import(self.HEADER + f'A-1,Alpha,Acme,Phones,200,3,true,25,{self.window},images/products/a.jpg\n')
+        result = self.run_import(
+            'sku,price,amount,discount_percentage,discount_start,discount_end,images\n'
+            f'A-1,300,9,10,{self.window},images/products/a.jpg|images/products/c.jpg\n'
+        )
+        self.assertEqual((result.created, result.updated, result.discounts, result.images), (0, 1, 1, 1))
+        product = Product.objects.get()
+        self.assertEqual((product.name, product.price, product.amount, product.effective_price),
+                         ('Alpha', 300.0, 9, 270.0))
+        self.assertEqual(Discount.objects.get().percentage, 10.0)
+        self.assertEqual(product.image_set.count(), 2)
+
+    def test_rejects_invalid_rows_and_imports_the_rest(self):
+        other = Product.objects.create(name='Held', brand='B', price=5.0, amount=1, category=self.phones, sku='HELD')
+        Discount.objects.create(title='Spring', product=other, percentage=5.0, active=True,
+                                start_date=self.now - timedelta(days=2), end_date=self.now + timedelta(days=2))
+        result = self.run_import(
+            self.HEADER
+            + 'OK-1,Fine,Acme,Phones,10,1,,,,,\n'
+            + 'BAD-1,Neg,Acme,Phones,-1,1,,,,,\n'
+            + 'NEW-1,,,,10,1,,,,,\n'
+            + f'HELD,,,,,,,20,{self.window},\n'
+            + 'BAD-2,Window,Acme,Phones,10,1,,20,,,\n'
+        )
+        self.assertEqual((result.rows, result.created, result.updated), (5, 1, 1))
+        self.assertEqual([(line, sku) for line, sku, _ in result.errors],
+                         [(3, 'BAD-1'), (6, 'BAD-2'), (4, 'NEW-1'), (5, 'HELD')])
+        self.assertIn('price', result.errors[0][2])
+        self.assertIn('name, brand', result.errors[2][2])
+        self.assertEqual(other.discounts.get().title, 'Spring')
+
+    def test_each_batch_costs_a_fixed_number_of_queries(self):
+        # Batches stay below the backend's bulk insert size, so each is a single INSERT.
+        with CaptureQueriesContext(connection) as small:
+            self.run_import(self.HEADER + self.csv_rows(5), batch_size=50)
+        with CaptureQueriesContext(connection) as large:
+            self.run_import(self.HEADER + self.csv_rows(50, start=5), batch_size=50)
+        self.assertEqual(len(large), len(small))
+        with CaptureQueriesContext(connection) as two_batches:
+            self.run_import(self.HEADER + self.csv_rows(50, start=55) + self.csv_rows(50, start=105), batch_size=50)
+        # Category names are looked up once per import, not per batch.
+        self.assertEqual(len(two_batches), 2 * len(large) - 1)
+        self.assertEqual(Product.objects.count(), 155)
+
+    def test_command_streams_jsonl_and_reports_progress(self):
+        path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), 'catalog.jsonl')
+        with open(path, 'w') as file:
+            for i in range(5):
+                file.write(json.dumps({'sku': f'J-{i}', 'name': f'Item {i}', 'brand': 'B', 'category': 'Phones',
+                                       'price': 10, 'amount': 1, 'images': [f'images/products/{i}.jpg']}) + '\n')
+            file.write('{not json\n')
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, '--batch-size', '2', stdout=out, stderr=err)
+        self.assertEqual(Product.objects.filter(sku__startswith='J-').count(), 5)
+        self.assertEqual(out.getvalue().count('rows read'), 3)
+        self.assertIn('5 products created', out.getvalue())
+        self.assertIn('Line 6 (no sku): Invalid JSON', err.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('import_catalog', path.replace('.jsonl', '.xml'), stdout=out)
+
+    def test_admin_upload_action(self):
+        admin_user = User.objects.create_superuser(username='root', password='pass12345', email='root@example.com')
+        self.client.force_login(admin_user)
+        url = reverse('admin:product_product_import_catalog')
+        self.assertEqual(self.client.get(url).status_code, 200)
+        upload = SimpleUploadedFile('catalog.csv', (self.HEADER + self.csv_rows(3)).encode(), 'text/csv')
+        response = self.client.post(url, {'file': upload}, follow=True)
+        self.assertRedirects(response, reverse('admin:product_product_changelist'))
+        self.assertContains(response, '3 products created')
+        self.assertEqual(Product.objects.count(), 3)
+
+
+@override_settings(DATABASE_READ_ALIAS='replica', CATALOG_CACHE_TIMEOUT=0)
+class ReadReplicaRoutingTests(TransactionTestCase):
+    """
+    `replica` is a separate SQLite file here, so the two databases can hold
+    different rows and every response shows which one it was read from.
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username='admin', password='pass12345', role='admin')
+        for alias, name in [('default', 'On primary'), ('replica', 'On replica')]:
+            Category.objects.using(alias).bulk_create([Category(pk=1, name='Phones')])
+            Product.objects.using(alias).bulk_create([
+                Product(pk=1, name=name, brand='B', price=10.0, effective_price=10.0, amount=5, category_id=1),
+            ])
+
+    def product_name(self):
+        response = self.client.get('/api/products/1/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['name']
+
+    def test_catalog_reads_go_to_the_read_alias(self):
+        self.assertEqual(self.product_name(), 'On replica')
+        self.assertEqual(self.client.get('/api/products/').json()['results'][0]['name'], 'On replica')
+        with override_settings(DATABASE_READ_ALIAS=None):
+            self.assertEqual(self.product_name(), 'On primary')
+
+    def test_writes_go_to_the_primary_and_pin_the_user(self):
+        self.client.force_authenticate(self.admin)
+        response = self.client.patch('/api/products/1/', {'amount': 7}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Product.objects.using('default').get(pk=1).amount, 7)
+        self.assertEqual(Product.objects.using('replica').get(pk=1).amount, 5)
+
+        # Within the stickiness window the writer keeps reading the primary...
+        self.assertEqual(self.product_name(), 'On primary')
+        # ...while everyone else reads the replica.
+        self.client.force_authenticate(None)
+        self.assertEqual(self.product_name(), 'On replica')
+        self.client.force_authenticate(self.admin)
+        cache.delete(f'db:primary:{self.admin.pk}')
+        self.assertEqual(self.product_name(), 'On replica')
+
+    def test_reads_after_a_write_in_the_same_scope_use_the_primary(self):
+        with routing_scope():
+            self.assertTrue(use_read_replica())
+            self.assertEqual(Product.objects.get(pk=1).name, 'On replica')
+            product = Product.objects.get(pk=1)
+            product.amount = 9
+            product.save(update_fields=['amount'])
+            self.assertEqual(Product.objects.get(pk=1).name, 'On primary')
+            self.assertFalse(use_read_replica())
+        self.assertEqual(Product.objects.using('replica').get(pk=1).amount, 5)
+        self.assertEqual(Product.objects.get(pk=1).amount, 9)
+
+    def test_other_endpoints_read_the_primary(self):
+        self.client.force_authenticate(self.admin)
+        self.assertEqual(self.client.get('/api/cart/').status_code, 200)
+        with CaptureQueriesContext(connections['replica']) as replica_queries:
+            self.client.get('/orders/')
+            self.client.get('/api/cart/')
+        self.assertEqual(len(replica_queries), 0)
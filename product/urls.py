@@ -5,6 +5,8 @@ from .views import (BannerViewSet ,CategoryViewSet,
                     WishListViewSet, ReviewViewSet,
                     CartAPIView, CartItemAddAPIView,
                     CartItemUpdateAPIView, CartItemDeleteAPIView,
+                    CartItemBatchAPIView,
+                    CatalogCacheStatsAPIView, ProductExportAPIView,
                     )
 
 router = DefaultRouter()
@@ -16,10 +18,16 @@ router.register(r'wishlists', WishListViewSet, basename='wishlist')
 router.register(r'reviews', ReviewViewSet, basename='review')
 
 
-urlpatterns = router.urls
+# Listed before the router so `products/export/` is not taken for a product id.
+urlpatterns = [
+    path('products/export/', ProductExportAPIView.as_view(), name='product-export'),
+]
+urlpatterns += router.urls
 urlpatterns += [
+    path('cache/stats/', CatalogCacheStatsAPIView.as_view(), name='catalog-cache-stats'),
     path('cart/', CartAPIView.as_view(), name='cart'),
     path('cart/items/add/', CartItemAddAPIView.as_view(), name='cart-item-add'),
+    path('cart/items/batch/', CartItemBatchAPIView.as_view(), name='cart-item-batch'),
     path('cart/items/<int:pk>/update/', CartItemUpdateAPIView.as_view(), name='cart-item-update'),
     path('cart/items/<int:pk>/delete/', CartItemDeleteAPIView.as_view(), name='cart-item-delete'),
 ]
\ No newline at end of file
@@ -1,31 +1,61 @@
 from rest_framework import viewsets, generics, permissions, filters
-from .filters import ProductFilter
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from django_filters.rest_framework import DjangoFilterBackend
+from .cache import CatalogCacheMixin, get_cache_stats
+from .filters import ProductExportFilter, ProductFilter, ProductSearchFilter
+from .carts import TOKEN_HEADER, GuestCart, GuestCartMergeMixin, get_user_cart
+from .pricing import price_cart, price_guest_cart
 from users.mixins import ReadOnlyOrIsAdminMixin
 from users.permissions import IsAdmin
+from core.db import ReadReplicaMixin
+from core.exports import ExportAPIView
 
 
 from .serializers import (
-            BannerSerializer, CartSerializer,
+            BannerSerializer,
             CategorySerializer, CategoryCreateSerializer,
             ProductSerializer, ProductCreateSerializer,
             DiscountSerializer, DiscountCreateSerializer,
             WishlistSerializer, WishlistCreateSerializer,
             ReviewSerializer, ReviewCreateSerializer,
-            CartItemSerializer, CartItemCreateUpdateSerializer
+            CartItemSerializer, CartItemCreateUpdateSerializer,
+            ProductValuesSerializer, PricedCartSerializer, CartBatchSerializer,
+            requested_fields, requested_expansions,
 )
 from .models import (
             Banner, Category,Product, Discount,
             Wishlist, Review, Cart, CartItem,
+            product_prefetches,
 )
 
-class BannerViewSet(ReadOnlyOrIsAdminMixin, viewsets.ModelViewSet):
+class NestedProductQuerysetMixin:
+    """
+    Load the nested `product` of every row in bulk when it is expanded
+    (`?expand=product`), prefetching only what its requested fields read.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ['list', 'retrieve']:
+            return queryset
+        fields = requested_fields(self.request)
+        if 'product' in requested_expansions(self.request) and (fields is None or 'product' in fields):
+            product_fields = fields['product'] if fields else None
+            queryset = queryset.select_related('product').prefetch_related(
+                *product_prefetches('product', product_fields)
+            )
+        return queryset
+
+
+class BannerViewSet(ReadReplicaMixin, CatalogCacheMixin, ReadOnlyOrIsAdminMixin, viewsets.ModelViewSet):
     queryset = Banner.objects.all()
     serializer_class = BannerSerializer
 
 
 
 
-class CategoryViewSet(ReadOnlyOrIsAdminMixin, viewsets.ModelViewSet):
+class CategoryViewSet(ReadReplicaMixin, CatalogCacheMixin, ReadOnlyOrIsAdminMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
 
     def get_serializer_class(self):
@@ -35,21 +65,58 @@ class CategoryViewSet(ReadOnlyOrIsAdminMixin, viewsets.ModelViewSet):
 
 
 
-class ProductViewSet(ReadOnlyOrIsAdminMixin, viewsets.ModelViewSet):
+class ProductViewSet(ReadReplicaMixin, CatalogCacheMixin, ReadOnlyOrIsAdminMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [DjangoFilterBackend, filters.OrderingFilter, ProductSearchFilter]
     search_fields = ['name', 'brand', 'category__name']
-    ordering_fields = ['price', '-price', 'rating','-rating', 'created_at', '-created_at']
+    ordering_fields = ['price', '-price', 'effective_price', '-effective_price',
+                       'rating','-rating', 'created_at', '-created_at']
     filterset_class = ProductFilter
     ordering = ['-rating']
+    # Serve list pages from .values() rows (ProductValuesSerializer).
+    fast_list = True
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ['list', 'retrieve']:
+            queryset = queryset.with_related(requested_fields(self.request))
+        return queryset
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return ProductSerializer
         return ProductCreateSerializer
 
+    def list(self, request, *args, **kwargs):
+        fields = requested_fields(request)
+        if not self.fast_list or (fields is not None and any(fields.values())):
+            # Nested selections such as `images.id` need the full serializer.
+            return super().list(request, *args, **kwargs)
+        return self.cached_response(request, self.list_from_values, *args, **kwargs)
+
+    def list_from_values(self, request, *args, **kwargs):
+        """`list` served by ProductValuesSerializer instead of model instances."""
+        queryset = self.filter_queryset(self.get_queryset().prefetch_related(None))
+        rows = queryset.values(*ProductValuesSerializer.columns, 'effective_price', *queryset.query.annotations)
+        page = self.paginate_queryset(rows)
+        serializer = ProductValuesSerializer(
+            rows if page is None else page,
+            context=self.get_serializer_context(),
+            fields=requested_fields(request),
+        )
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
 
-class DiscountViewSet(viewsets.ModelViewSet):
+class CatalogCacheStatsAPIView(APIView):
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return Response(get_cache_stats())
+
+
+class DiscountViewSet(NestedProductQuerysetMixin, viewsets.ModelViewSet):
     queryset = Discount.objects.all()
     permission_classes = [permissions.IsAuthenticated, IsAdmin]
 
@@ -58,17 +125,17 @@ class DiscountViewSet(viewsets.ModelViewSet):
             return DiscountSerializer
         return DiscountCreateSerializer
     
-class WishListViewSet(viewsets.ModelViewSet):
+class WishListViewSet(NestedProductQuerysetMixin, viewsets.ModelViewSet):
     queryset = Wishlist.objects.all()
     permission_classes = [permissions.IsAuthenticated]
-    
+
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
             return WishlistSerializer
         return WishlistCreateSerializer
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(NestedProductQuerysetMixin, viewsets.ModelViewSet):
     queryset = Review.objects.all()
     permission_classes = [permissions.IsAuthenticated]
 
@@ -77,14 +144,50 @@ class ReviewViewSet(viewsets.ModelViewSet):
             return ReviewSerializer
         return ReviewCreateSerializer
 
-class CartAPIView(generics.RetrieveAPIView):
-    serializer_class = CartSerializer
+class CartAPIView(GuestCartMergeMixin, generics.RetrieveAPIView):
+    """
+    The priced cart of the user, or of the guest cart whose token comes in
+    the X-Cart-Token header. Reading a cart never creates one.
+    """
+    serializer_class = PricedCartSerializer
 
     def get_object(self):
-        cart, _ = Cart.objects.get_or_create(user=self.request.user)
-        return cart
+        if self.request.user.is_authenticated:
+            return price_cart(get_user_cart(self.request))
+        guest = GuestCart.from_request(self.request)
+        return price_guest_cart(guest) if guest is not None else price_cart(None)
 
-class CartItemAddAPIView(generics.CreateAPIView):
+
+class CartItemBatchAPIView(GuestCartMergeMixin, generics.GenericAPIView):
+    """
+    Apply a list of add / set / remove operations to the cart and return the
+    priced cart. Anonymous shoppers get a cache-backed guest cart whose
+    token is returned in the body and the X-Cart-Token header.
+    """
+    serializer_class = CartBatchSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if getattr(self, 'swagger_fake_view', False):
+            return context
+        if self.request.user.is_authenticated:
+            context['cart'] = get_user_cart(self.request) or Cart.objects.create(user=self.request.user)
+        else:
+            context['cart'] = GuestCart.from_request(self.request) or GuestCart()
+        return context
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        cart = serializer.save()
+        if isinstance(cart, GuestCart):
+            response = Response(PricedCartSerializer(price_guest_cart(cart), context=serializer.context).data)
+            response[TOKEN_HEADER] = cart.token
+            return response
+        return Response(PricedCartSerializer(price_cart(cart), context=serializer.context).data)
+
+
+class CartItemAddAPIView(GuestCartMergeMixin, generics.CreateAPIView):
     serializer_class = CartItemCreateUpdateSerializer
     permission_classes = [permissions.IsAuthenticated]
 
@@ -107,7 +210,7 @@ class CartItemAddAPIView(generics.CreateAPIView):
         return CartItem.objects.filter(cart__user=self.request.user)
 
 
-class CartItemUpdateAPIView(generics.UpdateAPIView):
+class CartItemUpdateAPIView(GuestCartMergeMixin, generics.UpdateAPIView):
     queryset = CartItem.objects.all()
     serializer_class = CartItemCreateUpdateSerializer
     permission_classes = [permissions.IsAuthenticated]
@@ -121,7 +224,7 @@ class CartItemUpdateAPIView(generics.UpdateAPIView):
         return CartItem.objects.filter(cart__user=self.request.user)
 
 
-class CartItemDeleteAPIView(generics.DestroyAPIView):
+class CartItemDeleteAPIView(GuestCartMergeMixin, generics.DestroyAPIView):
     queryset = CartItem.objects.all()
     permission_classes = [permissions.IsAuthenticated]
 
@@ -134,4 +237,14 @@ class CartItemDeleteAPIView(generics.DestroyAPIView):
         return CartItem.objects.filter(cart__user=self.request.user)
 
 
-
+class ProductExportAPIView(ExportAPIView):
+    """The whole catalog as CSV or NDJSON (`?format=`), filtered as the product list is."""
+    queryset = Product.objects.all()
+    filterset_class = ProductExportFilter
+    filename = 'products'
+    columns = [
+        ('id', 'pk'), ('name', 'name'), ('brand', 'brand'), ('category_id', 'category_id'),
+        ('category', 'category__name'), ('price', 'price'), ('effective_price', 'effective_price'),
+        ('amount', 'amount'), ('is_available', 'is_available'), ('rating', 'rating'),
+        ('rating_count', 'rating_count'), ('created_at', 'created_at'),
+    ]
@@ -3,6 +3,6 @@ from rest_framework import permissions
 
 class IsAdmin(permissions.BasePermission):
     def has_permission(self, request, view):
-        if request.user.role == "admin" and request.user.is_authenticated:
+        if request.user.is_authenticated and request.user.role == "admin":
             return True
         return False
\ No newline at end of file